@@ -2,25 +2,59 @@ import pandas as pd
 import numpy as np
 from scipy.signal import find_peaks
 import datetime
-from tariff import Tariff
+from itertools import repeat
+from tariff_calendar import get_tariff
+
+STATS_TARIFF_ID = 'pge'
+
+
+def get_periods(target_set):
+    # Period labels of every target from a single pass over all intervals
+    timestamps = target_set[0].index.append(
+        [target.index for target in target_set[1:]])
+    frame = pd.DataFrame({'timestamp': timestamps}, index=timestamps)
+    periods = get_tariff(STATS_TARIFF_ID).apply_period(
+        load=frame)['period'].values
+    bounds = np.cumsum([0] + [len(target) for target in target_set])
+    return [periods[start:stop]
+            for start, stop in zip(bounds[:-1], bounds[1:])]
 
 
 def collect_stats(site, target_set, peaks=True, intervals=False,
                   max_baseline=False):
     stat_set = []
-    max_peak = max([max(t['soc']) for t in target_set])
-    for target in target_set:
-        tariff = Tariff('pge')
-        target = tariff.apply_period(load=target)
+    max_peak = max([target['soc'].to_numpy().max() for target in target_set])
+    periods = get_periods(target_set) if max_baseline else repeat(None)
+    for target, period in zip(target_set, periods):
         stat_set.append(
             get_target_stats(site, target, peaks=peaks, intervals=intervals,
                              max_baseline=max_baseline,
-                             max_peak=max_peak))
+                             max_peak=max_peak, period=period))
     return stat_set
 
 
+def iter_stats(site, targets, peaks=True, intervals=False,
+               max_baseline=False, max_peak=None):
+    """
+    Stats of targets, one stat dict per target as it arrives.
+
+    The interval stats threshold on max_peak, the SOC peak of the whole
+    target set, which a stream can't know up front. Without it every
+    target is thresholded on its own SOC peak.
+
+    :param str site: Store name
+    :param targets: Iterable of target DataFrames
+    :param float max_peak: SOC peak of the whole target set
+    :return: Generator of stat dicts
+    """
+    for target in targets:
+        yield get_target_stats(site, target, peaks=peaks,
+                               intervals=intervals,
+                               max_baseline=max_baseline, max_peak=max_peak)
+
+
 def get_target_stats(site, target, peaks=True, intervals=False,
-                     max_baseline=False, max_peak=None):
+                     max_baseline=False, max_peak=None, period=None):
     target_stats = {
         'site': site,
         **feature_base_stats(target, 'temperature')
@@ -33,128 +67,132 @@ def get_target_stats(site, target, peaks=True, intervals=False,
                         **interval_stats(target, max_peak=max_peak)}
     if max_baseline:
         target_stats = {**target_stats,
-                        **max_baseline_stats(target)}
+                        **max_baseline_stats(target, period=period)}
     return target_stats
 
 
 def feature_base_stats(target, feature):
+    values = target[feature].to_numpy()
     return {
-        f'{feature}_max': max(target[feature]),
-        f'{feature}_min': min(target[feature]),
-        f'{feature}_avg': sum(target[feature]) / len(target[feature]),
-        f'{feature}_range': (max(target[feature]) - min(target[feature]))
+        f'{feature}_max': values.max(),
+        f'{feature}_min': values.min(),
+        f'{feature}_avg': values.sum() / len(values),
+        f'{feature}_range': values.max() - values.min()
     }
 
 
 def find_target_peaks(target, prominence=10, distance=12, width=8,
                       height=None,
                       height_factor=0.3):
-    soc = target['soc']
-
-    # for timestamp, interval in target.iterrows():
-    # print(interval)
+    soc = np.asarray(target['soc'])
 
     if not height:
-        height = max(soc) * height_factor
+        height = soc.max() * height_factor
     peaks, properties = find_peaks(soc, prominence=prominence,
                                    distance=distance, width=width,
                                    height=height)
     return peaks, properties
 
 
+def _bases(properties):
+    # Interleaved (left, right) base indices for ufunc.reduceat
+    return np.ravel([properties['left_bases'], properties['right_bases']],
+                    order='F')
+
+
 def peak_stats(target, max_peak=None):
-    soc = target['soc']
-    old_power = target['baseline']
-    new_power = target['load_values']
+    soc = target['soc'].to_numpy()
+    old_power = target['baseline'].to_numpy()
+    new_power = target['load_values'].to_numpy()
+    charge_limits = target['charge_limits'].to_numpy()
+    discharge_limits = target['discharge_limits'].to_numpy()
+    offsets = target['offsets'].to_numpy()
+    index = target.index
 
     height_threshold = (max_peak * 0.0) if max_peak else None
-    peaks, properties = find_target_peaks(target, height=height_threshold)
+    peaks, properties = find_target_peaks({'soc': soc},
+                                          height=height_threshold)
+    if not len(peaks):
+        return {'peaks': []}
+
+    left_bases = properties['left_bases']
+    right_bases = properties['right_bases']
+    bases = _bases(properties)
+    max_old_loads = np.maximum.reduceat(old_power, bases)[::2]
+    max_new_loads = np.maximum.reduceat(new_power, bases)[::2]
+    peak_aucs = np.add.reduceat(soc, bases)[::2]
+    offset_normalized = offsets[peaks] / discharge_limits[peaks]
 
     peak_results = []
     for i, p in enumerate(peaks):
-        left_base = properties['left_bases'][i]
-        right_base = properties['right_bases'][i]
-        max_old_load = max(old_power.iloc[left_base:right_base])
-        max_new_load = max(new_power.iloc[left_base:right_base])
-        peak_charge_limit = target['charge_limits'].iloc[p]
-        peak_discharge_limit = target['discharge_limits'].iloc[p]
-        offset = target['offsets'].iloc[p]
-        offset_normalized = offset / peak_discharge_limit
-        peak_vals = soc.iloc[left_base:right_base]
-        peak_auc = sum(peak_vals)
         peak = {
-            'peak_soc': soc.iloc[p],
-            'peak_soc_time': target.iloc[p].name,
-            'charge_start_time': target.iloc[left_base].name,
-            'discharge_end_time': target.iloc[right_base].name,
-            'charge_limit': peak_charge_limit,
-            'discharge_limit': peak_discharge_limit,
-            'offset': offset,
-            'offset_normalized': offset_normalized,
-            'peak_soc_auc': peak_auc,
-            'baseline_peak_load': max_old_load,
-            'target_peak_load': max_new_load,
+            'peak_soc': soc[p],
+            'peak_soc_time': index[p],
+            'charge_start_time': index[left_bases[i]],
+            'discharge_end_time': index[right_bases[i]],
+            'charge_limit': charge_limits[p],
+            'discharge_limit': discharge_limits[p],
+            'offset': offsets[p],
+            'offset_normalized': offset_normalized[i],
+            'peak_soc_auc': peak_aucs[i],
+            'baseline_peak_load': max_old_loads[i],
+            'target_peak_load': max_new_loads[i],
         }
         peak_results.append(peak)
 
     return {'peaks': peak_results}
 
 
-def max_baseline_stats(target):
-    if 'On-Peak' in target['period'].unique():
-        on_peak_target = target[target['period'] == 'On-Peak']
+def _interval(target, position):
+    row = {column: target[column].to_numpy()[position]
+           for column in ('baseline', 'load_values', 'soc', 'charge_limits',
+                          'discharge_limits', 'offsets', 'temperature')}
+    return {
+        'timestamp': target.index[position],
+        'baseline_load': row['baseline'],
+        'target_load': row['load_values'],
+        'soc': row['soc'],
+        'charge_limit': row['charge_limits'],
+        'discharge_limit': row['discharge_limits'],
+        'offset': row['offsets'],
+        'offset_normalized': row['offsets'] / row['discharge_limits'],
+        'temperature': row['temperature'],
+    }
+
+
+def max_baseline_stats(target, period=None):
+    if period is None:
+        period = get_periods([target])[0]
+    baseline = target['baseline'].to_numpy()
+
+    on_peak = period == 'On-Peak'
+    if on_peak.any():
+        positions = np.flatnonzero(on_peak)
+        position = positions[np.argmax(baseline[positions])]
     else:
-        on_peak_target = target
-    interval = on_peak_target.loc[on_peak_target['baseline'].idxmax()]
-    if not interval['offsets'] and not interval['soc']:
-        return {'intervals': []}
+        position = np.argmax(baseline)
 
-    inter = {
-        'timestamp': interval.name,
-        'baseline_load': interval['baseline'],
-        'target_load': interval['load_values'],
-        'soc': interval['soc'],
-        'charge_limit': interval['charge_limits'],
-        'discharge_limit': interval['discharge_limits'],
-        'offset': interval['offsets'],
-        'offset_normalized': interval['offsets'] / interval[
-            'discharge_limits'],
-        'temperature': interval['temperature'],
-        'period': interval['period']
-    }
+    if not target['offsets'].to_numpy()[position] and \
+            not target['soc'].to_numpy()[position]:
+        return {'intervals': []}
 
+    inter = {**_interval(target, position), 'period': period[position]}
     return {'intervals': [inter]}
 
 
 def interval_stats(target, max_peak=None):
     height_threshold = (max_peak * 0.2) if max_peak else None
     peaks, properties = find_target_peaks(target, height=height_threshold)
-    max_interval_timestamp = target.loc[target['baseline'].idxmax()].name
-    interval_results = []
-    for i, p in enumerate(peaks):
-        left_base = properties['left_bases'][i]
-        right_base = properties['right_bases'][i]
-        target_period = target.iloc[left_base:right_base]
-        for timestamp, interval in target_period.iterrows():
-            if timestamp != max_interval_timestamp:
-                continue
-            if not interval['discharge_limits']:
-                continue
-
-            inter = {
-                'timestamp': timestamp,
-                'baseline_load': interval['baseline'],
-                'target_load': interval['baseline'],
-                'soc': interval['soc'],
-                'charge_limit': interval['charge_limits'],
-                'discharge_limit': interval['discharge_limits'],
-                'offset': interval['offsets'],
-                'offset_normalized': interval['offsets'] / interval[
-                    'discharge_limits'],
-                'temperature': interval['temperature']
-            }
-            interval_results.append(inter)
-    return {'intervals': interval_results}
+    position = np.argmax(target['baseline'].to_numpy())
+    if not target['discharge_limits'].to_numpy()[position]:
+        return {'intervals': []}
+
+    # Every peak window holding the max baseline interval reports it
+    holding = np.count_nonzero((properties['left_bases'] <= position) &
+                               (position < properties['right_bases']))
+    inter = _interval(target, position)
+    inter['target_load'] = inter['baseline_load']
+    return {'intervals': [dict(inter) for _ in range(holding)]}
 
 
 def flatten_stat_data(stats, timestamp_to_min=True, by='peaks'):
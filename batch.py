@@ -0,0 +1,173 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat, tee
+import pandas as pd
+import config
+import load
+import savings
+import analyze
+from metrics import MetricsRecorder
+
+INPUT_PATH = 'input/'
+CONFIG_FILES = {
+    'WF': 'input/WF_LTSB_mass_and_SST.csv',
+    'WM': 'input/WM_LTSB_mass_and_SST_new.csv',
+}
+DEFAULT_START = "2018-06-01 00:00:00-07"
+DEFAULT_END = "2019-05-31 23:45:00-07"
+
+
+def find_power_file(site, path=INPUT_PATH):
+    """
+    Find the power data file of a site in the input directory, the first
+    file whose name contains the store name.
+
+    :param str site: Store name, e.g. WM3138
+    :param str path: Directory holding the site power files
+    :return: Path of the power file or None if the site has no data
+    """
+    for file_name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, file_name)
+        if os.path.isfile(file_path) and site in file_name:
+            return file_path
+    return None
+
+
+def find_config_file(site):
+    """
+    Pick the LT mass/SST config file matching the site prefix.
+
+    :param str site: Store name, e.g. WM3138
+    :return: Path of the config file or None if the prefix is unknown
+    """
+    return CONFIG_FILES.get(site[:2])
+
+
+def get_config_stores(config_files=None):
+    """
+    List every store of the LT mass/SST config files.
+
+    :param config_files: Config files to read, all known files by default
+    :return: List of store names
+    """
+    if config_files is None:
+        config_files = CONFIG_FILES.values()
+    stores = []
+    for config_file in config_files:
+        stores.extend(config.get_lt_config(config_file).Store)
+    return stores
+
+
+def run_site(site, start=DEFAULT_START, end=DEFAULT_END,
+             optimize_energy=False, workers=1, path=INPUT_PATH):
+    """
+    Run load, optimize, stats and savings for a single site.
+
+    :param str site: Store name, e.g. WM3138
+    :param str start: Start time of data to analyze
+    :param str end: End time of data to analyze
+    :param bool optimize_energy: Include energy charges in the objective
+    :param int workers: Number of processes solving the site windows
+    :param str path: Directory holding the site power files
+    :return: Savings, stats and metrics DataFrames, None if the site can't
+        be run
+    """
+    power_file = find_power_file(site, path)
+    config_file = find_config_file(site)
+    if power_file is None or config_file is None:
+        print(f"Can't find power data or config file for {site}")
+        return None
+
+    print(f'Running site {site}')
+    power_data, master_conf = load.load_data(site, start, end, power_file,
+                                             config_file)
+    master_conf['optimize_energy'] = optimize_energy
+    master_conf['workers'] = workers
+
+    # Stats & savings consume every month as it is solved, no targets are
+    # held once both are computed
+    metrics = MetricsRecorder()
+    stat_targets, savings_targets = tee(
+        load.iter_targets(power_data, master_conf, 'month', metrics=metrics))
+    stats, rows = [], []
+    for stat, row in zip(
+            analyze.iter_stats(site, stat_targets, max_baseline=True),
+            savings.iter_savings_rows(savings_targets, master_conf)):
+        stats.append(stat)
+        rows.append(row)
+
+    stats = pd.DataFrame(analyze.flatten_stat_data(stats,
+                                                   timestamp_to_min=False,
+                                                   by='intervals'))
+
+    savings_table = pd.DataFrame(rows, columns=savings.SAVINGS_COLUMNS)
+    savings_table.insert(0, 'site', site)
+
+    metrics_table = metrics.to_frame()
+    metrics_table.insert(0, 'site', site)
+
+    return savings_table, stats, metrics_table
+
+
+def run_batch(sites=None, start=DEFAULT_START, end=DEFAULT_END,
+              optimize_energy=False, workers=1, path=INPUT_PATH):
+    """
+    Run the whole pipeline for many sites concurrently.
+
+    Sites are scheduled across a pool of processes, the windows of each
+    site are solved serially inside its process.
+
+    :param list sites: Store names, every store with power data by default
+    :param str start: Start time of data to analyze
+    :param str end: End time of data to analyze
+    :param bool optimize_energy: Include energy charges in the objective
+    :param int workers: Number of sites run in parallel
+    :param str path: Directory holding the site power files
+    :return: Consolidated savings, stats and metrics DataFrames of all sites
+    """
+    if sites is None:
+        sites = [site for site in get_config_stores()
+                 if find_power_file(site, path)]
+
+    args = (sites, repeat(start), repeat(end), repeat(optimize_energy),
+            repeat(1), repeat(path))
+    if workers > 1 and len(sites) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_site, *args))
+    else:
+        results = list(map(run_site, *args))
+
+    results = [result for result in results if result is not None]
+    if not results:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    return tuple(pd.concat(tables, ignore_index=True)
+                 for tables in zip(*results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the LT setback optimization for many sites')
+    parser.add_argument('sites', nargs='*',
+                        help='Stores to run, every store with data if empty')
+    parser.add_argument('--start', default=DEFAULT_START)
+    parser.add_argument('--end', default=DEFAULT_END)
+    parser.add_argument('--optimize-energy', action='store_true')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--input', default=INPUT_PATH)
+    parser.add_argument('--output', default='output/')
+    args = parser.parse_args()
+
+    savings_table, stats_table, metrics_table = run_batch(
+        args.sites or None, start=args.start, end=args.end,
+        optimize_energy=args.optimize_energy, workers=args.workers,
+        path=args.input)
+
+    os.makedirs(args.output, exist_ok=True)
+    savings_table.to_csv(os.path.join(args.output, 'savings.csv'),
+                         index=False)
+    stats_table.to_csv(os.path.join(args.output, 'stats.csv'), index=False)
+    metrics_table.to_csv(os.path.join(args.output, 'metrics.csv'),
+                         index=False)
+    print(savings_table)
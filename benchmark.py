@@ -0,0 +1,337 @@
+"""
+This module benchmarks the optimization pipeline on synthetic sites. Sites
+are generated with the columns of the input power files and every stage of
+a single Optimizer.solve (build, solve, extract) and of the iterative run
+(optimize, billing, stats) is timed for 1-day to 1-year horizons. Solver
+backends can also be compared on the same windows. Results are saved as CSV
+& JSON rows so runs can be compared over time.
+
+"""
+# System imports
+import os
+import json
+import time
+import platform
+import argparse
+import contextlib
+import io
+
+# 3rd party imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+import config
+import util
+import analyze
+import billing
+import thermal
+from periods import period_codes
+from iterative_optimizer import OPTIMIZERS, run_iterative_optimizer
+from solvers import SOLVERS
+
+# Benchmark horizons in days
+HORIZONS = {
+    '1d': 1,
+    '1w': 7,
+    '1m': 30,
+    '1y': 365,
+}
+SYNTHETIC_START = '2019-01-01 00:00:00'
+TIMEZONE = 'US/Pacific'
+OUTPUT_PATH = 'output/'
+
+
+def synthetic_lt_config(site, seed=0):
+    """
+    LT mass/SST table row of a synthetic site
+
+    :param str site: Synthetic store name
+    :param int seed: Random seed of the site
+    :return DataFrame: LT config table with the single site
+    """
+    rng = np.random.default_rng(seed)
+    mass = round(rng.uniform(30, 65), 2)
+    sst_max = int(rng.integers(-23, -19))
+    return pd.DataFrame({
+        'Store': [site],
+        'SST_min': [sst_max - 20],
+        'SST_max': [sst_max],
+        'mass_total': [mass],
+        'mass_derated': [mass],
+    })
+
+
+def synthetic_power_data(days, seed=0, start=SYNTHETIC_START,
+                         timezone=TIMEZONE):
+    """
+    Power data shaped like the site input files
+
+    Building load and temperature follow daily & seasonal cycles with noise,
+    the CRS load follows the temperature.
+
+    :param int days: Number of days of data
+    :param int seed: Random seed of the site
+    :param str start: Local start time of the data
+    :param str timezone: Timezone of the site
+    :return DataFrame: building_baseline, temperature & crs_baseline
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(pd.Timestamp(start).tz_localize(timezone),
+                               periods=days * 96, freq='15T',
+                               name='timestamp')
+    hours = timestamps.hour + timestamps.minute / 60
+    day_of_year = timestamps.dayofyear.values
+
+    daily = np.sin((hours.values - 9) / 24 * 2 * np.pi)
+    seasonal = -np.cos((day_of_year - 15) / 365 * 2 * np.pi)
+    temperature = 62 + 12 * seasonal + 10 * daily + \
+        rng.normal(0, 1.5, len(timestamps))
+    building = 180 + 60 * np.clip(daily, 0, None) + \
+        0.8 * (temperature - 60) + rng.normal(0, 12, len(timestamps))
+    crs = np.clip(15 + 0.35 * (temperature - 55) +
+                  rng.normal(0, 2, len(timestamps)), 1, None)
+
+    df = pd.DataFrame({
+        'building_baseline': building,
+        'temperature': temperature,
+        'crs_baseline': crs,
+    }, index=timestamps)
+    return df.assign(month=period_codes(timestamps, 'month'),
+                     date=period_codes(timestamps, 'date'),
+                     timestamp=timestamps)
+
+
+def synthetic_site(days, seed=0):
+    """
+    Power data with thermal info and master config of a synthetic site
+
+    :param int days: Number of days of data
+    :param int seed: Random seed of the site
+    :return tuple: Power data & master config, as from load.load_data
+    """
+    site = f'SYN{seed:03d}'
+    power_data = synthetic_power_data(days, seed)
+    master_conf = config.get_master_config(
+        site, power_data.index[0], power_data.index[-1],
+        synthetic_lt_config(site, seed))
+    master_conf['optimizer_config']['MRC'] = \
+        power_data.crs_baseline.max() + 2
+    master_conf['target_cache'] = None
+
+    power_data = util.add_thermal_info(power_data, master_conf)
+    power_data = power_data.drop('crs_baseline', axis=1)
+    return power_data, master_conf
+
+
+def benchmark_solve(power_data, master_conf, engine):
+    """
+    Time a single solve of the whole window by stage
+
+    :param DataFrame power_data: Power data of the window
+    :param dict master_conf: LT Setback Config object
+    :param str engine: Optimizer engine
+    :return dict: build, solve & extract times, status & objective
+    """
+    optimizer_config = dict(master_conf['optimizer_config'])
+    optimizer_config['start'] = power_data.index[0]
+    optimizer_config['end'] = power_data.index[-1]
+    optimizer_config['solver_msg'] = False
+    optimizer_config['sst_line'] = thermal.sst_line(master_conf)
+
+    optimizer = OPTIMIZERS[engine](
+        optimizer_config,
+        optimize_energy=master_conf.get('optimize_energy', True))
+    optimizer.solve(power_data)
+
+    return {
+        'build': optimizer.metrics['build_time'],
+        'solve': optimizer.metrics['solve_time'],
+        'extract': optimizer.metrics['extract_time'],
+        'status': optimizer.status,
+        'objective': optimizer.metrics['objective'],
+    }
+
+
+def benchmark_iterative(power_data, master_conf, engine, period='month'):
+    """
+    Time the iterative run, billing and stats of a site
+
+    :param DataFrame power_data: Power data of the site
+    :param dict master_conf: LT Setback Config object
+    :param str engine: Optimizer engine
+    :param str period: Window of the iterative run, 'month' or 'date'
+    :return dict: optimize, billing & stats times, number of windows
+    """
+    master_conf = {**master_conf, 'engine': engine}
+    times = {}
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        targets = run_iterative_optimizer(
+            power_data.groupby(period, observed=True), master_conf)
+    times['optimize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    billing.calculate_savings(targets, master_conf['site_id'])
+    times['billing'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analyze.collect_stats(master_conf['site'], targets, max_baseline=True)
+    times['stats'] = time.perf_counter() - start
+
+    times['windows'] = len(targets)
+    return times
+
+
+def run_benchmark(horizons=tuple(HORIZONS), engines=('pulp',), sites=1,
+                  optimize_energy=False, iterative=True):
+    """
+    Benchmark every engine on every horizon for a number of sites
+
+    :param horizons: Horizon names of HORIZONS
+    :param engines: Optimizer engines to benchmark
+    :param int sites: Number of synthetic sites
+    :param bool optimize_energy: Include energy charges in the objective
+    :param bool iterative: Also time the iterative run of each site
+    :return DataFrame: One row per engine, horizon, site & stage
+    """
+    rows = []
+    for horizon in horizons:
+        days = HORIZONS[horizon]
+        for seed in range(sites):
+            power_data, master_conf = synthetic_site(days, seed)
+            master_conf['optimize_energy'] = optimize_energy
+            for engine in engines:
+                common = {'engine': engine, 'horizon': horizon,
+                          'site': master_conf['site'],
+                          'intervals': len(power_data)}
+
+                solve = benchmark_solve(power_data, master_conf, engine)
+                status = solve.pop('status')
+                objective = solve.pop('objective')
+                for stage, seconds in solve.items():
+                    rows.append({**common, 'run': 'solve', 'stage': stage,
+                                 'seconds': seconds, 'status': status,
+                                 'objective': objective})
+
+                if iterative:
+                    iterative_times = benchmark_iterative(
+                        power_data, master_conf, engine)
+                    windows = iterative_times.pop('windows')
+                    for stage, seconds in iterative_times.items():
+                        rows.append({**common, 'run': 'iterative',
+                                     'stage': stage, 'seconds': seconds,
+                                     'windows': windows})
+                print(f'Benchmarked {engine} {horizon} '
+                      f'{master_conf["site"]}')
+    return pd.DataFrame(rows)
+
+
+def compare_solvers(power_data, master_conf, solvers=tuple(SOLVERS),
+                    engine='pulp'):
+    """
+    Solve the same window with every solver backend
+
+    Backends that aren't installed are reported without times.
+
+    :param DataFrame power_data: Power data of the window
+    :param dict master_conf: LT Setback Config object
+    :param solvers: Solver backend names of SOLVERS
+    :param str engine: Optimizer engine
+    :return list: build, solve & extract times, status & objective of every
+        backend
+    """
+    rows = []
+    options = dict(master_conf['optimizer_config'].get('solver') or {})
+    options.pop('name', None)
+    for solver in solvers:
+        if not SOLVERS[solver](**options).available():
+            rows.append({'solver': solver, 'status': 'Not Available'})
+            continue
+
+        conf = {**master_conf, 'optimizer_config': {
+            **master_conf['optimizer_config'],
+            'solver': {**options, 'name': solver}}}
+        rows.append({'solver': solver,
+                     **benchmark_solve(power_data, conf, engine)})
+    return rows
+
+
+def run_solver_comparison(horizons=tuple(HORIZONS), solvers=tuple(SOLVERS),
+                          sites=1, optimize_energy=False, engine='pulp'):
+    """
+    Compare the solver backends on every horizon for a number of sites
+
+    :param horizons: Horizon names of HORIZONS
+    :param solvers: Solver backend names of SOLVERS
+    :param int sites: Number of synthetic sites
+    :param bool optimize_energy: Include energy charges in the objective
+    :param str engine: Optimizer engine
+    :return DataFrame: One row per horizon, site & solver
+    """
+    rows = []
+    for horizon in horizons:
+        for seed in range(sites):
+            power_data, master_conf = synthetic_site(HORIZONS[horizon], seed)
+            master_conf['optimize_energy'] = optimize_energy
+            for row in compare_solvers(power_data, master_conf, solvers,
+                                       engine):
+                rows.append({'engine': engine, 'horizon': horizon,
+                             'site': master_conf['site'],
+                             'intervals': len(power_data), **row})
+            print(f'Compared solvers {horizon} {master_conf["site"]}')
+    return pd.DataFrame(rows)
+
+
+def save_results(results, path=OUTPUT_PATH, name='benchmark'):
+    """
+    Save benchmark rows as CSV & as JSON with the environment
+
+    :param DataFrame results: Benchmark rows
+    :param str path: Output directory
+    :param str name: File name without extension
+    """
+    os.makedirs(path, exist_ok=True)
+    results.to_csv(os.path.join(path, f'{name}.csv'), index=False)
+    with open(os.path.join(path, f'{name}.json'), 'w') as f:
+        json.dump({
+            'created': pd.Timestamp.now(tz='UTC').isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'results': json.loads(results.to_json(orient='records')),
+        }, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the LT setback optimization stages')
+    parser.add_argument('--horizons', nargs='+', default=list(HORIZONS),
+                        choices=list(HORIZONS))
+    parser.add_argument('--engines', nargs='+', default=['pulp'],
+                        choices=list(OPTIMIZERS))
+    parser.add_argument('--sites', type=int, default=1)
+    parser.add_argument('--optimize-energy', action='store_true')
+    parser.add_argument('--no-iterative', action='store_true')
+    parser.add_argument('--solvers', nargs='+', choices=list(SOLVERS),
+                        help='Compare solver backends instead')
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    parser.add_argument('--name', default='benchmark')
+    args = parser.parse_args()
+
+    if args.solvers:
+        results = run_solver_comparison(args.horizons, args.solvers,
+                                        args.sites, args.optimize_energy,
+                                        args.engines[0])
+        save_results(results, args.output, args.name)
+        print(results.groupby(['horizon', 'solver'])[
+            ['solve', 'objective']].mean())
+    else:
+        results = run_benchmark(args.horizons, args.engines, args.sites,
+                                args.optimize_energy, not args.no_iterative)
+        save_results(results, args.output, args.name)
+        print(results.pivot_table(index=['engine', 'horizon'],
+                                  columns=['run', 'stage'],
+                                  values='seconds', aggfunc='mean'))
@@ -0,0 +1,220 @@
+"""
+This module holds the grouped billing engine. All targets are stacked into
+one frame with window, season and period codes, and the demand & energy
+bills of the baseline and optimized loads of every window are computed in a
+single grouped pass.
+
+Demand charges are the billing-period peak of every season & period times
+its rate, weighted by the fraction of the window's intervals in that season.
+Energy charges are the energy rate times the interval energy. Run as a
+script, the bills of every site are checked against BillCalculator.
+
+"""
+# System imports
+import sys
+
+# 3rd party imports
+import numpy as np
+import pandas
+from tariff import NON_COINCIDENT
+from tariff.bill_calculator import BillCalculator
+
+# Project imports
+from tariff_calendar import get_tariff, get_tariff_calendar
+
+LOAD_COLUMNS = ('baseline', 'load_values')
+
+# Largest difference in dollars from a BillCalculator bill
+BILL_TOLERANCE = 1e-6
+
+
+def stack_targets(targets, tariff_id):
+    """
+    Stack targets into one frame with window, season & period codes
+
+    :param list targets: Target DataFrames, one per window
+    :param str tariff_id: Tariff id
+    :return DataFrame: Stacked targets with window, season, period &
+        energy_tariff columns
+    """
+    frames = []
+    for num, target in enumerate(targets):
+        calendar = get_tariff_calendar(tariff_id, target.index)
+        frames.append(pandas.DataFrame({
+            'window': num,
+            'season': calendar.season,
+            'period': calendar.period,
+            'energy_tariff': calendar.energy_tariff,
+            **{column: target[column].to_numpy(dtype=float)
+               for column in LOAD_COLUMNS + ('offsets',)
+               if column in target.columns},
+        }))
+    return pandas.concat(frames, ignore_index=True)
+
+
+def get_demand_peaks(frame, columns=LOAD_COLUMNS):
+    """
+    Peaks of every window, season & period, including non-coincident
+
+    :param DataFrame frame: Stacked targets
+    :param columns: Load columns to take the peaks of
+    :return DataFrame: Peaks indexed by window, season & period
+    """
+    columns = list(columns)
+    non_coincident = frame.groupby(['window', 'season'])[columns].max()
+    non_coincident = non_coincident.assign(period=NON_COINCIDENT).set_index(
+        'period', append=True)
+    periods = frame.groupby(['window', 'season', 'period'])[columns].max()
+    return pandas.concat([non_coincident, periods]).sort_index()
+
+
+def calculate_bills(targets, tariff_id, columns=LOAD_COLUMNS):
+    """
+    Demand & energy bills of every window
+
+    :param list targets: Target DataFrames, one per window
+    :param str tariff_id: Tariff id
+    :param columns: Load columns to bill
+    :return DataFrame: <column>_demand & <column>_energy for every window
+    """
+    frame = stack_targets(targets, tariff_id)
+    columns = list(columns)
+
+    # Billed peaks only, weighted by rate & the fraction of the season
+    demand_charges = get_tariff(tariff_id).demand_rates()
+    rates = pandas.Series({
+        (season, period): rate
+        for season in demand_charges
+        for period, rate in demand_charges[season].items()})
+    rates.index.names = ['season', 'period']
+
+    sizes = frame.groupby('window').size()
+    fractions = frame.groupby(['window', 'season']).size().div(
+        sizes, level='window')
+
+    peaks = get_demand_peaks(frame, columns)
+    keys = peaks.index.droplevel('window')
+    billed = keys.isin(rates.index)
+    peaks = peaks[billed]
+    keys = keys[billed]
+    weights = rates.reindex(keys).values * fractions.reindex(
+        peaks.index.droplevel('period')).values
+    demand = peaks.mul(weights, axis=0).groupby(level='window').sum()
+
+    energy = frame[columns].mul(frame['energy_tariff'] / 4, axis=0).groupby(
+        frame['window']).sum()
+
+    bills = pandas.concat([demand.add_suffix('_demand'),
+                           energy.add_suffix('_energy')], axis=1)
+    return bills.reindex(sizes.index, fill_value=0)
+
+
+def calculate_savings(targets, tariff_id):
+    """
+    Demand, energy & total savings, baseline bill and RTE of every window
+
+    :param list targets: Target DataFrames, one per window
+    :param str tariff_id: Tariff id
+    :return DataFrame: Savings of every window
+    """
+    bills = calculate_bills(targets, tariff_id)
+    savings = pandas.DataFrame({
+        'demand_savings': bills['baseline_demand'] -
+        bills['load_values_demand'],
+        'energy_savings': bills['baseline_energy'] -
+        bills['load_values_energy'],
+    })
+    savings['total_savings'] = savings.demand_savings + \
+        savings.energy_savings
+    savings['baseline_bill'] = bills['baseline_demand'] + \
+        bills['baseline_energy']
+
+    offsets = np.concatenate([target['offsets'].to_numpy(dtype=float)
+                              for target in targets])
+    windows = np.repeat(np.arange(len(targets)),
+                        [len(target) for target in targets])
+    dchg = np.bincount(windows, np.where(offsets > 0, offsets, 0),
+                       len(targets))
+    chg = np.bincount(windows, np.where(offsets < 0, offsets, 0),
+                      len(targets))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        savings['rte'] = dchg / -chg
+    return savings
+
+
+def get_demand_reductions(targets, tariff_id):
+    """
+    Demand peak reduction of every window in the season of its first interval
+
+    :param list targets: Target DataFrames, one per window
+    :param str tariff_id: Tariff id
+    :return DataFrame: Reductions by period, one row per window
+    """
+    frame = stack_targets(targets, tariff_id)
+    peaks = get_demand_peaks(frame)
+    reductions = (peaks['baseline'] - peaks['load_values']).unstack('period')
+
+    first_seasons = frame.groupby('window')['season'].first()
+    reductions = reductions.reindex(
+        pandas.MultiIndex.from_arrays([first_seasons.index,
+                                       first_seasons.values]))
+    return reductions.reset_index(level=1, drop=True).fillna(0)
+
+
+def compare_bill_calculator(targets, tariff_id, columns=LOAD_COLUMNS):
+    """
+    Compare the grouped bills of every window against BillCalculator
+
+    :param list targets: Target DataFrames, one per window
+    :param str tariff_id: Tariff id
+    :param columns: Load columns to bill
+    :return DataFrame: Grouped & BillCalculator bills of every window, the
+        largest absolute difference & the seasons and periods billed
+    """
+    bills = calculate_bills(targets, tariff_id, columns)
+    bill_calculator = BillCalculator(tariff_id)
+    frame = stack_targets(targets, tariff_id)
+
+    rows = []
+    for target in targets:
+        target = target.reset_index()
+        row = {}
+        for column in columns:
+            row[f'{column}_demand'] = bill_calculator.calculate_demand_bill(
+                target, load_column=column)
+            row[f'{column}_energy'] = bill_calculator.calculate_energy_bill(
+                target, load_column=column)
+        rows.append(row)
+    reference = pandas.DataFrame(rows, index=bills.index)
+
+    window = frame.groupby('window')
+    comparison = bills.join(reference, rsuffix='_reference')
+    comparison['difference'] = (bills - reference[bills.columns]).abs().max(
+        axis=1)
+    comparison['seasons'] = window['season'].nunique()
+    comparison['periods'] = window['period'].nunique()
+    return comparison
+
+
+if __name__ == '__main__':
+    import batch
+    import load
+    from iterative_optimizer import run_iterative_optimizer
+
+    sites = sys.argv[1:] or [site for site in batch.get_config_stores()
+                             if batch.find_power_file(site)]
+    comparisons = []
+    for site in sites:
+        power_data, master_conf = load.load_data(
+            site, batch.DEFAULT_START, batch.DEFAULT_END,
+            batch.find_power_file(site), batch.find_config_file(site))
+        targets = run_iterative_optimizer(
+            power_data.groupby('month', observed=True), master_conf)
+        comparison = compare_bill_calculator(
+            targets, master_conf['optimizer_config']['site_id'])
+        comparisons.append(comparison.assign(site=site))
+
+    comparisons = pandas.concat(comparisons, ignore_index=True)
+    print(comparisons[['site', 'seasons', 'periods', 'difference']])
+    if (comparisons['difference'] > BILL_TOLERANCE).any():
+        sys.exit('Grouped bills differ from BillCalculator')
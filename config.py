@@ -3,6 +3,7 @@ from functools import partial
 
 from optimizer_engine.cop import farenheit_to_celsius
 from util import master_cop_eq
+from convergence import DEFAULT_MAX_ITERATIONS, DEFAULT_TOLERANCE
 
 
 def get_master_config(site, start, end, lt_config_file):
@@ -15,9 +16,6 @@ def get_master_config(site, start, end, lt_config_file):
     lt_capacity = lt_conf.loc[lt_conf.Store == site]['mass_derated'].iloc[0]
     sst_max_f = lt_conf.loc[lt_conf.Store == site]['SST_max'].iloc[0]
     sst_min_f = lt_conf.loc[lt_conf.Store == site]['SST_min'].iloc[0]
-    sst_mid_f = (sst_max_f + sst_min_f) / 2
-    cop_mid_sst = partial(master_cop_eq, farenheit_to_celsius(sst_mid_f))
-    cop_max_sst = partial(master_cop_eq, farenheit_to_celsius(sst_max_f))
     master = {
         'site': site,
         'site_id': site_id,
@@ -27,14 +25,45 @@ def get_master_config(site, start, end, lt_config_file):
                                                  lt_capacity),
         'lt_config': lt_conf.loc[lt_conf.Store == site].to_dict(),
         'lt_capacity': lt_capacity,
+        **get_sst_config(sst_min_f, sst_max_f),
+        'sst_factor': 0.15,
+        # Optimizer engine, 'pulp', 'matrix', 'peak' or 'coupled'
+        'engine': 'pulp',
+        # Charge COP iteration: stop once no charging interval's COP changes
+        # by more than 'tolerance', apply 'damping' of every COP change (1 for
+        # none) or Anderson acceleration over 'anderson' previous iterations
+        # (0 for none). None stops on the change in savings instead
+        'convergence': {
+            'tolerance': DEFAULT_TOLERANCE,
+            'damping': 1.0,
+            'anderson': 0,
+            'max_iterations': DEFAULT_MAX_ITERATIONS,
+        },
+        # Patch & warm start the built model on every COP iteration
+        'reuse_model': True,
+        # Number of processes solving windows in parallel
+        'workers': 1,
+        # Lookahead 'horizon' & 'commit' lengths in intervals, e.g.
+        # {'horizon': 192, 'commit': 96}, or None to solve windows at once
+        'rolling_horizon': None,
+        # Directory of stored window targets, or None to always re-solve
+        'target_cache': '.target_cache/',
+        # Float type of stored target columns, 'float32' halves the memory
+        'target_dtype': 'float64',
+    }
+    return master
+
+
+def get_sst_config(sst_min_f, sst_max_f):
+    # SST range of the site & the COP curves at its mid & max SST
+    sst_mid_f = (sst_max_f + sst_min_f) / 2
+    return {
         'sst_max_f': sst_max_f,
         'sst_mid_f': sst_mid_f,
         'sst_min_f': sst_min_f,
-        'cop_mid_sst': cop_mid_sst,
-        'cop_max_sst': cop_max_sst,
-        'sst_factor': 0.15,
+        'cop_mid_sst': partial(master_cop_eq, farenheit_to_celsius(sst_mid_f)),
+        'cop_max_sst': partial(master_cop_eq, farenheit_to_celsius(sst_max_f)),
     }
-    return master
 
 
 def get_optimizer_config(site_id, start, end, lt_capacity):
@@ -53,6 +82,20 @@ def get_optimizer_config(site_id, start, end, lt_capacity):
         "SOC_initial": 0,
         "cop_dchg_coefficients": [0],  # Already provided in timeseries data
         "cop_chg_coefficients": [0],  # Already provided in timeseries data
+        "selector_elimination": True,
+        "verify_selector_free": False,
+        # SOC breakpoints (fractions of the SOC range) of the coupled charge
+        # COP envelope, every extra breakpoint adds a binary per interval
+        "cop_soc_breakpoints": [0, 0.5, 1],
+        # Solver backend ('cbc', 'glpk' or 'highs', None for the engine
+        # default: CBC, HiGHS for the matrix engine), threads, time limit in
+        # seconds & relative MIP gap
+        "solver": {
+            "name": None,
+            "threads": None,
+            "time_limit": 120,
+            "mip_gap": None
+        },
         "constraints": {
             "time_transition": False,
             "minimum_charge_offset": False,
@@ -78,5 +121,8 @@ def get_optimizer_config(site_id, start, end, lt_capacity):
 
 
 def get_lt_config(config_file):
+    # Synthetic sites pass their LT mass/SST table directly
+    if isinstance(config_file, pd.DataFrame):
+        return config_file
     config_lt = pd.read_csv(config_file)
     return config_lt
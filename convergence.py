@@ -0,0 +1,194 @@
+"""
+This module holds the convergence policies of the charge COP iteration of
+every window. The COP policy compares the charge COP's a solve was made with
+against the COP's at its solved SOC and stops once no charging interval
+changes by more than a tolerance, without any billing. The COP of an
+interval without charge offset doesn't enter the SOC balance, so the solve
+is then consistent with its own SOC. The next COP's are the solved
+ones, optionally damped or extrapolated by Anderson acceleration. The
+savings policy keeps the original stop on the change in savings.
+
+"""
+# System imports
+from collections import deque
+
+# 3rd party imports
+import numpy as np
+
+# Project imports
+from billing import calculate_savings
+from metrics import timed
+from thermal import get_sst, get_charge_cop
+
+DEFAULT_MAX_ITERATIONS = 10
+
+# Largest charge COP change of a converged iteration. At 0.1 the savings stay
+# within 0.3% of the savings stop, tighter tolerances mostly run into the
+# iteration limit for under $0.2/month
+DEFAULT_TOLERANCE = 0.1
+
+# Smallest charge offset (kW) of a charging interval
+CHARGE_EPSILON = 1e-6
+
+
+class SavingsPolicy:
+    """Stop once the savings of the window stop changing
+
+    Attributes:
+        tariff_id (str): Tariff id of the bills
+        max_iterations (int): Iteration limit of a window
+        previous_total_savings (float): Savings of the previous iteration
+        previous_diff (float): Change in savings of the previous iteration
+    """
+
+    def __init__(self, tariff_id, max_iterations=DEFAULT_MAX_ITERATIONS):
+        """
+        Initialize the SavingsPolicy object.
+
+        :param str tariff_id: Tariff id of the bills
+        :param int max_iterations: Iteration limit of a window
+        """
+        self.tariff_id = tariff_id
+        self.max_iterations = max_iterations
+        self.previous_total_savings = 0
+        self.previous_diff = 0
+
+    def step(self, cop_in, cop_out, target, record):
+        """
+        Check an iteration for convergence
+
+        :param cop_in: Charge COP's the window was solved with
+        :param cop_out: Charge COP's at the solved SOC
+        :param DataFrame target: Target of the iteration
+        :param dict record: Metrics record of the iteration, updated
+        :return: Charge COP's of the next iteration, None once converged
+        """
+        with timed(record, 'billing_time'):
+            savings = calculate_savings([target], self.tariff_id)
+        total_savings = savings.total_savings.iloc[0]
+        savings_diff = abs(total_savings - self.previous_total_savings)
+        record.update(total_savings=total_savings, savings_diff=savings_diff)
+
+        if savings_diff < 10 or abs(savings_diff - self.previous_diff) < 1:
+            return None
+
+        self.previous_total_savings = total_savings
+        self.previous_diff = savings_diff
+        return np.asarray(cop_out, dtype=float)
+
+    def log(self, record):
+        """Log lines of an iteration record"""
+        return ["Total Savings {}".format(record['total_savings']),
+                "Delta in savings {}".format(record['savings_diff'])]
+
+
+class CopPolicy:
+    """Stop once the charge COP of every interval is consistent with the
+    solved SOC
+
+    Attributes:
+        tolerance (float): Largest COP change of a charging interval in a
+            converged iteration
+        damping (float): Fraction of the COP change applied, 1 for none
+        anderson (int): Previous iterations used by Anderson acceleration,
+            0 to disable it
+        max_iterations (int): Iteration limit of a window
+        bounds (tuple): Lowest & highest charge COP of every interval
+        inputs (deque): Charge COP's the recent iterations were solved with
+        outputs (deque): Charge COP's at the SOC of the recent iterations
+    """
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, damping=1.0, anderson=0,
+                 max_iterations=DEFAULT_MAX_ITERATIONS, bounds=None):
+        """
+        Initialize the CopPolicy object.
+
+        :param float tolerance: Largest COP change of a charging interval in
+            a converged iteration
+        :param float damping: Fraction of the COP change applied, 1 for none
+        :param int anderson: Previous iterations used by Anderson
+            acceleration, 0 to disable it
+        :param int max_iterations: Iteration limit of a window
+        :param tuple bounds: Lowest & highest charge COP of every interval
+        """
+        if not 0 < damping <= 1:
+            raise ValueError('Convergence "damping" must be in (0, 1]')
+        self.tolerance = tolerance
+        self.damping = damping
+        self.anderson = anderson
+        self.max_iterations = max_iterations
+        self.bounds = bounds
+        self.inputs = deque(maxlen=anderson + 1)
+        self.outputs = deque(maxlen=anderson + 1)
+
+    def step(self, cop_in, cop_out, target, record):
+        """
+        Check an iteration for convergence
+
+        :param cop_in: Charge COP's the window was solved with
+        :param cop_out: Charge COP's at the solved SOC
+        :param DataFrame target: Target of the iteration
+        :param dict record: Metrics record of the iteration, updated
+        :return: Charge COP's of the next iteration, None once converged
+        """
+        cop_in = np.asarray(cop_in, dtype=float)
+        cop_out = np.asarray(cop_out, dtype=float)
+        residual = cop_out - cop_in
+        charging = target['offsets'].to_numpy(dtype=float) < -CHARGE_EPSILON
+        cop_delta = float(np.abs(residual[charging]).max()) \
+            if charging.any() else 0.0
+        record['cop_delta'] = cop_delta
+        if cop_delta < self.tolerance:
+            return None
+
+        self.inputs.append(cop_in)
+        self.outputs.append(cop_out)
+        if len(self.inputs) < 2:
+            cop_next = cop_in + self.damping * residual
+        else:
+            cop_next = self._anderson()
+
+        if self.bounds is not None:
+            cop_next = np.clip(cop_next, *self.bounds)
+        return cop_next
+
+    def _anderson(self):
+        """
+        Anderson extrapolation of the next charge COP's from the recent
+        iterations
+
+        :return ndarray: Charge COP's of the next iteration
+        """
+        inputs = np.array(self.inputs)
+        outputs = np.array(self.outputs)
+        residuals = outputs - inputs
+
+        # Mix of the recent iterations with the smallest residual
+        residual_diffs = np.diff(residuals, axis=0).T
+        output_diffs = np.diff(outputs, axis=0).T
+        gamma = np.linalg.lstsq(residual_diffs, residuals[-1], rcond=None)[0]
+        residual = residuals[-1] - residual_diffs @ gamma
+        return (outputs[-1] - output_diffs @ gamma -
+                (1 - self.damping) * residual)
+
+    def log(self, record):
+        """Log lines of an iteration record"""
+        return ["Max COP change {}".format(record['cop_delta'])]
+
+
+def get_policy(config, oat_c):
+    """
+    Build the convergence policy of a window
+
+    :param dict config: LT Setback Config object
+    :param oat_c: OAT of every interval of the window in C
+    :return: CopPolicy, or SavingsPolicy without a "convergence" config
+    """
+    settings = config.get('convergence')
+    if settings is None:
+        return SavingsPolicy(config['optimizer_config']['site_id'])
+
+    # Charge COP's of a full & an empty tank
+    bounds = (get_charge_cop(get_sst(config['lt_capacity'], config), oat_c),
+              get_charge_cop(get_sst(0, config), oat_c))
+    return CopPolicy(bounds=bounds, **settings)
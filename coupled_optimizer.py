@@ -0,0 +1,271 @@
+"""
+This module holds an optimizer mode with the SST dependent charge COP inside
+the model. The charge COP is linear in SST, and SST is linear in SOC, so the
+thermal energy of a charge offset is (cop_slope * SOC + cop_base) * offset.
+The SOC * charge offset product is replaced by its McCormick envelope over
+segments of the SOC range, so every window is solved once instead of
+iterating the charge COP on the SOC of the previous solution.
+
+"""
+# 3rd party imports
+import numpy as np
+import pandas
+import pulp
+
+# Project imports
+from lt_optimizer import Optimizer
+from thermal import COP_SST_COEFFICIENT, master_cop_eq, to_celsius
+
+
+class CoupledOptimizer(Optimizer):
+    """Solve the LP Minimization with the charge COP coupled to the SOC
+
+    With a single SOC segment the envelope is linear and the model stays a
+    pure LP. Every additional breakpoint tightens the envelope at the cost
+    of a binary segment selector per interval. The largest gap between the
+    charge COP of the envelope and the charge COP at the solved SOC is kept
+    in metrics['cop_error'].
+
+    Attributes:
+        sst_line (tuple): Slope & intercept of the SOC to SST (C) line
+        breakpoints (ndarray): SOC breakpoints of the envelope segments
+        cop_slope (float): Change of the charge COP per kWh of SOC
+        cop_base (ndarray): Charge COP of every interval at zero SOC
+        soc_cof (dict): Decision variable - SOC times charge offset, float
+        segments (dict): Segment selector, SOC, charge offset & product
+            variables, keyed by (time label, segment)
+    """
+
+    def __init__(self, config, optimize_energy=True):
+        """
+        Initialize the CoupledOptimizer object.
+
+        :param dict config: dictionary with input configurations, including
+            the "sst_line" of the site
+        """
+        super().__init__(config, optimize_energy=optimize_energy)
+
+        if 'sst_line' not in config:
+            raise ValueError('The coupled engine needs the "sst_line" of '
+                             'the site')
+        self.sst_line = config['sst_line']
+
+        # Breakpoints as fractions of the SOC range
+        fractions = np.asarray(config.get('cop_soc_breakpoints',
+                                          [0, 0.5, 1]), dtype=float)
+        if (len(fractions) < 2 or fractions[0] != 0 or fractions[-1] != 1 or
+                np.any(np.diff(fractions) <= 0)):
+            raise ValueError('"cop_soc_breakpoints" must increase from 0 '
+                             'to 1')
+        self.breakpoints = self.rb_min_soc + fractions * (
+            self.rb_capacity - self.rb_min_soc)
+
+        self.cop_slope = COP_SST_COEFFICIENT * self.sst_line[0]
+        self.cop_base = None
+        self.soc_cof = {}
+        self.segments = {}
+
+    def _prepare_inputs(self, df, temperature_column='temperature',
+                        **kwargs):
+        """
+        Derive the time series parameters of the RB model and the charge
+        COP at zero SOC
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str temperature_column: Name of air temperature column
+        :param kwargs: Column names of Optimizer._prepare_inputs
+        """
+        super()._prepare_inputs(df, temperature_column=temperature_column,
+                                **kwargs)
+        oat_c = to_celsius(df[temperature_column].to_numpy(dtype=float))
+        self.cop_base = master_cop_eq(self.sst_line[1], oat_c)
+
+    def _is_selector_free(self):
+        """
+        Check whether simultaneous charge & discharge offsets can pay off,
+        for every charge COP between an empty and a full tank
+
+        :return bool: True if the selector variables can be dropped
+        """
+        cop_full = self.cop_base + self.cop_slope * self.rb_capacity
+        cop_empty = self.cop_base + self.cop_slope * self.rb_min_soc
+        cop_dchg = np.asarray(self.cop_dchg, dtype=float)
+        if np.any(np.minimum(cop_full, cop_empty) <= 0) or \
+                np.any(np.maximum(cop_full, cop_empty) > cop_dchg):
+            return False
+        return super()._is_selector_free()
+
+    def _define_decision_variables(self):
+        """
+        Define the decision variables of the Optimizer and of the SOC *
+        charge offset envelope
+        """
+        super()._define_decision_variables()
+
+        # Product terms of the SOC balance intervals
+        labels = self.time_labels[:-1]
+        self.soc_cof = pulp.LpVariable.dicts("SOC_Charge_Offset", labels)
+        self.variables += [self.soc_cof[label] for label in labels]
+
+        self.segments = {}
+        if len(self.breakpoints) > 2:
+            keys = [(label, segment) for label in labels
+                    for segment in range(len(self.breakpoints) - 1)]
+            self.segments = {
+                'selector': pulp.LpVariable.dicts("Segment", keys,
+                                                  cat='Binary'),
+                'soc': pulp.LpVariable.dicts("Segment_SOC", keys,
+                                             lowBound=0),
+                'cof': pulp.LpVariable.dicts("Segment_Charge_Offset", keys,
+                                             lowBound=0),
+                'product': pulp.LpVariable.dicts(
+                    "Segment_SOC_Charge_Offset", keys),
+            }
+            for variables in self.segments.values():
+                self.variables += [variables[key] for key in keys]
+
+    def _add_constraints(self, df, building_power_column='building_baseline'):
+        """
+        Define the constraints of the Optimizer with the charge COP of the
+        SOC balance depending on the SOC
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str building_power_column: Name of building baseline column
+        """
+        super()._add_constraints(
+            df, building_power_column=building_power_column)
+
+        chg_limits = np.maximum(np.asarray(self.chg_limits, dtype=float), 0)
+        for t, label in enumerate(self.time_labels[:-1]):
+            balance = self.soc_balance[label]
+            balance[self.cof[label]] = 0.25 * self.cop_base[t]
+            balance[self.soc_cof[label]] = 0.25 * self.cop_slope
+            self._add_envelope(label, chg_limits[t])
+
+        # The charge limit curve bounds the thermal charge, at the coupled
+        # charge COP of the SOC balance intervals
+        for label, m, b, limit in self.chg_curve_limits:
+            if label in self.soc_cof:
+                t = self.time_labels.index(label)
+                limit[self.cof[label]] = self.cop_base[t]
+                limit[self.soc_cof[label]] = self.cop_slope
+                limit[self.soc[label]] = -m
+                limit.constant = -b
+
+    def _add_envelope(self, label, chg_limit):
+        """
+        Bound the SOC * charge offset product of an interval
+
+        :param str label: Time label of the interval
+        :param float chg_limit: Charge limit of the interval
+        """
+        soc = self.soc[label]
+        cof = self.cof[label]
+        product = self.soc_cof[label]
+        if not self.segments:
+            self._add_mccormick(product, soc, cof, self.breakpoints[0],
+                                self.breakpoints[-1], chg_limit)
+            return
+
+        # The SOC lies in exactly one segment, whose variables carry the SOC,
+        # charge offset & product of the interval
+        keys = [(label, segment)
+                for segment in range(len(self.breakpoints) - 1)]
+        selector = self.segments['selector']
+        segment_soc = self.segments['soc']
+        segment_cof = self.segments['cof']
+        segment_product = self.segments['product']
+
+        self.frame += pulp.lpSum(selector[key] for key in keys) == 1
+        self.frame += soc == pulp.lpSum(segment_soc[key] for key in keys)
+        self.frame += cof == pulp.lpSum(segment_cof[key] for key in keys)
+        self.frame += product == pulp.lpSum(segment_product[key]
+                                            for key in keys)
+
+        for segment, key in enumerate(keys):
+            low = self.breakpoints[segment]
+            high = self.breakpoints[segment + 1]
+            self.frame += segment_soc[key] >= low * selector[key]
+            self.frame += segment_soc[key] <= high * selector[key]
+            self.frame += segment_cof[key] <= chg_limit * selector[key]
+            self._add_mccormick(segment_product[key], segment_soc[key],
+                                segment_cof[key], low, high, chg_limit,
+                                selector[key])
+
+    def _add_mccormick(self, product, soc, cof, low, high, chg_limit,
+                       selector=1):
+        """
+        Add the McCormick envelope of a SOC * charge offset product
+
+        :param product: Product variable
+        :param soc: SOC variable, within [low, high] if selected
+        :param cof: Charge offset variable, within [0, chg_limit] if selected
+        :param float low: Lower SOC bound
+        :param float high: Upper SOC bound
+        :param float chg_limit: Charge offset bound
+        :param selector: Segment selector, all variables are 0 if unselected
+        """
+        self.frame += product >= low * cof
+        self.frame += product >= (high * cof + chg_limit * soc -
+                                  high * chg_limit * selector)
+        self.frame += product <= high * cof
+        self.frame += product <= (low * cof + chg_limit * soc -
+                                  low * chg_limit * selector)
+
+    def _solve_frame(self, warm_start=False):
+        """
+        Solve the optimization frame, a MILP as soon as the envelope has
+        more than one segment
+
+        :param bool warm_start: Start the solver from the current solution
+        """
+        super()._solve_frame(warm_start=warm_start)
+        if self.segments and self.metrics['mip_gap'] == 0.0:
+            self.metrics['mip_gap'] = None
+
+    def update_cop_charge(self, cop_chg):
+        """
+        The charge COP is part of the model, so it's never patched
+
+        :param cop_chg: New charge COP for every interval of the window
+        :return bool: Always False
+        """
+        return False
+
+    def update_capacity(self, capacity, heat_leak):
+        """
+        The envelope breakpoints span the SOC range, so a new capacity
+        needs a new model
+
+        :param float capacity: New RB tank capacity in KWH_thermal
+        :param heat_leak: Heat leak of every interval at the new capacity
+        :return bool: Always False
+        """
+        return False
+
+    def _get_target(self, df, **kwargs):
+        """
+        Construct the target building load, with the charge COP at the
+        solved SOC of every interval
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param kwargs: Column names of Optimizer._get_target
+        :return DataFrame: Target building time series output with offsets
+        """
+        _, cof_values, soc_values = self._get_solution()
+        self.cop_chg = pandas.Series(
+            self.cop_base + self.cop_slope * np.asarray(soc_values),
+            index=self.cop_chg.index)
+
+        # Charge COP of the envelope, on the intervals that charge
+        column = {id(variable): i for i, variable in enumerate(self.variables)}
+        cof_values = np.asarray(cof_values[:-1], dtype=float)
+        products = np.array([self.solution[column[id(self.soc_cof[label])]]
+                             for label in self.time_labels[:-1]])
+        charging = cof_values > 1e-6
+        cop_envelope = self.cop_base[:-1][charging] + self.cop_slope * (
+            products[charging] / cof_values[charging])
+        self.metrics['cop_error'] = float(np.max(
+            np.abs(cop_envelope - self.cop_chg.values[:-1][charging]),
+            initial=0))
+        return super()._get_target(df, **kwargs)
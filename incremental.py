@@ -0,0 +1,145 @@
+"""
+This module holds the incremental refresh of a site's targets. Appended or
+corrected power data only re-optimizes the billing months or dates whose
+rows changed. Rows appended to a billing month are solved as a tail window
+that starts from the SOC and month-to-date peaks of the existing target,
+and the results are merged into the existing target set.
+
+"""
+# System imports
+import copy
+
+# 3rd party imports
+import numpy as np
+import pandas
+
+# Project imports
+from iterative_optimizer import run_iterative_optimizer
+from periods import period_codes
+from rolling_horizon import get_peaks
+from tariff_calendar import get_tariff, get_tariff_calendar
+
+# Length of a power data interval
+INTERVAL = pandas.Timedelta(minutes=15)
+
+# Target columns compared against the power data columns they came from
+COMPARED_COLUMNS = {
+    'baseline': 'building_baseline',
+    'temperature': 'temperature',
+}
+
+
+def _label(target, period):
+    return period_codes(target.index[:1], period)[0]
+
+
+def find_changes(load, target):
+    """
+    Compare a window of power data against its existing target
+
+    :param DataFrame load: Power data of the window
+    :param DataFrame target: Existing target of the window
+    :return str: 'unchanged', 'appended' if rows were only added after the
+        end of the target, or 'changed'
+    """
+    if target is None:
+        return 'changed'
+
+    overlap = load.index.intersection(target.index)
+    if len(overlap) < len(target):
+        return 'changed'
+    for target_column, load_column in COMPARED_COLUMNS.items():
+        if target_column in target.columns and load_column in load.columns:
+            if not np.allclose(target.loc[overlap, target_column].values,
+                               load.loc[overlap, load_column].values,
+                               equal_nan=True):
+                return 'changed'
+
+    if len(overlap) == len(load):
+        return 'unchanged'
+    if load.index[0] == target.index[0] and \
+            load.index[len(overlap) - 1] == target.index[-1]:
+        return 'appended'
+    return 'changed'
+
+
+def _month_to_date_config(target, conf, complete=True):
+    """
+    Build the config of a tail window continuing an existing target
+
+    The tail starts on the last interval of the existing target, whose SOC
+    is the SOC at the start of that interval. The final SOC of the month is
+    only held on a tail that completes the billing month.
+
+    :param DataFrame target: Existing target of the billing month
+    :param dict conf: LT Setback Config object
+    :param bool complete: The tail ends on the last interval of the month
+    :return dict: Config with the initial SOC & month-to-date peaks set
+    """
+    optimizer_config = dict(conf['optimizer_config'])
+    tariff_id = (optimizer_config.get('tariff_id') or
+                 optimizer_config['site_id'])
+
+    peaks = optimizer_config.get('peaks')
+    if not peaks:
+        peaks = copy.deepcopy(get_tariff(tariff_id).demand_rates())
+        for season in peaks:
+            for period in peaks[season]:
+                peaks[season][period] = 0
+
+    committed = target.iloc[:-1]
+    if len(committed):
+        calendar = get_tariff_calendar(tariff_id, committed.index)
+        peaks = get_peaks(committed['load_values'].values, calendar, peaks)
+
+    optimizer_config['SOC_final'] = None
+    if complete:
+        optimizer_config['SOC_final'] = conf['optimizer_config'].get(
+            'SOC_final', optimizer_config['SOC_initial'])
+    optimizer_config['SOC_initial'] = target['soc'].iloc[-1]
+    optimizer_config['peaks'] = peaks
+    return {**conf, 'optimizer_config': optimizer_config}
+
+
+def update_targets(power_data, conf, targets, period='month'):
+    """
+    Re-optimize only the windows whose power data changed
+
+    Windows without an existing target or with changed rows are solved in
+    full. Billing months that only gained rows are solved from the end of
+    their existing target, carrying over its SOC and month-to-date peaks,
+    and only hold the final SOC once the month is complete. Daily windows
+    are independent, so appended dates are solved in full.
+
+    :param DataFrame power_data: Power data with month & date columns
+    :param dict conf: LT Setback Config object
+    :param list targets: Existing target DataFrames, one per window
+    :param str period: 'month' or 'date'
+    :return: Merged list of target DataFrames for each window
+    """
+    existing = {_label(target, period): target for target in targets}
+    merged = dict(existing)
+
+    changed = []
+    for label, load in power_data.groupby(period, observed=True):
+        target = existing.get(label)
+        change = find_changes(load, target)
+        if change == 'unchanged':
+            continue
+
+        if change == 'appended' and period == 'month':
+            tail = load.loc[target.index[-1]:]
+            print(f'Solving {len(tail) - 1} appended intervals of {label}')
+            end = tail.index[-1]
+            complete = (end + INTERVAL).month != end.month
+            tail_target, = run_iterative_optimizer(
+                [(label, tail)], _month_to_date_config(target, conf, complete))
+            merged[label] = pandas.concat([target.iloc[:-1], tail_target])
+        else:
+            changed.append((label, load))
+
+    for (label, _), target in zip(changed,
+                                  run_iterative_optimizer(changed, conf)):
+        merged[label] = target
+
+    return [merged[label] for label in sorted(merged)]
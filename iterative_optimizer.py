@@ -1,78 +1,275 @@
-import pulp
 import datetime
-from util import get_sst, get_charge_cop
-from optimizer_engine.cop import farenheit_to_celsius, celsius_to_farenheit
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from functools import partial
+from thermal import (get_sst, get_charge_cop, sst_line, to_celsius,
+                     to_farenheit)
 from lt_optimizer import Optimizer
-from savings import get_bill_calculator
+from matrix_optimizer import MatrixOptimizer
+from coupled_optimizer import CoupledOptimizer
+from peak_optimizer import PeakThresholdOptimizer
+from rolling_horizon import RollingHorizonOptimizer
+from convergence import get_policy
+from target_cache import TargetCache, window_key
 
+# Windows queued per worker process, bounds the targets held in memory
+IN_FLIGHT_FACTOR = 2
 
-def run_iterative_optimizer(loads, config, verbose=False):
-    optimizer_config = config['optimizer_config']
-    bill_calculator = get_bill_calculator(optimizer_config)
-    optimize_energy = True
-    if 'optimize_energy' in config:
-        optimize_energy = config['optimize_energy']
-    targets = []
-    for time_frame, load in loads:
+OPTIMIZERS = {
+    'pulp': Optimizer,
+    'matrix': MatrixOptimizer,
+    'peak': PeakThresholdOptimizer,
+    'coupled': CoupledOptimizer,
+}
+
+
+def get_optimizer_class(config):
+    engine = config.get('engine', 'pulp')
+    try:
+        optimizer_class = OPTIMIZERS[engine]
+    except KeyError:
+        raise ValueError(f'Unknown optimizer engine "{engine}"')
+
+    # Solve long windows as a sequence of lookahead windows
+    if config.get('rolling_horizon'):
+        return partial(RollingHorizonOptimizer,
+                       optimizer_class=optimizer_class,
+                       **config['rolling_horizon'])
+    return optimizer_class
+
+
+def run_iterative_optimizer(loads, config, verbose=False, logs=None,
+                            metrics=None):
+    """
+    Run the iterative optimizer on every window and collect targets.
+
+    :param loads: Iterable of (time frame, load DataFrame) windows
+    :param dict config: LT Setback Config object
+    :param bool verbose: Log savings for every iteration
+    :param dict logs: Optional dict to collect the log lines per time frame
+    :param MetricsRecorder metrics: Optional recorder of every iteration
+    :return: List of target DataFrames for each window
+    """
+    return [target for _, target in
+            iter_iterative_optimizer(loads, config, verbose, logs, metrics)]
 
-        previous_total_savings = 0
-        previous_diff = 0
-        iteration_limit = 10
-        optimizer_config['start'] = load.index[0]
-        optimizer_config['end'] = load.index[-1]
-        count = 0
 
-        print(f'Starting optimization for {time_frame}')
+def iter_iterative_optimizer(loads, config, verbose=False, logs=None,
+                             metrics=None):
+    """
+    Run the iterative optimizer on every window, yielding each target as
+    soon as its window is done.
+
+    Windows are read lazily and yielded in the original window order, each
+    window's log lines are printed as one block. Windows are independent,
+    so with config['workers'] > 1 they are solved across a pool of
+    processes with a bounded number of windows in flight. With
+    config['target_cache'] set, windows whose input slice and config are
+    unchanged are loaded from the target store instead of being re-solved,
+    and solved windows are stored as they complete.
+
+    :param loads: Iterable of (time frame, load DataFrame) windows
+    :param dict config: LT Setback Config object
+    :param bool verbose: Log savings for every iteration
+    :param dict logs: Optional dict to collect the log lines per time frame
+    :param MetricsRecorder metrics: Optional recorder of every iteration
+    :return: Generator of (time frame, target DataFrame) for each window
+    """
+    workers = config.get('workers', 1)
+    cache = None
+    if config.get('target_cache'):
+        cache = TargetCache(config['target_cache'])
+
+    if workers <= 1:
+        for time_frame, load, key, target in _cached_windows(loads, config,
+                                                             cache):
+            if target is None:
+                target, log, records = optimize_window(time_frame, load,
+                                                       config, verbose)
+                _store(cache, key, target)
+            else:
+                log, records = _cached_log(time_frame)
+            _print_log(time_frame, log, logs)
+            _record(metrics, time_frame, records)
+            yield time_frame, target
+        return
+
+    # Solver output of the worker processes would interleave, so only the
+    # collected window logs are printed
+    config = {**config, 'optimizer_config': {
+        **config['optimizer_config'], 'solver_msg': False}}
+    in_flight = deque()
+    windows = _cached_windows(loads, config, cache)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
         while True:
-            count += 1
+            # Keep every worker busy with the next windows queued behind
+            while len(in_flight) < IN_FLIGHT_FACTOR * workers:
+                window = next(windows, None)
+                if window is None:
+                    break
+                time_frame, load, key, target = window
+                if target is None:
+                    target = executor.submit(optimize_window, time_frame,
+                                             load, config, verbose)
+                in_flight.append((time_frame, key, target))
+            if not in_flight:
+                return
+
+            time_frame, key, target = in_flight.popleft()
+            if isinstance(target, Future):
+                target, log, records = target.result()
+                _store(cache, key, target)
+            else:
+                log, records = _cached_log(time_frame)
+            _print_log(time_frame, log, logs)
+            _record(metrics, time_frame, records)
+            yield time_frame, target
+
+
+def _cached_windows(loads, config, cache=None):
+    for time_frame, load in loads:
+        # Grouping by a categorical month/date without observed=True yields
+        # empty windows for the unobserved categories
+        if not len(load):
+            continue
+        key = target = None
+        if cache is not None:
+            key = window_key(load, config)
+            target = cache.get(key)
+        yield time_frame, load, key, target
 
-            optimizer = Optimizer(optimizer_config,
-                                  optimize_energy=optimize_energy)
-            target = optimizer.solve(load)
 
-            print(
-                f'Iteration {count} - {pulp.LpStatus[optimizer.frame.status]}')
+def _store(cache, key, target):
+    if cache is not None:
+        cache.put(key, target)
 
-            baseline_demand = bill_calculator.calculate_demand_bill(
-                target, load_column='baseline')
-            baseline_energy = bill_calculator.calculate_energy_bill(
-                target, load_column='baseline')
 
-            ideal_demand = bill_calculator.calculate_demand_bill(target)
-            ideal_energy = bill_calculator.calculate_energy_bill(target)
+def _cached_log(time_frame):
+    return ([f'Loaded stored target for {time_frame}'],
+            [{'iteration': 0, 'cached': True}])
 
-            demand_savings = baseline_demand - ideal_demand
-            energy_savings = baseline_energy - ideal_energy
 
-            total_savings = demand_savings + energy_savings
+def _record(metrics, time_frame, records):
+    if metrics is not None:
+        metrics.extend(records, time_frame=time_frame)
 
-            savings_diff = abs(total_savings - previous_total_savings)
 
-            if verbose:
-                print("Solved for count {}".format(count))
-                print("Total Savings {}".format(total_savings))
-                print("Delta in savings {}".format(savings_diff))
+def _print_log(time_frame, log, logs=None):
+    print('\n'.join(log) + '\n')
+    if logs is not None:
+        logs[time_frame] = log
+
+
+def optimize_window(time_frame, load, config, verbose=False):
+    """
+    Iteratively optimize a single window until the charge COP's converge,
+    as decided by the convergence policy of the config. The coupled engine
+    solves the charge COP within the model, in one solve.
+
+    :param time_frame: Month or date of the window
+    :param DataFrame load: Power data of the window
+    :param dict config: LT Setback Config object
+    :param bool verbose: Log savings for every iteration
+    :return: Target DataFrame, the list of log lines and the metrics of
+        every iteration of the window
+    """
+    log = [f'Starting optimization for {time_frame}']
+    records = []
+    _, target, _ = iterate_window(load, config, log=log, records=records,
+                                  verbose=verbose)
+
+    target.drop(columns=['timestamp'], inplace=True)
+    target['sst'] = to_farenheit(get_sst(target['soc'], config))
+
+    log.append(f"Completed optimizing for {time_frame}")
+
+    return target, log, records
+
+
+def window_config(load, config):
+    """
+    Optimizer config of a window
+
+    :param DataFrame load: Power data of the window
+    :param dict config: LT Setback Config object
+    :return dict: Optimizer config with the window bounds & SST line
+    """
+    optimizer_config = dict(config['optimizer_config'])
+    optimizer_config['start'] = load.index[0]
+    optimizer_config['end'] = load.index[-1]
+    optimizer_config['sst_line'] = sst_line(config)
+    return optimizer_config
+
+
+def iterate_window(load, config, optimizer=None, log=None, records=None,
+                   verbose=False):
+    """
+    Solve a window, updating its charge COP's until they converge.
+
+    :param DataFrame load: Power data of the window
+    :param dict config: LT Setback Config object
+    :param optimizer: Optimizer already built for the window, re-solved
+        instead of building a new one
+    :param list log: Optional list collecting the log lines
+    :param list records: Optional list collecting the metrics of every
+        iteration
+    :param bool verbose: Log the convergence of every iteration
+    :return: Optimizer, target DataFrame and power data with the charge
+        COP's of the last solve
+    """
+    log = [] if log is None else log
+    records = [] if records is None else records
+    optimize_energy = True
+    if 'optimize_energy' in config:
+        optimize_energy = config['optimize_energy']
+    optimizer_class = get_optimizer_class(config)
+    reuse_model = config.get('reuse_model', True)
+    coupled = config.get('engine') == 'coupled'
+    oat_c = to_celsius(load['temperature'].to_numpy(dtype=float))
+    policy = get_policy(config, oat_c)
+    count = 0
+
+    while True:
+        count += 1
+
+        # Keep the built model, only the charge COP's have changed
+        if count == 1:
+            reused = optimizer is not None
+        else:
+            reused = (reuse_model and
+                      optimizer.update_cop_charge(load.cop_charge)
+                      is not False)
+        if reused:
+            target = optimizer.resolve(load)
+        else:
+            optimizer = optimizer_class(window_config(load, config),
+                                        optimize_energy=optimize_energy)
+            target = optimizer.solve(load)
 
-            if count == iteration_limit:
-                print("Warning: Optimizer iteration limit reached")
-                break
+        log.append(f'Iteration {count} - {optimizer.status}')
 
-            if (savings_diff < 10 or abs(savings_diff - previous_diff) < 1):
-                break
+        record = {**optimizer.metrics, 'iteration': count, 'reused': reused,
+                  'billing_time': 0.0}
+        records.append(record)
+        if coupled:
+            break
 
-            previous_total_savings = total_savings
-            previous_diff = savings_diff
+        # Charge COP's at the solved SOC
+        cop_charge = get_charge_cop(get_sst(target.soc, config), oat_c)
+        cop_charge = policy.step(load.cop_charge, cop_charge, target, record)
 
-            sst_df = get_sst(target.soc, config)
-            oat_df = farenheit_to_celsius(target.temperature)
+        if verbose:
+            log.append("Solved for count {}".format(count))
+            log.extend(policy.log(record))
 
-            load = load.assign(cop_charge=get_charge_cop(sst_df, oat_df))
+        if cop_charge is None:
+            log.append(f'Converged after {count} iterations')
+            break
 
-        target.drop(columns=['timestamp'], inplace=True)
-        target['sst'] = list(
-            map(celsius_to_farenheit, get_sst(target['soc'], config)))
-        targets.append(target)
+        if count == policy.max_iterations:
+            log.append("Warning: Optimizer iteration limit reached")
+            break
 
-        print(f"Completed optimizing for {time_frame}\n")
+        load = load.assign(cop_charge=cop_charge)
 
-    return targets
+    return optimizer, target, load
@@ -1,9 +1,104 @@
+import os
+import json
 import pytz
+import numpy as np
 import pandas as pd
 from pickle_jar.pickle_jar import pickle_jar
 import config
 import util
-from iterative_optimizer import run_iterative_optimizer
+from iterative_optimizer import iter_iterative_optimizer
+from periods import period_codes
+from target_store import TargetStore
+
+POWER_CACHE_PATH = '.power_cache/'
+
+# Max recharge capacity above the peak CRS load
+MRC_HEADROOM = 2
+
+
+def ingest_power_file(power_file, timezone, cache_path=POWER_CACHE_PATH):
+    """
+    Convert a site power file once into memory-mappable NumPy columns.
+
+    Timestamps are localized to the timezone and stored as UTC nanoseconds.
+    The site files are logged on a fixed 15 minute clock, so every row is
+    placed by its elapsed time from the localized first timestamp. The cache
+    is rebuilt when the size or modification time of the source changes.
+
+    :param str power_file: Path of the site CSV or Excel file
+    :param str timezone: Timezone of the site
+    :param str cache_path: Directory holding the converted files
+    :return: Directory of the converted file
+    """
+    name = os.path.splitext(os.path.basename(power_file))[0]
+    directory = os.path.join(cache_path, name)
+    meta_file = os.path.join(directory, 'meta.json')
+
+    stat = os.stat(power_file)
+    source = {
+        'file': os.path.abspath(power_file),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'timezone': timezone,
+    }
+    if os.path.isfile(meta_file):
+        with open(meta_file) as f:
+            if json.load(f)['source'] == source:
+                return directory
+
+    try:
+        df = pd.read_csv(power_file, parse_dates=['timestamp'])
+    except ValueError:
+        df = pd.read_excel(power_file, parse_dates=['timestamp'])
+
+    timestamps = pd.DatetimeIndex(df.pop('timestamp'))
+    if timestamps.tz is None:
+        elapsed = timestamps - timestamps[0]
+        timestamps = timestamps[0].tz_localize(timezone) + elapsed
+    else:
+        timestamps = timestamps.tz_convert(timezone)
+
+    if timestamps.hasnans or not timestamps.is_monotonic_increasing:
+        raise ValueError(f'Timestamps of {power_file} are not increasing')
+    if not timestamps.is_unique:
+        raise ValueError(f'Timestamps of {power_file} are not unique')
+
+    columns = [column for column in df.columns
+               if pd.api.types.is_numeric_dtype(df[column])]
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'timestamp.npy'), timestamps.asi8)
+    for num, column in enumerate(columns):
+        np.save(os.path.join(directory, f'{num}.npy'),
+                df[column].to_numpy(dtype=float))
+    with open(meta_file, 'w') as f:
+        json.dump({'source': source, 'columns': columns}, f)
+
+    return directory
+
+
+def read_power_file(power_file, timezone, cache_path=POWER_CACHE_PATH):
+    """
+    Read a site power file through its converted NumPy columns.
+
+    :param str power_file: Path of the site CSV or Excel file
+    :param str timezone: Timezone of the site
+    :param str cache_path: Directory holding the converted files
+    :return: DataFrame with a localized timestamp column
+    """
+    directory = ingest_power_file(power_file, timezone, cache_path)
+    with open(os.path.join(directory, 'meta.json')) as f:
+        columns = json.load(f)['columns']
+
+    timestamps = np.load(os.path.join(directory, 'timestamp.npy'),
+                         mmap_mode='r')
+    data = {'timestamp': pd.DatetimeIndex(
+        np.asarray(timestamps).view('datetime64[ns]'),
+        tz='UTC').tz_convert(timezone)}
+    for num, column in enumerate(columns):
+        data[column] = np.load(os.path.join(directory, f'{num}.npy'),
+                               mmap_mode='r')
+    return pd.DataFrame(data)
 
 
 def read_power_data(power_file, config):
@@ -20,13 +115,7 @@ def read_power_data(power_file, config):
     except TypeError:
         end = end.tz_convert(target_tz)
 
-    try:
-        df = pd.read_csv(power_file, parse_dates=['timestamp'])
-    except ValueError:
-        df = pd.read_excel(power_file, parse_dates=['timestamp'])
-
-    df['timestamp'] = df['timestamp'].apply(
-        lambda t: t.replace(tzinfo=target_tz))
+    df = read_power_file(power_file, config['optimizer_config']['timezone'])
 
     if start < df.iloc[0]['timestamp']:
         print("Start time out of bounds of data, clipping")
@@ -36,21 +125,20 @@ def read_power_data(power_file, config):
         end = df.iloc[-1]['timestamp']
 
     df = df[(df.timestamp >= start) & (df.timestamp <= end)]
-    timestamps = pd.date_range(start, end, freq='15T', tz=target_tz)
+    df = df.set_index('timestamp')
 
-    try:
-        df['timestamp'] = timestamps
-    except ValueError:
-        df['timestamp'] = timestamps[:-4]
-    df.set_index('timestamp', drop=True, inplace=True)
+    # Canonical 15 minute grid, DST transitions are handled in absolute time
+    timestamps = pd.date_range(start, end, freq='15T', name='timestamp')
+    missing = len(timestamps.difference(df.index))
+    if missing:
+        print(f"Filling {missing} missing intervals of {power_file}")
+    df = df.reindex(timestamps)
+    if missing:
+        df = df.interpolate(method='time', limit_direction='both')
 
-    df = df.assign(
-        month=df.index.to_series(keep_tz=True).apply(
-            lambda t: f"{t:%Y}-{t:%m}"))
-    df = df.assign(
-        date=df.index.to_series(keep_tz=True).apply(
-            lambda t: f"{t:%Y}-{t:%m}-{t:%d}"))
-    df['timestamp'] = df.index.to_series(keep_tz=True)
+    df = df.assign(month=period_codes(df.index, 'month'),
+                   date=period_codes(df.index, 'date'))
+    df['timestamp'] = df.index
 
     if 'temperature' not in df.columns and 'dbt' in df.columns:
         df['temperature'] = df['dbt'].copy()
@@ -70,7 +158,8 @@ def load_data(site, start, end, power_file, config_file):
     power_data = read_power_data(power_file,
                                  master_conf)
 
-    master_conf['optimizer_config']['MRC'] = power_data.crs_baseline.max() + 2
+    master_conf['optimizer_config']['MRC'] = (power_data.crs_baseline.max() +
+                                              MRC_HEADROOM)
 
     power_data = util.add_thermal_info(power_data, master_conf)
 
@@ -78,16 +167,19 @@ def load_data(site, start, end, power_file, config_file):
     return power_data, master_conf
 
 
-@pickle_jar(detect_changes=True)
-def get_monthly_targets(data, conf, start=None, end=None):
+def iter_targets(data, conf, period='month', start=None, end=None,
+                 metrics=None):
     """
-    Run optimizer on each month in dataset and collect targets.
+    Run optimizer on each month or day in dataset, yielding each target as
+    soon as its window is done.
 
     :param DataFrame data: Power data
     :param conf: LT Setback Config object
+    :param str period: 'month' or 'date'
     :param str start: Start time of data to analyze
     :param str end: End timestamp of data to analyze
-    :return: List of target DataFrames for each month
+    :param MetricsRecorder metrics: Optional recorder of every iteration
+    :return: Generator of target DataFrames for each window
     """
     if start is None:
         start = pd.to_datetime(data.index[0])
@@ -103,50 +195,46 @@ def get_monthly_targets(data, conf, start=None, end=None):
     conf['optimizer_config']['end'] = end
     conf['start'] = start
     conf['end'] = end
-    months = data_slice.groupby('month')
-    return run_iterative_optimizer(months, conf)
+    windows = data_slice.groupby(period, observed=True)
+    for _, target in iter_iterative_optimizer(windows, conf,
+                                              metrics=metrics):
+        yield target
+
+
+def get_monthly_targets(data, conf, start=None, end=None):
+    """
+    Run optimizer on each month in dataset and collect targets.
+
+    :param DataFrame data: Power data
+    :param conf: LT Setback Config object
+    :param str start: Start time of data to analyze
+    :param str end: End timestamp of data to analyze
+    :return: List of target DataFrames for each month
+    """
+    return list(iter_targets(data, conf, 'month', start, end))
 
 
-@pickle_jar(detect_changes=True)
 def get_daily_targets(data, conf, start=None, end=None):
     """
     Run optimizer on each individual day in data set and collect targets.
 
     :param DataFrame data: Power data
     :param conf: LT Setback Config object
-    :return: List of target DataFrames for each month
     :param str start: Start time of data to analyze
     :param str end: End timestamp of data to analyze
-    :return:
+    :return: List of target DataFrames for each day
     """
-    if start is None:
-        start = pd.to_datetime(data.index[0])
-    else:
-        start = pd.to_datetime(start)
-    if end is None:
-        end = pd.to_datetime(data.index[-1])
-    else:
-        end = pd.to_datetime(end)
-    data_slice = data[(data.index >= start) & (data.index <= end)]
-
-    conf['optimizer_config']['start'] = start
-    conf['optimizer_config']['end'] = end
-    conf['start'] = start
-    conf['end'] = end
-    data_slice = data_slice.groupby('date')
-    return run_iterative_optimizer(data_slice, conf)
+    return list(iter_targets(data, conf, 'date', start, end))
 
 
-@pickle_jar(detect_changes=True)
 def get_monthly_daily_targets(power_data, master_conf):
-    monthly_targets = get_monthly_targets(power_data, master_conf)
+    dtype = master_conf.get('target_dtype', 'float64')
+    monthly_targets = TargetStore.from_targets(
+        iter_targets(power_data, master_conf, 'month'), dtype=dtype)
 
-    daily_targets = get_daily_targets(power_data, master_conf)
+    daily_targets = TargetStore.from_targets(
+        iter_targets(power_data, master_conf, 'date'), dtype=dtype)
 
-    final_monthly = pd.concat(monthly_targets)
-    final_monthly = final_monthly.assign(
-        date=final_monthly.index.to_series(keep_tz=True).apply(
-            lambda t: f"{t:%Y}-{t:%m}-{t:%d}"))
-    monthly_targets_days = final_monthly.groupby('date')
-    monthly_targets_days = [m[1] for m in monthly_targets_days]
+    # Days of the monthly run are views onto the monthly arrays
+    monthly_targets_days = monthly_targets.by_day()
     return monthly_targets_days, daily_targets
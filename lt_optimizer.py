@@ -10,13 +10,17 @@ from collections import OrderedDict
 
 # 3rd party imports
 import pulp
+import numpy as np
 import pandas
-from tariff import Tariff, NON_COINCIDENT
+from tariff import NON_COINCIDENT
 
 # Project imports
 from optimizer_engine import cop, time_ops, common
 from optimizer_engine.operating_limits import (get_discharge_limits,
                                                get_charge_limits)
+from metrics import new_metrics, timed
+from solvers import get_solver
+from tariff_calendar import get_tariff, get_tariff_calendar
 
 
 class Optimizer:
@@ -42,8 +46,16 @@ class Optimizer:
         cof (dict): Decision variable - charge offsets, float
         y (dict): Decision variable - selector variable, binary
         max_peaks (dict): dummy variables, peak demand for all periods
+        variables (list): All variables in column order (SOC, discharge
+            offsets, charge offsets, selectors, peaks)
+        solution (ndarray): Values of the variables once solved
         frame (obj): PuLP LP optimization object
+        calendar (TariffCalendar): Season, period & energy rate arrays
+        status (str): Solution status of the last solve
+        solver (SolverBackend): Solver of the frame
+        metrics (dict): Stage times, model size & objective of the last solve
     """
+    DEFAULT_SOLVER = 'cbc'
 
     def __init__(self, config, optimize_energy=True):
         """
@@ -52,7 +64,7 @@ class Optimizer:
         :param dict config: dictionary with input configurations
         """
         self.tariff_id = config.get('tariff_id') or config['site_id']
-        self.tariff = Tariff(self.tariff_id)
+        self.tariff = get_tariff(self.tariff_id)
 
         self.start = config['start']
         self.end = config['end']
@@ -65,6 +77,7 @@ class Optimizer:
         self.mrc = config['MRC']
         self.rb_capacity = config['RB_capacity']
         self.soc_init = config['SOC_initial']
+        # Final SOC, the initial SOC by default & free if None
         self.soc_final = config.get('SOC_final', self.soc_init)
         self.rb_min_soc = config.get('RB_min_soc', 0)
         self.min_charge_offset = config['min_charge_offset']
@@ -92,6 +105,19 @@ class Optimizer:
         # Load big M variable value
         self.big_m = config['M']
 
+        # Print solver output
+        self.solver_msg = config.get('solver_msg', True)
+
+        # Solver backend with its threads, time limit & MIP gap
+        self.solver = get_solver(config.get('solver'), self.DEFAULT_SOLVER)
+
+        # Build a pure LP without selector variables whenever charging and
+        # discharging in the same interval can't pay off, and optionally
+        # check the solution for simultaneous offsets
+        self.selector_elimination = config.get('selector_elimination', True)
+        self.verify_selector_free = config.get('verify_selector_free', False)
+        self.pure_lp = False
+
         # Fetch dataframe wih 15 min interval timestamps and time labels
         self.timestamp_df = time_ops.get_timestamps(self.start, self.end)
 
@@ -114,9 +140,23 @@ class Optimizer:
         self.y = None
         self.max_peaks = None
 
-        # Define a dictionary to hold the final values for the decision
-        # variables once the optimizer has solved the problem
-        self.decision_variables = {}
+        # Variables in column order and their values once the optimizer has
+        # solved the problem
+        self.variables = []
+        self.solution = None
+
+        # Solution status of the last solve (solved, undefined, infeasible)
+        self.status = None
+
+        # Stage times, model size, status & objective of the last solve
+        self.metrics = new_metrics()
+
+        # Season, period & energy rate of every interval in the window
+        self.calendar = None
+
+        # Constraints with charge COP coefficients, kept to patch re-solves
+        self.soc_balance = {}
+        self.chg_curve_limits = []
 
         # Constraints
         self.chg_limits = None
@@ -157,13 +197,15 @@ class Optimizer:
             lowBound=0,
             upBound=None)
 
-        # Define selector decision variables (binary)
-        self.y = pulp.LpVariable.dicts(
-            "Selector",
-            self.time_labels,
-            lowBound=None,
-            upBound=None,
-            cat='Binary')
+        # Define selector decision variables (binary), unless the model is
+        # a pure LP
+        if not self.pure_lp:
+            self.y = pulp.LpVariable.dicts(
+                "Selector",
+                self.time_labels,
+                lowBound=None,
+                upBound=None,
+                cat='Binary')
 
         # Define variables max peak, part-peak & non-coincidental demand Summer
         self.max_peaks = {season: {peak: pulp.LpVariable(
@@ -171,6 +213,17 @@ class Optimizer:
             for peak in self.demand_peaks[season]}
             for season in self.demand_peaks}
 
+        # Fixed column order, so that solved values are read back by interval
+        # position instead of by variable name
+        self.variables = [variables[label]
+                          for variables in (self.soc, self.dof, self.cof,
+                                            self.y)
+                          if variables is not None
+                          for label in self.time_labels]
+        self.variables += [self.max_peaks[season][peak]
+                           for season in self.max_peaks
+                           for peak in self.max_peaks[season]]
+
     def _define_objective(self, df, building_power_column='building_baseline'):
         """
         Define the objective function of the LP Minimization
@@ -185,15 +238,12 @@ class Optimizer:
         :param DataFrame df: Building power time series inputs
         :param building_power_column: Name of building baseline column
         """
-        # Fetch energy tariff's for the given time frame
-        energy_tariff_df = self.tariff.apply_energy_rates(df)
-
         # Fetch demand charges
         demand_charges = self.tariff.demand_rates()
 
         # Create mapping of energy tariffs and time labels for the given frame
         energy_tariff = dict(
-            zip(self.time_labels, energy_tariff_df.energy_tariff))
+            zip(self.time_labels, self.calendar.energy_tariff))
 
         # Create mapping of building power and time labels for the given frame
         building_power = dict(
@@ -201,12 +251,11 @@ class Optimizer:
 
         # ===== Set objective function =====
         # Demand portion
-        season_df = self.tariff.apply_season(df)
         demand = []
         for season in self.max_peaks:
             # Determine the fraction of rows in the current season
-            n = len(season_df[season_df['season'] == season])
-            fraction = n / len(season_df)
+            n = np.count_nonzero(self.calendar.season == season)
+            fraction = n / len(self.calendar.season)
 
             # Weight each peak by the demand charge in that period as well
             # as the fraction of days in the current season
@@ -227,27 +276,26 @@ class Optimizer:
         else:
             self.frame += pulp.lpSum(demand)
 
-    def _add_constraints(self, df, building_power_column='building_baseline',
-                         crs_power_column='crs_baseline',
-                         temperature_column='temperature',
-                         discharge_limit_column='discharge_limits',
-                         charge_limit_column='charge_limits',
-                         cop_charge_column='cop_charge',
-                         cop_discharge_column='cop_discharge'):
+    def _prepare_inputs(self, df, crs_power_column='crs_baseline',
+                        temperature_column='temperature',
+                        discharge_limit_column='discharge_limits',
+                        charge_limit_column='charge_limits',
+                        cop_charge_column='cop_charge',
+                        cop_discharge_column='cop_discharge'):
         """
-        Define constraints for the LP Minimization
+        Derive the time series parameters of the RB model
 
-        This function takes in building power as a DataFrame and adds energy
-        balance constraints to the optimization frame, as well as limits on
-        different parameters including both offsets to limit their value as
-        well as force only one parameter to be active in each 15 min interval.
+        This function sets the charge & discharge limits, the charge &
+        discharge COP's and the heat leak for every interval of the window,
+        either from the input columns or from the configured coefficients.
 
         :param DataFrame df: Building power, CRS power, and OAT time series
-        :param str building_power_column: Name of building baseline column
         :param str crs_power_column: Name of CRS baseline column
         :param str temperature_column: Name of air temperature column
         :param str discharge_limit_column: Name of discharge limit column
         :param str charge_limit_column: Name of charge limit column
+        :param str cop_charge_column: Name of charge COP column
+        :param str cop_discharge_column: Name of discharge COP column
         """
         # If the CRS power is given, use it to derive CHG/DCHG limits,
         # otherwise the charge and discharge limits must be given
@@ -270,15 +318,6 @@ class Optimizer:
         # Fetch max compressor capacity for each interval based on temperature
         # mcc_df = cop.generate_mcc(temperature_df)
 
-        # Create mappings of building power and time labels
-        building_power = dict(zip(self.time_labels, df[building_power_column]))
-
-        # Create mappings of time series discharge limits and time labels
-        dchg_limits = dict(zip(self.time_labels, self.dchg_limits))
-
-        # Create mappings of time series charge limits and time labels
-        chg_limits = dict(zip(self.time_labels, self.chg_limits))
-
         # Create COP time series
         if (cop_charge_column in df.columns and
                 cop_discharge_column in df.columns):
@@ -308,12 +347,6 @@ class Optimizer:
             self.cop_dchg = cop_df['cop_dchg']
             self.cop_chg = cop_df['cop_chg']
 
-        # Create mapping of discharge COP's and time labels
-        cop_dchg = dict(zip(self.time_labels, self.cop_dchg))
-
-        # Create mapping of charge COP's and time labels
-        cop_chg = dict(zip(self.time_labels, self.cop_chg))
-
         if self.heat_leak_coefficients:
             heat_leak_df = cop.generate_heat_leak(
                 df, self.heat_leak_coefficients,
@@ -323,11 +356,40 @@ class Optimizer:
             # heat_leak_df['heat_leak'] = 0
 
         self.heat_leak = heat_leak_df['heat_leak']
+
+    def _add_constraints(self, df, building_power_column='building_baseline'):
+        """
+        Define constraints for the LP Minimization
+
+        This function takes in building power as a DataFrame and adds energy
+        balance constraints to the optimization frame, as well as limits on
+        different parameters including both offsets to limit their value as
+        well as force only one parameter to be active in each 15 min interval.
+        The time series limits, COP's and heat leak must have been set by
+        _prepare_inputs.
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str building_power_column: Name of building baseline column
+        """
+        # Create mappings of building power and time labels
+        building_power = dict(zip(self.time_labels, df[building_power_column]))
+
+        # Create mappings of time series discharge limits and time labels
+        dchg_limits = dict(zip(self.time_labels, self.dchg_limits))
+
+        # Create mappings of time series charge limits and time labels
+        chg_limits = dict(zip(self.time_labels, self.chg_limits))
+
+        # Create mapping of discharge COP's and time labels
+        cop_dchg = dict(zip(self.time_labels, self.cop_dchg))
+
+        # Create mapping of charge COP's and time labels
+        cop_chg = dict(zip(self.time_labels, self.cop_chg))
+
         # Create mapping of charge COP's and time labels
         heat_leak = dict(zip(self.time_labels, self.heat_leak))
 
         # Run loop to add constraints to the frame
-        common.timer('constraints_loop')
         for t in range(len(self.time_labels)):
             if t < len(self.time_labels) - 1:
                 # Difference in subsequent SOC states in kWh
@@ -345,7 +407,9 @@ class Optimizer:
 
                 # Energy balance equation for the RB
                 effective_energy = offset_energy + energy_heat_leak
-                self.frame += soc_difference == effective_energy
+                balance = soc_difference == effective_energy
+                self.frame += balance
+                self.soc_balance[self.time_labels[t]] = balance
 
                 # ===== OPTIONAL CONSTRAINT =====
                 if self.constraints['time_transition']:
@@ -360,18 +424,22 @@ class Optimizer:
                     self.frame += (self.cof[self.time_labels[t + 1]] <=
                                    self.big_m * (1 - beta))
 
-                # Helper variable
-                alpha = (self.y[self.time_labels[t]] +
-                         self.y[self.time_labels[t + 1]])
-
                 # ===== OPTIONAL CONSTRAINT =====
                 if self.constraints['minimum_discharge_offset']:
+                    # Helper variable
+                    alpha = (self.y[self.time_labels[t]] +
+                             self.y[self.time_labels[t + 1]])
+
                     # Equation to support minimum discharge offset
                     self.frame += (self.dof[self.time_labels[t + 1]] >=
                                    self.min_discharge_offset * (alpha - 1))
 
                 # ===== OPTIONAL CONSTRAINT =====
                 if self.constraints['minimum_charge_offset']:
+                    # Helper variable
+                    alpha = (self.y[self.time_labels[t]] +
+                             self.y[self.time_labels[t + 1]])
+
                     # Equation to support minimum charge offset
                     self.frame += (self.cof[self.time_labels[t + 1]] >=
                                    self.min_charge_offset * (1 - alpha))
@@ -384,12 +452,14 @@ class Optimizer:
             self.frame += (self.cof[self.time_labels[t]] <=
                            chg_limits[self.time_labels[t]])
 
-            # Constraints that allow either chg or dchg offset in an interval
-            self.frame += (self.dof[self.time_labels[t]] <=
-                           self.big_m * self.y[self.time_labels[t]])
+            # Constraints that allow either chg or dchg offset in an interval,
+            # not needed when simultaneous offsets can't pay off
+            if not self.pure_lp:
+                self.frame += (self.dof[self.time_labels[t]] <=
+                               self.big_m * self.y[self.time_labels[t]])
 
-            self.frame += (self.cof[self.time_labels[t]] <=
-                           self.big_m * (1 - self.y[self.time_labels[t]]))
+                self.frame += (self.cof[self.time_labels[t]] <=
+                               self.big_m * (1 - self.y[self.time_labels[t]]))
 
             # Once the RB has chosen to charge or discharge, effective
             # demand represents the adjustment to the building baseline by
@@ -402,9 +472,8 @@ class Optimizer:
             # Since the operation of finding a maximum is not linear,
             # constraints must be added to select the maximum effective demand
             # amongst all 15-minute intervals
-            time = self.timestamp_labels[self.time_labels[t]]
-            season = self.tariff.season(time)
-            period = self.tariff.period(time)
+            season = self.calendar.season[t]
+            period = self.calendar.period[t]
 
             if NON_COINCIDENT in self.max_peaks[season]:
                 peak = self.max_peaks[season][NON_COINCIDENT]
@@ -442,27 +511,24 @@ class Optimizer:
                 # Additional bounding constraint on discharge offset as f(SOC)
                 for line in self.chg_limit_curve:
                     m, b = line
-                    self.frame += self.cof[self.time_labels[t]] <= ((
-                                                                            m *
-                                                                            self.soc[
-                                                                                self.time_labels[
-                                                                                    t]] + b) /
-                                                                    cop_chg[
-                                                                        self.time_labels[
-                                                                            t]])
+                    label = self.time_labels[t]
+                    limit = (self.cof[label] <=
+                             (m * self.soc[label] + b) / cop_chg[label])
+                    self.frame += limit
+                    self.chg_curve_limits.append(
+                        (label, m, b, limit))
             else:
                 if self.chg_limit_curve:
                     common.warning('Value provided for "chg_limit_curve" but '
                                    '"chg_limit_curve" constraint is not '
                                    'active')
 
-        common.timer('constraints_loop', "Ran constraints loop")
-
         # Constraint to set initial SOC in the frame
         self.frame += self.soc["T01"] == self.soc_init
 
         # Constraint to set final SOC in the frame (same as initial)
-        self.frame += self.soc[self.time_labels[-1]] == self.soc_final
+        if self.soc_final is not None:
+            self.frame += self.soc[self.time_labels[-1]] == self.soc_final
 
         # ===== OPTIONAL CONSTRAINT =====
         if self.constraints['fixed_rte']:
@@ -491,6 +557,45 @@ class Optimizer:
                             other_peak = self.max_peaks[season][other_period]
                             self.frame += peak >= other_peak
 
+    def _is_selector_free(self):
+        """
+        Check whether simultaneous charge & discharge offsets can pay off
+
+        Reducing a pair of simultaneous offsets while keeping the SOC change
+        never raises the target load as long as the charge COP is positive
+        and no larger than the discharge COP, so it never raises a peak or,
+        with non negative energy rates, the energy charges. The selector
+        variables are then redundant unless a constraint relies on them.
+
+        :return bool: True if the selector variables can be dropped
+        """
+        for constraint in ('time_transition', 'minimum_charge_offset',
+                           'minimum_discharge_offset', 'fixed_rte'):
+            if self.constraints[constraint]:
+                return False
+
+        cop_chg = np.asarray(self.cop_chg, dtype=float)
+        cop_dchg = np.asarray(self.cop_dchg, dtype=float)
+        if np.any(cop_chg <= 0) or np.any(cop_chg > cop_dchg):
+            return False
+
+        if self.optimize_energy and np.any(self.calendar.energy_tariff < 0):
+            return False
+
+        return True
+
+    def _verify_selector_free(self):
+        """
+        Warn about intervals with both offsets non-zero in a pure LP solution
+        """
+        dof_values, cof_values, _ = self._get_solution()
+        simultaneous = np.count_nonzero(
+            (np.asarray(dof_values, dtype=float) > 1e-6) &
+            (np.asarray(cof_values, dtype=float) > 1e-6))
+        if simultaneous:
+            common.warning('{} intervals charge and discharge at the same '
+                           'time in the pure LP solution'.format(simultaneous))
+
     def write_frame(self, file_name):
         """
         Write linear programming framework to a file
@@ -503,29 +608,140 @@ class Optimizer:
         # Write frame LP problem to file
         self.frame.writeLP(file_name)
 
-    def _solve_frame(self):
+    def _solve_frame(self, warm_start=False):
         """
         Solve optimization frame and time it
 
         This function solves the frame setup by the form_optimization method &
         prints out the status of the solution (solved, undefined, infeasible).
         It also prints out the time taken for convergence.
+
+        :param bool warm_start: Start the solver from the current solution
         """
-        pulp.LpSolverDefault.msg = 1
+        # Solve & time frame, fetching the values of all variables
+        with timed(self.metrics, 'solve_time'):
+            self.status, self.solution, objective = \
+                self.solver.solve_problem(self.frame, self.variables,
+                                          msg=self.solver_msg,
+                                          warm_start=warm_start)
+        common.debug("Convergence time {}".format(self.metrics['solve_time']))
 
-        # Solve & time frame
-        common.timer('solve_frame')
+        # Post solution status to logger
+        common.debug("Solution status: {}".format(self.status))
+
+        # The PuLP solvers don't report their final bound, only an LP's gap
+        # is known
+        self.metrics.update(
+            variables=len(self.variables),
+            constraints=len(self.frame.constraints),
+            status=self.status,
+            mip_gap=0.0 if self.pure_lp and self.status == 'Optimal' else None,
+            objective=objective)
+
+    def update_cop_charge(self, cop_chg):
+        """
+        Patch the charge COP coefficients of an already built frame
 
-        self.frame.solve(pulp.PULP_CBC_CMD(maxSeconds=120))
-        common.timer('solve_frame', "Convergence time")
+        Only the charge offset coefficients of the SOC balance constraints
+        (and of the charge limit curve, if active) depend on the charge COP,
+        so the rest of the frame is kept as is.
 
-        # Post solution status to logger
-        status = pulp.LpStatus[self.frame.status]
-        common.debug("Solution status: {}".format(status))
+        :param cop_chg: New charge COP for every interval of the window
+        :return bool: False if the model must be rebuilt instead
+        """
+        self.metrics = new_metrics()
+        with timed(self.metrics, 'build_time'):
+            self.cop_chg = pandas.Series(list(cop_chg),
+                                         index=self.cop_chg.index)
+            if self.pure_lp and not self._is_selector_free():
+                return False
+            cop_chg = dict(zip(self.time_labels, self.cop_chg))
+
+            for label, balance in self.soc_balance.items():
+                balance[self.cof[label]] = 0.25 * cop_chg[label]
+
+            for label, m, b, limit in self.chg_curve_limits:
+                limit[self.soc[label]] = -m / cop_chg[label]
+                limit.constant = -b / cop_chg[label]
+
+            # Hand only the patched coefficients to a solver keeping the
+            # model of the last solve
+            coefficients = [(balance, self.cof[label])
+                            for label, balance in self.soc_balance.items()]
+            coefficients += [(limit, self.soc[label])
+                             for label, _, _, limit in self.chg_curve_limits]
+            self.solver.update_problem(
+                self.frame, coefficients=coefficients,
+                rows=[limit for _, _, _, limit in self.chg_curve_limits])
+
+        return True
+
+    def update_capacity(self, capacity, heat_leak):
+        """
+        Patch the RB capacity of an already built frame
+
+        Only the SOC upper bounds and the heat leak coefficients of the SOC
+        balance constraints depend on the capacity, so the rest of the frame
+        is kept as is.
+
+        :param float capacity: New RB tank capacity in KWH_thermal
+        :param heat_leak: Heat leak of every interval at the new capacity
+        :return bool: False if the model must be rebuilt instead
+        """
+        self.metrics = new_metrics()
+        with timed(self.metrics, 'build_time'):
+            self.rb_capacity = capacity
+            self.heat_leak = pandas.Series(list(heat_leak),
+                                           index=self.heat_leak.index)
+            heat_leak = dict(zip(self.time_labels, self.heat_leak))
+
+            for label in self.time_labels:
+                self.soc[label].upBound = capacity
+
+            for label, balance in self.soc_balance.items():
+                balance[self.soc[label]] = 1 - 0.25 * heat_leak[label]
+
+            self.solver.update_problem(
+                self.frame,
+                coefficients=[(balance, self.soc[label])
+                              for label, balance in self.soc_balance.items()],
+                columns=[self.soc[label] for label in self.time_labels])
+
+        return True
+
+    def resolve(self, df, building_power_column='building_baseline',
+                temperature_column='temperature'):
+        """
+        Re-solve the already built frame, warm started from the previous
+        solution, and produce the new target schedule.
 
-        # Extract decision variable solutions from solved frame
-        self.decision_variables = {v.name: v.varValue
-                                   for v in self.frame.variables()}
+        HiGHS re-solves its kept model from the simplex basis of the
+        previous solve (an LP) or with the previous solution as incumbent
+        (a MIP), CBC is handed the previous solution as MIP start. GLPK
+        always starts cold.
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str building_power_column: Name of building baseline column
+        :param str temperature_column: Name of air temperature column
+        :return DataFrame: Target building time series output with offsets
+        """
+        self._solve_frame(warm_start=True)
+
+        with timed(self.metrics, 'extract_time'):
+            return self._get_target(
+                df, building_power_column=building_power_column,
+                temperature_column=temperature_column)
+
+    def _get_solution(self):
+        """
+        Fetch the solved offsets & SOC for every interval of the window
+
+        :return tuple: Discharge offsets, charge offsets and SOC values
+        """
+        n = len(self.time_labels)
+        return (self.solution[n:2 * n],
+                self.solution[2 * n:3 * n],
+                self.solution[:n])
 
     def _get_target(self, df, building_power_column='building_baseline',
                     temperature_column='temperature',
@@ -543,15 +759,8 @@ class Optimizer:
         :return DataFrame: Target building time series output with offsets
         """
         # Calculate effective offsets (Discharge - Charge)
-        offset_values = []
-        soc_values = []
-        for label in self.time_labels:
-            dof = self.decision_variables["Discharge_Offset_" + label]
-            cof = self.decision_variables["Charge_Offset_" + label]
-            soc = self.decision_variables["SOC_" + label]
-
-            offset_values.append(dof - cof)
-            soc_values.append(soc)
+        dof_values, cof_values, soc_values = self._get_solution()
+        offset_values = [dof - cof for dof, cof in zip(dof_values, cof_values)]
 
         # Calculate building target value based on baseline and offset
         building_target = [
@@ -596,23 +805,40 @@ class Optimizer:
         :param str charge_limit_column: Name of charge limit column
         :return DataFrame: Target building time series output with offsets
         """
-        # Call function to define decision variables
-        self._define_decision_variables()
-
-        # Call function to define objective function
-        self._define_objective(df, building_power_column=building_power_column)
-
-        # Call function to add constraints to frame
-        self._add_constraints(df,
-                              building_power_column=building_power_column,
-                              crs_power_column=crs_power_column,
-                              temperature_column=temperature_column,
-                              discharge_limit_column=discharge_limit_column,
-                              charge_limit_column=charge_limit_column,
-                              cop_charge_column=cop_charge_column,
-                              cop_discharge_column=cop_discharge_column)
+        self.metrics = new_metrics()
+        with timed(self.metrics, 'build_time'):
+            # Fetch the shared tariff calendar of the window
+            self.calendar = get_tariff_calendar(self.tariff_id, df.index)
+
+            # Call function to derive limits, COP's and heat leak
+            self._prepare_inputs(df,
+                                 crs_power_column=crs_power_column,
+                                 temperature_column=temperature_column,
+                                 discharge_limit_column=discharge_limit_column,
+                                 charge_limit_column=charge_limit_column,
+                                 cop_charge_column=cop_charge_column,
+                                 cop_discharge_column=cop_discharge_column)
+
+            # Drop the selector variables if simultaneity can't pay off
+            self.pure_lp = (self.selector_elimination and
+                            self._is_selector_free())
+
+            # Call function to define decision variables
+            self._define_decision_variables()
+
+            # Call function to define objective function
+            self._define_objective(
+                df, building_power_column=building_power_column)
+
+            # Call function to add constraints to frame
+            self._add_constraints(
+                df, building_power_column=building_power_column)
 
         # Run the solver
         self._solve_frame()
 
-        return self._get_target(df)
+        if self.pure_lp and self.verify_selector_free:
+            self._verify_selector_free()
+
+        with timed(self.metrics, 'extract_time'):
+            return self._get_target(df)
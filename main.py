@@ -1,10 +1,10 @@
-import os
 import matplotlib.pyplot as plt
 from pprint import pprint
 import pandas as pd
 from pickle_jar import pickle_jar
 import load
 import savings
+import batch
 from display import lt_plot, peak_plot, stat_plot, stat_plot_intervals, \
     stat_plot_compare, single_day_analysis
 import analyze
@@ -42,16 +42,13 @@ for site in sites[-1:]:
 
     # power_file = 'input/WFROS_timeseries_filled.csv'
     print(f'Running site {site}')
-    path = 'input/'
-    power_file = [os.path.join(path, i) for i in os.listdir(path) if
-                  os.path.isfile(os.path.join(path, i)) and
-                  site in i][0]
-
-    if site.startswith('WF'):
-        config_file = 'input/WF_LTSB_mass_and_SST.csv'
-    elif site.startswith('WM'):
-        config_file = 'input/WM_LTSB_mass_and_SST_new.csv'
-    else:
+    power_file = batch.find_power_file(site)
+    if power_file is None:
+        print(f"Can't find power data file for {site}")
+        continue
+
+    config_file = batch.find_config_file(site)
+    if config_file is None:
         print(f"Can't find proper config file for {site}")
         continue
 
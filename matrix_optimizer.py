@@ -0,0 +1,508 @@
+"""
+This module holds a matrix-form variant of the schedule optimizer. The
+MatrixOptimizer builds the exact model of lt_optimizer.Optimizer as sparse
+constraint matrices and bound vectors instead of PuLP expression objects, and
+hands them straight to the in-process HiGHS solver backend.
+
+"""
+# 3rd party imports
+import numpy as np
+import pandas
+from scipy import sparse
+from tariff import NON_COINCIDENT
+
+# Project imports
+from optimizer_engine import common
+from lt_optimizer import Optimizer
+from metrics import new_metrics, timed
+from tariff_calendar import get_tariff_calendar
+
+
+class ConstraintBlocks:
+    """Accumulate blocks of linear constraint rows in coordinate form
+
+    Every block adds one row per interval (or a single row) and is described
+    by a list of (column indices, coefficients) terms together with the lower
+    and upper bounds of the rows.
+
+    Attributes:
+        rows (list): Row indices of every block term
+        cols (list): Column indices of every block term
+        vals (list): Coefficients of every block term
+        lower (list): Lower bounds of every block
+        upper (list): Upper bounds of every block
+        count (int): Number of rows added so far
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.cols = []
+        self.vals = []
+        self.lower = []
+        self.upper = []
+        self.count = 0
+
+    def add(self, terms, lower=-np.inf, upper=np.inf):
+        """
+        Add a block of constraint rows
+
+        :param list terms: (column indices, coefficients) pairs of the block
+        :param lower: Lower bound(s) of the rows
+        :param upper: Upper bound(s) of the rows
+        :return ndarray: Row indices of the added block
+        """
+        size = len(terms[0][0])
+        rows = np.arange(self.count, self.count + size)
+        for cols, coefficients in terms:
+            self.rows.append(rows)
+            self.cols.append(np.asarray(cols))
+            self.vals.append(
+                np.broadcast_to(np.asarray(coefficients, dtype=float),
+                                (size,)))
+        self.lower.append(np.broadcast_to(np.asarray(lower, dtype=float),
+                                          (size,)))
+        self.upper.append(np.broadcast_to(np.asarray(upper, dtype=float),
+                                          (size,)))
+        self.count += size
+        return rows
+
+    def build(self, n_columns):
+        """
+        Assemble the accumulated blocks into a sparse constraint matrix
+
+        :param int n_columns: Number of decision variables in the model
+        :return tuple: CSR matrix, row lower bounds, row upper bounds
+        """
+        matrix = sparse.csr_matrix(
+            (np.concatenate(self.vals),
+             (np.concatenate(self.rows), np.concatenate(self.cols))),
+            shape=(self.count, n_columns))
+        return (matrix, np.concatenate(self.lower),
+                np.concatenate(self.upper))
+
+
+class MatrixOptimizer(Optimizer):
+    """Build & solve the LP Minimization in matrix form
+
+    The MatrixOptimizer shares the configuration and inputs of the Optimizer
+    but skips PuLP entirely. Decision variables are laid out in contiguous
+    blocks (SOC, discharge offsets, charge offsets, selectors, peaks) so that
+    every family of constraints is created with a few vectorized operations.
+
+    Attributes:
+        n (int): Number of intervals in the optimization window
+        peak_keys (list): (season, period) of every peak variable
+        c (ndarray): Objective coefficients
+        objective_constant (float): Constant part of the objective
+        lb (ndarray): Lower bounds of the decision variables
+        ub (ndarray): Upper bounds of the decision variables
+        integrality (ndarray): Integrality flags of the decision variables
+        a (csr_matrix): Constraint matrix
+        a_lb (ndarray): Constraint row lower bounds
+        a_ub (ndarray): Constraint row upper bounds
+        balance_rows (ndarray): Row indices of the SOC balance constraints
+        chg_curve_rows (list): Row indices of the charge limit curves
+        solution (ndarray): Values of the decision variables once solved
+        objective (float): Objective value once solved
+    """
+    DEFAULT_SOLVER = 'highs'
+
+    def __init__(self, config, optimize_energy=True):
+        """
+        Initialize the MatrixOptimizer object.
+
+        :param dict config: dictionary with input configurations
+        """
+        super().__init__(config, optimize_energy=optimize_energy)
+        if not self.solver.solves_matrices:
+            raise ValueError(f'The matrix engine can\'t run solver '
+                             f'"{self.solver.name}"')
+
+        self.n = len(self.time_labels)
+        self.peak_keys = [(season, period)
+                          for season in self.demand_peaks
+                          for period in self.demand_peaks[season]]
+
+        self.c = None
+        self.objective_constant = 0
+        self.lb = None
+        self.ub = None
+        self.integrality = None
+        self.a = None
+        self.a_lb = None
+        self.a_ub = None
+        self.balance_rows = None
+        self.chg_curve_rows = []
+        self.solution = None
+        self.objective = None
+
+    def _index(self, block):
+        """
+        Column indices of a block of per-interval decision variables
+
+        :param int block: Block number (0 SOC, 1 DOF, 2 COF, 3 selector)
+        :return ndarray: Column indices of the block
+        """
+        return np.arange(block * self.n, (block + 1) * self.n)
+
+    def _peak_index(self, season, period):
+        """
+        Column index of a peak decision variable
+
+        :param str season: Season of the peak
+        :param str period: Period of the peak
+        :return int: Column index of the peak variable
+        """
+        return 4 * self.n + self.peak_keys.index((season, period))
+
+    def _define_variables(self):
+        """
+        Define bounds & integrality of all decision variables
+
+        Charge & discharge limits are applied directly as variable bounds,
+        which is equivalent to the limit constraints of the PuLP model.
+        """
+        n = self.n
+        n_columns = 4 * n + len(self.peak_keys)
+
+        self.lb = np.zeros(n_columns)
+        self.ub = np.full(n_columns, np.inf)
+        self.integrality = np.zeros(n_columns)
+
+        soc, dof, cof, y = (self._index(block) for block in range(4))
+
+        self.lb[soc] = self.rb_min_soc
+        self.ub[soc] = self.rb_capacity
+        self.ub[dof] = np.minimum(self.mdl, np.asarray(self.dchg_limits,
+                                                       dtype=float))
+        self.ub[cof] = np.asarray(self.chg_limits, dtype=float)
+        # Selectors are fixed to zero in a pure LP and dropped by presolve
+        if not self.pure_lp:
+            self.ub[y] = 1
+            self.integrality[y] = 1
+        else:
+            self.ub[y] = 0
+
+    def _define_objective(self, df, building_power_column='building_baseline'):
+        """
+        Define the objective coefficients of the LP Minimization
+
+        :param DataFrame df: Building power time series inputs
+        :param building_power_column: Name of building baseline column
+        """
+        self.c = np.zeros(len(self.lb))
+
+        # Demand portion, weighted by the fraction of rows in each season
+        seasons = self.calendar.season
+        demand_charges = self.tariff.demand_rates()
+        for season, period in self.peak_keys:
+            fraction = np.count_nonzero(seasons == season) / len(seasons)
+            rate = demand_charges[season][period]
+            self.c[self._peak_index(season, period)] = rate * fraction
+
+        # Energy portion
+        self.objective_constant = 0
+        if self.optimize_energy:
+            energy_tariff = self.calendar.energy_tariff
+            building_power = np.asarray(df[building_power_column],
+                                        dtype=float)
+            self.c[self._index(1)] = -energy_tariff / 4
+            self.c[self._index(2)] = energy_tariff / 4
+            self.objective_constant = np.sum(energy_tariff *
+                                             building_power) / 4
+
+    def _add_constraints(self, df, building_power_column='building_baseline'):
+        """
+        Define the constraint matrix of the LP Minimization
+
+        Builds the same energy balance, big M, peak and optional constraints
+        as Optimizer._add_constraints, one block of rows per constraint
+        family.
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str building_power_column: Name of building baseline column
+        """
+        n = self.n
+        soc, dof, cof, y = (self._index(block) for block in range(4))
+        now, nxt = slice(0, n - 1), slice(1, n)
+
+        cop_dchg = np.asarray(self.cop_dchg, dtype=float)
+        cop_chg = np.asarray(self.cop_chg, dtype=float)
+        heat_leak = np.asarray(self.heat_leak, dtype=float)
+        building_power = np.asarray(df[building_power_column], dtype=float)
+
+        blocks = ConstraintBlocks()
+        self.chg_curve_rows = []
+
+        # Energy balance equation for the RB
+        self.balance_rows = blocks.add([
+            (soc[now], 1 - 0.25 * heat_leak[now]),
+            (soc[nxt], -1),
+            (dof[now], -0.25 * cop_dchg[now]),
+            (cof[now], 0.25 * cop_chg[now]),
+        ], lower=0, upper=0)
+
+        # ===== OPTIONAL CONSTRAINT =====
+        if self.constraints['time_transition']:
+            blocks.add([(dof[nxt], 1), (y[now], -self.big_m),
+                        (y[nxt], self.big_m)], upper=self.big_m)
+            blocks.add([(cof[nxt], 1), (y[now], self.big_m),
+                        (y[nxt], -self.big_m)], upper=self.big_m)
+
+        # ===== OPTIONAL CONSTRAINT =====
+        if self.constraints['minimum_discharge_offset']:
+            blocks.add([(dof[nxt], -1),
+                        (y[now], self.min_discharge_offset),
+                        (y[nxt], self.min_discharge_offset)],
+                       upper=self.min_discharge_offset)
+
+        # ===== OPTIONAL CONSTRAINT =====
+        if self.constraints['minimum_charge_offset']:
+            blocks.add([(cof[nxt], -1),
+                        (y[now], -self.min_charge_offset),
+                        (y[nxt], -self.min_charge_offset)],
+                       upper=-self.min_charge_offset)
+
+        # Constraints that allow either chg or dchg offset in an interval,
+        # not needed when simultaneous offsets can't pay off
+        if not self.pure_lp:
+            blocks.add([(dof, 1), (y, -self.big_m)], upper=0)
+            blocks.add([(cof, 1), (y, self.big_m)], upper=self.big_m)
+
+        # Peak demand constraints on the effective demand of every interval
+        for season, period in self.peak_keys:
+            mask = self.calendar.season == season
+            if period != NON_COINCIDENT:
+                mask &= self.calendar.period == period
+            if not mask.any():
+                continue
+            peak = self._peak_index(season, period)
+            blocks.add([(dof[mask], -1), (cof[mask], 1),
+                        (np.full(np.count_nonzero(mask), peak), -1)],
+                       upper=-building_power[mask])
+
+        # ===== OPTIONAL CONSTRAINT =====
+        if self.constraints['dchg_limit_curve'] and self.dchg_limit_curve:
+            for m, b in self.dchg_limit_curve:
+                blocks.add([(dof, cop_dchg), (soc, -m)], upper=b)
+        elif self.dchg_limit_curve:
+            common.warning('Value provided for "dchg_limit_curve" but '
+                           '"dchg_limit_curve" constraint is not active')
+
+        # ===== OPTIONAL CONSTRAINT =====
+        if self.constraints['chg_limit_curve'] and self.chg_limit_curve:
+            for m, b in self.chg_limit_curve:
+                self.chg_curve_rows.append(
+                    blocks.add([(cof, cop_chg), (soc, -m)], upper=b))
+        elif self.chg_limit_curve:
+            common.warning('Value provided for "chg_limit_curve" but '
+                           '"chg_limit_curve" constraint is not active')
+
+        # Constraints to set initial & final SOC
+        blocks.add([([soc[0]], 1)], lower=self.soc_init, upper=self.soc_init)
+        if self.soc_final is not None:
+            blocks.add([([soc[-1]], 1)], lower=self.soc_final,
+                       upper=self.soc_final)
+
+        # ===== OPTIONAL CONSTRAINT =====
+        if self.constraints['fixed_rte']:
+            if not self.rte_setpoint:
+                raise TypeError('Value for "rte_setpoint" unset')
+            blocks.add([(dof, np.ones(n)),
+                        (cof, np.full(n, -self.rte_setpoint))], lower=0)
+        elif self.rte_setpoint:
+            common.warning('Value provided for "rte_setpoint" but '
+                           '"fixed_rte" constraint is not active')
+
+        # Set target peaks based on historical peaks in the billing period &
+        # tie the NON_COINCIDENT peak to all other peaks
+        for season, period in self.peak_keys:
+            peak = self._peak_index(season, period)
+            self.lb[peak] = max(0, self.demand_peaks[season][period])
+            if period == NON_COINCIDENT:
+                for other_season, other_period in self.peak_keys:
+                    if (other_season == season and
+                            other_period != NON_COINCIDENT):
+                        other_peak = self._peak_index(season, other_period)
+                        blocks.add([([peak], 1), ([other_peak], -1)],
+                                   lower=0)
+
+        self.a, self.a_lb, self.a_ub = blocks.build(len(self.lb))
+
+    def _solve_frame(self, warm_start=False):
+        """
+        Solve the matrix model with HiGHS and store the solution vector
+
+        :param bool warm_start: Start the solver from the current solution
+        """
+        with timed(self.metrics, 'solve_time'):
+            self.status, self.solution, objective, mip_gap = \
+                self.solver.solve_matrix(self.c, self.integrality, self.lb,
+                                         self.ub, self.a, self.a_lb,
+                                         self.a_ub, msg=self.solver_msg,
+                                         warm_start=warm_start)
+        common.debug("Convergence time {}".format(self.metrics['solve_time']))
+        common.debug("Solution status: {}".format(self.status))
+
+        self.objective = None
+        if objective is not None:
+            self.objective = objective + self.objective_constant
+
+        # HiGHS only reports a gap for models with integer variables
+        if mip_gap is None and self.pure_lp and self.status == 'Optimal':
+            mip_gap = 0.0
+
+        # The zero-fixed selector columns of a pure LP aren't part of the
+        # model, as in the PuLP engine
+        variables = self.a.shape[1] - (self.n if self.pure_lp else 0)
+        self.metrics.update(variables=variables,
+                            constraints=self.a.shape[0],
+                            status=self.status,
+                            mip_gap=mip_gap,
+                            objective=self.objective)
+
+    def update_cop_charge(self, cop_chg):
+        """
+        Patch the charge COP coefficients of the already built matrices
+
+        :param cop_chg: New charge COP for every interval of the window
+        :return bool: False if the model must be rebuilt instead
+        """
+        self.metrics = new_metrics()
+        with timed(self.metrics, 'build_time'):
+            self.cop_chg = pandas.Series(list(cop_chg),
+                                         index=self.cop_chg.index)
+            if self.pure_lp and not self._is_selector_free():
+                return False
+            cop_chg = self.cop_chg.values
+
+            cof = self._index(2)
+            rows = [self.balance_rows]
+            cols = [cof[:-1]]
+            values = [0.25 * cop_chg[:-1]]
+
+            # ===== OPTIONAL CONSTRAINT =====
+            for curve_rows in self.chg_curve_rows:
+                rows.append(curve_rows)
+                cols.append(cof)
+                values.append(cop_chg)
+
+            coefficients = tuple(np.concatenate(block)
+                                 for block in (rows, cols, values))
+            self.a[coefficients[0], coefficients[1]] = coefficients[2]
+            self.solver.update_matrix(self.a, coefficients=coefficients)
+
+        return True
+
+    def update_capacity(self, capacity, heat_leak):
+        """
+        Patch the RB capacity of the already built matrices
+
+        :param float capacity: New RB tank capacity in KWH_thermal
+        :param heat_leak: Heat leak of every interval at the new capacity
+        :return bool: False if the model must be rebuilt instead
+        """
+        self.metrics = new_metrics()
+        with timed(self.metrics, 'build_time'):
+            self.rb_capacity = capacity
+            self.heat_leak = pandas.Series(list(heat_leak),
+                                           index=self.heat_leak.index)
+            heat_leak = self.heat_leak.values
+
+            soc = self._index(0)
+            self.ub[soc] = capacity
+            coefficients = (self.balance_rows, soc[:-1],
+                            1 - 0.25 * heat_leak[:-1])
+            self.a[coefficients[0], coefficients[1]] = coefficients[2]
+            self.solver.update_matrix(
+                self.a, coefficients=coefficients,
+                columns=(soc, self.lb[soc], self.ub[soc]))
+
+        return True
+
+    def resolve(self, df, building_power_column='building_baseline',
+                temperature_column='temperature'):
+        """
+        Re-solve the already built matrices, warm started from the previous
+        solution, and produce the new target schedule.
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str building_power_column: Name of building baseline column
+        :param str temperature_column: Name of air temperature column
+        :return DataFrame: Target building time series output with offsets
+        """
+        self._solve_frame(warm_start=True)
+
+        with timed(self.metrics, 'extract_time'):
+            return self._get_target(
+                df, building_power_column=building_power_column,
+                temperature_column=temperature_column)
+
+    def _get_solution(self):
+        """
+        Fetch the solved offsets & SOC for every interval of the window
+
+        :return tuple: Discharge offsets, charge offsets and SOC values
+        """
+        return (self.solution[self._index(1)],
+                self.solution[self._index(2)],
+                self.solution[self._index(0)])
+
+    def write_frame(self, file_name):
+        """
+        Write the constraint matrix and bounds to a compressed NumPy file
+
+        :param str file_name:: file path for storing the model
+        """
+        np.savez_compressed(file_name, c=self.c, lb=self.lb, ub=self.ub,
+                            integrality=self.integrality,
+                            a_data=self.a.data, a_indices=self.a.indices,
+                            a_indptr=self.a.indptr, a_shape=self.a.shape,
+                            a_lb=self.a_lb, a_ub=self.a_ub)
+
+    def solve(self, df, building_power_column='building_baseline',
+              crs_power_column='crs_baseline',
+              temperature_column='temperature',
+              discharge_limit_column='discharge_limits',
+              charge_limit_column='charge_limits',
+              cop_charge_column='cop_charge',
+              cop_discharge_column='cop_discharge'):
+        """
+        Builds the matrix model, solves it and produces the same target
+        schedule as Optimizer.solve.
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str building_power_column: Name of building baseline column
+        :param str crs_power_column: Name of CRS baseline column
+        :param str temperature_column: Name of air temperature column
+        :param str discharge_limit_column: Name of discharge limit column
+        :param str charge_limit_column: Name of charge limit column
+        :return DataFrame: Target building time series output with offsets
+        """
+        self.metrics = new_metrics()
+        with timed(self.metrics, 'build_time'):
+            self.calendar = get_tariff_calendar(self.tariff_id, df.index)
+            self._prepare_inputs(df,
+                                 crs_power_column=crs_power_column,
+                                 temperature_column=temperature_column,
+                                 discharge_limit_column=discharge_limit_column,
+                                 charge_limit_column=charge_limit_column,
+                                 cop_charge_column=cop_charge_column,
+                                 cop_discharge_column=cop_discharge_column)
+            self.pure_lp = (self.selector_elimination and
+                            self._is_selector_free())
+            self._define_variables()
+            self._define_objective(
+                df, building_power_column=building_power_column)
+            self._add_constraints(
+                df, building_power_column=building_power_column)
+        common.debug("Built constraint matrices {}".format(
+            self.metrics['build_time']))
+
+        self._solve_frame()
+
+        if self.pure_lp and self.verify_selector_free:
+            self._verify_selector_free()
+
+        with timed(self.metrics, 'extract_time'):
+            return self._get_target(df)
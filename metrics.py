@@ -0,0 +1,156 @@
+"""
+This module holds the instrumentation of the optimizers. Every optimizer
+keeps a metrics dict of its last build & solve (stage times, model size,
+status, MIP gap and objective). The iterative runner adds billing time and
+the iteration to it, and a MetricsRecorder collects one record per window
+iteration for export to CSV or JSON.
+
+"""
+# System imports
+import json
+import time
+from contextlib import contextmanager
+
+# 3rd party imports
+import pandas
+
+METRIC_FIELDS = (
+    'build_time',
+    'solve_time',
+    'extract_time',
+    'variables',
+    'constraints',
+    'status',
+    'mip_gap',
+    'objective',
+)
+
+
+def new_metrics():
+    """
+    Empty metrics of a single build & solve
+
+    :return dict: Zero stage times, the other metrics unset
+    """
+    metrics = dict.fromkeys(METRIC_FIELDS)
+    metrics.update(build_time=0.0, solve_time=0.0, extract_time=0.0)
+    return metrics
+
+
+@contextmanager
+def timed(metrics, key):
+    """
+    Add the wall time of the block to a metric
+
+    :param dict metrics: Metrics to update
+    :param str key: Time metric, e.g. 'solve_time'
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics[key] = metrics.get(key, 0.0) + time.perf_counter() - start
+
+
+def combine_metrics(metrics_list):
+    """
+    Combine the metrics of the sub-problems of one window
+
+    Times, model sizes and objectives add up, the MIP gap is the largest and
+    the status is the first one that isn't optimal.
+
+    :param metrics_list: Metrics of every sub-problem
+    :return dict: Combined metrics
+    """
+    combined = new_metrics()
+    gaps = []
+    for metrics in metrics_list:
+        for key in ('build_time', 'solve_time', 'extract_time',
+                    'variables', 'constraints', 'objective'):
+            if metrics.get(key) is not None:
+                combined[key] = (combined[key] or 0) + metrics[key]
+        if metrics.get('mip_gap') is not None:
+            gaps.append(metrics['mip_gap'])
+        if combined['status'] in (None, 'Optimal'):
+            combined['status'] = metrics.get('status')
+    combined['mip_gap'] = max(gaps) if gaps else None
+    return combined
+
+
+class MetricsRecorder:
+    """Collect metrics records of a run and export them
+
+    Attributes:
+        records (list): One dict per window iteration
+    """
+
+    def __init__(self):
+        """
+        Initialize the MetricsRecorder object.
+        """
+        self.records = []
+
+    def record(self, **fields):
+        """
+        Add a single record
+
+        :param fields: Metrics & identifying fields, e.g. site & time_frame
+        """
+        self.records.append(fields)
+
+    def extend(self, records, **fields):
+        """
+        Add records, with common identifying fields
+
+        :param records: Metrics records
+        :param fields: Fields added to every record, e.g. site
+        """
+        for record in records:
+            self.records.append({**fields, **record})
+
+    def to_frame(self):
+        """
+        Records as a DataFrame, one row per record
+
+        :return DataFrame: Records
+        """
+        return pandas.DataFrame(self.records)
+
+    def windows(self):
+        """
+        Totals of every window, slowest first
+
+        :return DataFrame: Stage times, iterations & final status by window
+        """
+        frame = self.to_frame()
+        keys = [key for key in ('site', 'time_frame') if key in frame]
+        frame['time_frame'] = frame['time_frame'].astype(str)
+        totals = frame.groupby(keys, sort=False).agg(
+            build_time=('build_time', 'sum'),
+            solve_time=('solve_time', 'sum'),
+            extract_time=('extract_time', 'sum'),
+            billing_time=('billing_time', 'sum'),
+            iterations=('iteration', 'max'),
+            status=('status', 'last'),
+        )
+        totals['total_time'] = totals[['build_time', 'solve_time',
+                                       'extract_time',
+                                       'billing_time']].sum(axis=1)
+        return totals.sort_values('total_time', ascending=False)
+
+    def to_csv(self, file_name):
+        """
+        Write the records to a CSV file
+
+        :param str file_name: CSV file path
+        """
+        self.to_frame().to_csv(file_name, index=False)
+
+    def to_json(self, file_name):
+        """
+        Write the records to a JSON file
+
+        :param str file_name: JSON file path
+        """
+        with open(file_name, 'w') as f:
+            json.dump(self.records, f, indent=2, default=str)
@@ -0,0 +1,444 @@
+"""
+This module holds a specialized dispatch engine for the LT setback problem.
+With all optional constraints disabled, the RB is a single storage state
+with charge & discharge limits, COP's and heat leak, and the bill is driven
+by the peak demand of every period. The PeakThresholdOptimizer bisects on
+the peak demand thresholds and checks each candidate with an exact SOC
+feasibility pass instead of solving a MILP.
+
+"""
+# System imports
+import sys
+
+# 3rd party imports
+import numpy as np
+import pandas
+from tariff import NON_COINCIDENT
+
+# Project imports
+from optimizer_engine import common
+from lt_optimizer import Optimizer
+from metrics import new_metrics, timed
+from tariff_calendar import get_tariff_calendar
+
+# Tolerance of the peak threshold bisection in kW
+THRESHOLD_TOLERANCE = 0.01
+
+# Number of thresholds scanned for the most expensive peak
+SCAN_POINTS = 8
+
+# Number of scans, each refined around the best threshold of the previous
+SCAN_ROUNDS = 2
+
+# Numerical tolerance of the SOC feasibility pass
+EPSILON = 1e-9
+
+
+class PeakThresholdOptimizer(Optimizer):
+    """Find a target building load by peak threshold bisection
+
+    For a given threshold of every demand peak, the lowest & highest SOC
+    from which the rest of the window can still be operated are found with
+    a backward pass. A threshold set is feasible if the initial SOC lies in
+    that range, and the schedule follows with a forward pass that discharges
+    what the thresholds require and charges only as late as possible. The
+    thresholds are lowered one peak at a time, most expensive first, for a
+    scan of thresholds of the most expensive peak.
+
+    Energy charges are evaluated but not optimized, the schedule only keeps
+    charging to the minimum that the discharges require.
+
+    Attributes:
+        levels (dict): Peak thresholds, by season and period
+        objective (float): Objective value of the final schedule
+        solution (tuple): Discharge offsets, charge offsets and SOC arrays
+    """
+
+    def __init__(self, config, optimize_energy=True):
+        """
+        Initialize the PeakThresholdOptimizer object.
+
+        :param dict config: dictionary with input configurations
+        :param bool optimize_energy: Include energy charges in the objective,
+            evaluated but not optimized
+        """
+        super().__init__(config, optimize_energy=optimize_energy)
+
+        active = [name for name, value in self.constraints.items() if value]
+        if active:
+            raise ValueError('Peak threshold engine does not support the '
+                             'constraints: {}'.format(', '.join(active)))
+        if optimize_energy:
+            common.warning('Peak threshold engine does not optimize energy '
+                           'charges, "optimize_energy" is only evaluated')
+
+        self.levels = None
+        self.objective = None
+        self.solution = None
+
+        # Input arrays of the window
+        self.building_power = None
+        self.dof_max = None
+        self.cof_max = None
+        self.cop_dchg_values = None
+        self.cop_chg_values = None
+        self.heat_leak_values = None
+        self.masks = None
+
+    def _schedule(self, caps):
+        """
+        Build the schedule that keeps the load under the interval caps
+
+        :param ndarray caps: Maximum target load of every interval
+        :return tuple: DOF, COF & SOC arrays, or None if infeasible
+        """
+        n = len(caps)
+        dof_required = np.maximum(self.building_power - caps, 0)
+        if np.any(dof_required > self.dof_max + EPSILON):
+            return None
+        cof_max = np.clip(caps - self.building_power, 0, self.cof_max)
+
+        # Plain lists keep the sequential passes fast
+        discharge = (0.25 * self.cop_dchg_values).tolist()
+        charge = (0.25 * self.cop_chg_values).tolist()
+        keep = (1 - 0.25 * self.heat_leak_values).tolist()
+        dof_max = self.dof_max.tolist()
+        dof_required = dof_required.tolist()
+        cof_max = cof_max.tolist()
+
+        # Backward pass for the lowest & highest feasible SOC
+        lowest = [0.0] * n
+        highest = [0.0] * n
+        if self.soc_final is None:
+            lowest[-1], highest[-1] = self.rb_min_soc, self.rb_capacity
+        else:
+            lowest[-1] = highest[-1] = self.soc_final
+        for t in range(n - 2, -1, -1):
+            lowest[t] = max(self.rb_min_soc,
+                            (lowest[t + 1] + discharge[t] * dof_required[t] -
+                             charge[t] * cof_max[t]) / keep[t])
+            highest[t] = min(self.rb_capacity,
+                             (highest[t + 1] +
+                              discharge[t] * dof_max[t]) / keep[t])
+            if lowest[t] > highest[t] + EPSILON:
+                return None
+
+        if not (lowest[0] - EPSILON <= self.soc_init <=
+                highest[0] + EPSILON):
+            return None
+
+        # Forward pass, charging only what the discharges require
+        dof = dof_required
+        cof = [0.0] * n
+        soc = [0.0] * n
+        soc[0] = self.soc_init
+        for t in range(n - 1):
+            natural = soc[t] * keep[t] - discharge[t] * dof[t]
+            if natural < lowest[t + 1]:
+                cof[t] = min((lowest[t + 1] - natural) / charge[t],
+                             cof_max[t])
+            elif natural > highest[t + 1]:
+                dof[t] = min(dof[t] + (natural - highest[t + 1]) /
+                             discharge[t], dof_max[t])
+            soc[t + 1] = (soc[t] * keep[t] - discharge[t] * dof[t] +
+                          charge[t] * cof[t])
+
+        return np.array(dof), np.array(cof), np.array(soc)
+
+    def _lower_levels(self, levels, keys, schedule):
+        """
+        Lower the thresholds of the given peaks as far as they stay feasible
+
+        :param dict levels: Feasible peak thresholds, by (season, period)
+        :param list keys: Peaks to lower, in order
+        :param tuple schedule: Schedule of the given thresholds
+        :return tuple: Lowered thresholds and their schedule
+        """
+        levels = dict(levels)
+        for key in keys:
+            season, period = key
+            mask = self.masks[key]
+            low = max(self.demand_peaks[season][period],
+                      (self.building_power[mask] - self.dof_max[mask]).max())
+            high = levels[key]
+            while high - low > THRESHOLD_TOLERANCE:
+                middle = (low + high) / 2
+                candidate = self._schedule(self._caps({**levels, key: middle}))
+                if candidate is None:
+                    low = middle
+                else:
+                    high = middle
+                    schedule = candidate
+            levels[key] = high
+        return levels, schedule
+
+    def _scan_level(self, levels, keys, level):
+        """
+        Fix the threshold of the most expensive peak & lower all others
+
+        :param dict levels: Feasible peak thresholds, by (season, period)
+        :param list keys: Peaks ordered by cost, most expensive first
+        :param float level: Threshold of the most expensive peak
+        :return tuple: Objective, thresholds & schedule, None if infeasible
+        """
+        start = {**levels, keys[0]: level}
+        for key in keys[1:]:
+            start[key] = self.building_power[self.masks[key]].max()
+        schedule = self._schedule(self._caps(start))
+        if schedule is None:
+            return None
+        levels, schedule = self._lower_levels(start, keys[1:], schedule)
+        return self._evaluate(*schedule[:2]), levels, schedule
+
+    def _caps(self, levels):
+        """
+        Maximum target load of every interval for a set of peak thresholds
+
+        :param dict levels: Peak thresholds, by (season, period)
+        :return ndarray: Maximum target load of every interval
+        """
+        caps = np.full(len(self.building_power), np.inf)
+        for key, level in levels.items():
+            caps[self.masks[key]] = np.minimum(caps[self.masks[key]], level)
+        return caps
+
+    def _evaluate(self, dof, cof):
+        """
+        Objective value of a schedule, matching the MILP objective
+
+        :param ndarray dof: Discharge offsets
+        :param ndarray cof: Charge offsets
+        :return float: Objective value
+        """
+        return evaluate_objective(self.building_power - dof + cof,
+                                  self.calendar, self.tariff.demand_rates(),
+                                  self.demand_peaks, self.optimize_energy)
+
+    def solve(self, df, building_power_column='building_baseline',
+              crs_power_column='crs_baseline',
+              temperature_column='temperature',
+              discharge_limit_column='discharge_limits',
+              charge_limit_column='charge_limits',
+              cop_charge_column='cop_charge',
+              cop_discharge_column='cop_discharge'):
+        """
+        Bisect on the peak thresholds & produce the target schedule with
+        the same columns as Optimizer.solve.
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :param str building_power_column: Name of building baseline column
+        :param str crs_power_column: Name of CRS baseline column
+        :param str temperature_column: Name of air temperature column
+        :param str discharge_limit_column: Name of discharge limit column
+        :param str charge_limit_column: Name of charge limit column
+        :return DataFrame: Target building time series output with offsets
+        """
+        self.metrics = new_metrics()
+        with timed(self.metrics, 'build_time'):
+            self.calendar = get_tariff_calendar(self.tariff_id, df.index)
+            self._prepare_inputs(df,
+                                 crs_power_column=crs_power_column,
+                                 temperature_column=temperature_column,
+                                 discharge_limit_column=discharge_limit_column,
+                                 charge_limit_column=charge_limit_column,
+                                 cop_charge_column=cop_charge_column,
+                                 cop_discharge_column=cop_discharge_column)
+
+            self.building_power = np.asarray(df[building_power_column],
+                                             dtype=float)
+            self.dof_max = np.clip(np.asarray(self.dchg_limits, dtype=float),
+                                   0, self.mdl)
+            self.cof_max = np.maximum(
+                np.asarray(self.chg_limits, dtype=float), 0)
+            self.cop_dchg_values = np.asarray(self.cop_dchg, dtype=float)
+            self.cop_chg_values = np.asarray(self.cop_chg, dtype=float)
+            self.heat_leak_values = np.asarray(self.heat_leak, dtype=float)
+
+            # Intervals covered by every peak present in the window
+            demand_charges = self.tariff.demand_rates()
+            self.masks = {}
+            weights = {}
+            for season in self.demand_peaks:
+                in_season = self.calendar.season == season
+                for period in self.demand_peaks[season]:
+                    mask = in_season
+                    if period != NON_COINCIDENT:
+                        mask = in_season & (self.calendar.period == period)
+                    if mask.any():
+                        self.masks[(season, period)] = mask
+                        weights[(season, period)] = (
+                                demand_charges[season][period] *
+                                np.count_nonzero(in_season) / len(in_season))
+
+        with timed(self.metrics, 'solve_time'):
+            levels = {key: self.building_power[mask].max()
+                      for key, mask in self.masks.items()}
+            schedule = self._schedule(self._caps(levels))
+
+            if schedule is None:
+                self.status = 'Infeasible'
+                n = len(self.building_power)
+                schedule = (np.zeros(n), np.zeros(n), np.full(n, np.nan))
+            else:
+                keys = sorted(weights, key=weights.get, reverse=True)
+                levels, schedule = self._lower_levels(levels, keys, schedule)
+
+                # Lowering the most expensive peak as far as possible can block
+                # cheaper peaks, so scan its threshold for the best trade-off
+                if len(keys) > 1:
+                    first = keys[0]
+                    best = (self._evaluate(*schedule[:2]), levels, schedule)
+                    low = levels[first]
+                    high = self.building_power[self.masks[first]].max()
+                    for _ in range(SCAN_ROUNDS):
+                        grid = np.linspace(low, high, SCAN_POINTS)
+                        for level in grid:
+                            candidate = self._scan_level(levels, keys, level)
+                            if candidate and candidate[0] < best[0]:
+                                best = candidate
+
+                        # Refine the scan around the best threshold so far
+                        step = grid[1] - grid[0]
+                        low = max(levels[first], best[1][first] - step)
+                        high = best[1][first] + step
+                    _, levels, schedule = best
+                self.status = 'Feasible'
+
+        common.debug("Convergence time {}".format(self.metrics['solve_time']))
+        common.debug("Solution status: {}".format(self.status))
+
+        self.levels = levels
+        self.solution = schedule
+        self.objective = self._evaluate(schedule[0], schedule[1])
+        self.metrics.update(status=self.status, objective=self.objective)
+
+        with timed(self.metrics, 'extract_time'):
+            return self._get_target(df)
+
+    def _get_solution(self):
+        """
+        Fetch the offsets & SOC for every interval of the window
+
+        :return tuple: Discharge offsets, charge offsets and SOC values
+        """
+        return self.solution
+
+    def update_cop_charge(self, cop_chg):
+        """
+        Set the charge COP for the next solve of the window
+
+        :param cop_chg: New charge COP for every interval of the window
+        :return bool: Always True, the window is re-solved with the new COP's
+        """
+        self.cop_chg = pandas.Series(list(cop_chg), index=self.cop_chg.index)
+        return True
+
+    def update_capacity(self, capacity, heat_leak):
+        """
+        Set the RB capacity for the next solve of the window, the heat leak
+        is read from the power data of the solve
+
+        :param float capacity: New RB tank capacity in KWH_thermal
+        :param heat_leak: Heat leak of every interval at the new capacity
+        :return bool: Always True
+        """
+        self.rb_capacity = capacity
+        return True
+
+    def resolve(self, df, building_power_column='building_baseline',
+                temperature_column='temperature'):
+        """
+        Re-solve the window with the updated charge COP's
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :return DataFrame: Target building time series output with offsets
+        """
+        return self.solve(df.assign(cop_charge=self.cop_chg.values),
+                          building_power_column=building_power_column,
+                          temperature_column=temperature_column)
+
+
+def evaluate_objective(load_values, calendar, demand_charges, demand_peaks,
+                       optimize_energy=True):
+    """
+    Evaluate the optimizer objective for a target load
+
+    :param load_values: Target load of every interval
+    :param TariffCalendar calendar: Tariff calendar of the window
+    :param dict demand_charges: Demand rates, by season and period
+    :param dict demand_peaks: Historical peaks, by season and period
+    :param bool optimize_energy: Include energy charges
+    :return float: Objective value
+    """
+    load_values = np.asarray(load_values, dtype=float)
+    objective = 0
+    for season in demand_peaks:
+        in_season = calendar.season == season
+        fraction = np.count_nonzero(in_season) / len(in_season)
+        for period, rate in demand_charges[season].items():
+            mask = in_season
+            if period != NON_COINCIDENT:
+                mask = in_season & (calendar.period == period)
+            peak = demand_peaks[season][period]
+            if mask.any():
+                peak = max(peak, load_values[mask].max())
+            objective += max(peak, 0) * rate * fraction
+
+    if optimize_energy:
+        objective += np.sum(calendar.energy_tariff * load_values) / 4
+    return objective
+
+
+def objective_gap(df, config, optimize_energy=True,
+                  reference_class=Optimizer):
+    """
+    Compare the peak threshold engine against a MILP optimizer on a window
+
+    :param DataFrame df: Power data of the window
+    :param dict config: Optimizer configuration
+    :param bool optimize_energy: Include energy charges in the objective
+    :param type reference_class: Optimizer class of the reference solve
+    :return dict: Objective of both engines and the relative gap, the
+        absolute gap if the MILP objective is 0
+    """
+    config = dict(config, start=df.index[0], end=df.index[-1])
+    results = {}
+    for name, optimizer_class in (('milp', reference_class),
+                                  ('peak', PeakThresholdOptimizer)):
+        optimizer = optimizer_class(config, optimize_energy=optimize_energy)
+        target = optimizer.solve(df)
+        results[f'{name}_objective'] = evaluate_objective(
+            target['load_values'], optimizer.calendar,
+            optimizer.tariff.demand_rates(), optimizer.demand_peaks,
+            optimize_energy)
+        results[f'{name}_time'] = sum(
+            optimizer.metrics[key]
+            for key in ('build_time', 'solve_time', 'extract_time'))
+
+    results['gap'] = results['peak_objective'] - results['milp_objective']
+    if results['milp_objective'] != 0:
+        results['gap'] /= abs(results['milp_objective'])
+    return results
+
+
+if __name__ == '__main__':
+    import batch
+    import load
+
+    sites = sys.argv[1:] or [site for site in batch.get_config_stores()
+                             if batch.find_power_file(site)]
+    gaps = []
+    for site in sites:
+        power_data, master_conf = load.load_data(
+            site, batch.DEFAULT_START, batch.DEFAULT_END,
+            batch.find_power_file(site), batch.find_config_file(site))
+        for month, month_data in power_data.groupby('month', observed=True):
+            for optimize_energy in (False, True):
+                gap = objective_gap(month_data,
+                                    master_conf['optimizer_config'],
+                                    optimize_energy=optimize_energy)
+                gaps.append({'site': site, 'month': month,
+                             'optimize_energy': optimize_energy, **gap})
+                print(gaps[-1])
+
+    print(pandas.DataFrame(gaps))
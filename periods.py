@@ -0,0 +1,30 @@
+"""
+This module labels timestamps with the billing month or date they belong
+to, as categoricals whose categories are in time order.
+
+"""
+# 3rd party imports
+import numpy as np
+import pandas as pd
+
+
+def period_codes(timestamps, period):
+    """
+    Label every timestamp with its month or date as a categorical.
+
+    :param DatetimeIndex timestamps: Localized timestamps
+    :param str period: 'month' or 'date'
+    :return: Categorical of YYYY-MM or YYYY-MM-DD labels in time order
+    """
+    codes = timestamps.year * 100 + timestamps.month
+    label = '%Y-%m'
+    if period == 'date':
+        codes = codes * 100 + timestamps.day
+        label = '%Y-%m-%d'
+    elif period != 'month':
+        raise ValueError(f'Unknown period {period}')
+
+    _, first, inverse = np.unique(codes, return_index=True,
+                                  return_inverse=True)
+    return pd.Categorical.from_codes(inverse,
+                                     timestamps[first].strftime(label))
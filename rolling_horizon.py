@@ -0,0 +1,188 @@
+"""
+This module holds the rolling-horizon (receding-horizon) mode of the
+schedule optimizer. Long windows are solved as a sequence of short lookahead
+windows, of which only the first block of intervals is committed. The SOC
+and the running billing-period peaks are carried forward into the next
+lookahead window as its initial SOC and historical peaks, and the terminal
+SOC of every lookahead window but the last is left free.
+
+"""
+# System imports
+import copy
+
+# 3rd party imports
+import numpy as np
+import pandas
+from tariff import NON_COINCIDENT
+
+# Project imports
+from lt_optimizer import Optimizer
+from metrics import combine_metrics, new_metrics
+from tariff_calendar import get_tariff, get_tariff_calendar
+
+
+def get_peaks(load_values, calendar, peaks):
+    """
+    Update billing-period peaks with the load of a block of intervals
+
+    :param load_values: Load of every interval of the block
+    :param TariffCalendar calendar: Tariff calendar of the block
+    :param dict peaks: Peaks so far, by season and period
+    :return dict: Updated peaks, by season and period
+    """
+    load_values = np.asarray(load_values, dtype=float)
+    peaks = copy.deepcopy(peaks)
+    for season in peaks:
+        in_season = calendar.season == season
+        for period in peaks[season]:
+            mask = in_season
+            if period != NON_COINCIDENT:
+                mask = in_season & (calendar.period == period)
+            if mask.any():
+                peaks[season][period] = max(peaks[season][period],
+                                            load_values[mask].max())
+    return peaks
+
+
+class RollingHorizonOptimizer:
+    """Solve a long window as a sequence of lookahead windows
+
+    Every lookahead window of `horizon` intervals is solved with the wrapped
+    optimizer class and its first `commit` intervals are kept. Lookahead
+    windows are cut at the end of a billing period, and only the last one
+    is held to the terminal SOC. Solve time grows linearly with the length
+    of the data instead of with the size of a single model.
+
+    Attributes:
+        config (dict): Optimizer configuration of the whole window
+        optimize_energy (bool): Include energy charges in the objective
+        optimizer_class (type): Optimizer used for every lookahead window
+        horizon (int): Number of intervals in every lookahead window
+        commit (int): Number of intervals committed from every window
+        status (str): Worst solution status of the lookahead windows
+        metrics (dict): Combined metrics of the lookahead windows
+        optimizers (list): Optimizers of the last solve
+    """
+
+    def __init__(self, config, optimize_energy=True,
+                 optimizer_class=Optimizer, horizon=192, commit=96):
+        """
+        Initialize the RollingHorizonOptimizer object.
+
+        :param dict config: dictionary with input configurations
+        :param bool optimize_energy: Include energy charges in the objective
+        :param type optimizer_class: Optimizer used for every window
+        :param int horizon: Number of intervals in every lookahead window
+        :param int commit: Number of intervals committed from every window
+        """
+        if not 0 < commit <= horizon:
+            raise ValueError('Rolling horizon commit length must be between '
+                             '1 and the horizon length')
+
+        self.config = config
+        self.optimize_energy = optimize_energy
+        self.optimizer_class = optimizer_class
+        self.horizon = horizon
+        self.commit = commit
+        self.status = None
+        self.metrics = new_metrics()
+        self.optimizers = []
+
+    def solve(self, df, **kwargs):
+        """
+        Solve the window one lookahead window at a time and join the
+        committed blocks into the target schedule.
+
+        :param DataFrame df: Building power, CRS power, and OAT time series
+        :return DataFrame: Target building time series output with offsets
+        """
+        tariff_id = self.config.get('tariff_id') or self.config['site_id']
+        calendar = get_tariff_calendar(tariff_id, df.index)
+
+        initial_peaks = self.config.get('peaks')
+        if not initial_peaks:
+            initial_peaks = copy.deepcopy(get_tariff(tariff_id).demand_rates())
+            for season in initial_peaks:
+                for period in initial_peaks[season]:
+                    initial_peaks[season][period] = 0
+
+        # Peaks are carried within a billing period only, so a lookahead
+        # window never runs past the billing period of its first interval
+        # and the peaks of every interval are those of its own period
+        months = (df['month'].values if 'month' in df.columns
+                  else np.zeros(len(df)))
+        period_ends = np.append(np.flatnonzero(months[1:] != months[:-1]) + 1,
+                                len(df))
+        peaks = {}
+
+        # Only the last lookahead window keeps the configured terminal SOC,
+        # the others leave it to the following windows
+        soc = self.config['SOC_initial']
+        soc_final = self.config.get('SOC_final', soc)
+
+        self.optimizers = []
+        blocks = []
+        start = 0
+        while start < len(df):
+            period_end = period_ends[np.searchsorted(period_ends, start,
+                                                     side='right')]
+            stop = min(start + self.horizon, period_end)
+            window = df.iloc[start:stop]
+            month = months[start]
+
+            window_config = dict(self.config)
+            window_config['start'] = window.index[0]
+            window_config['end'] = window.index[-1]
+            window_config['SOC_initial'] = soc
+            window_config['SOC_final'] = soc_final if stop == len(df) else None
+            window_config['peaks'] = peaks.get(month, initial_peaks)
+
+            optimizer = self.optimizer_class(
+                window_config, optimize_energy=self.optimize_energy)
+            target = optimizer.solve(window, **kwargs)
+            self.optimizers.append(optimizer)
+
+            # A window reaching the end of its billing period is committed
+            # as a whole
+            commit = len(window) if stop == period_end else self.commit
+            block = target.iloc[:commit]
+            blocks.append(block)
+
+            block_calendar = calendar._make(
+                values[start:start + commit] for values in calendar)
+            peaks[month] = get_peaks(block['load_values'].values,
+                                     block_calendar,
+                                     peaks.get(month, initial_peaks))
+
+            # The next billing period starts from the last committed SOC
+            soc = target['soc'].iloc[min(commit, len(window) - 1)]
+            start += commit
+
+        statuses = [optimizer.status for optimizer in self.optimizers]
+        self.status = next((status for status in statuses
+                            if status != 'Optimal'), 'Optimal')
+        self.metrics = combine_metrics(optimizer.metrics
+                                       for optimizer in self.optimizers)
+
+        return pandas.concat(blocks)
+
+    def update_cop_charge(self, cop_chg):
+        """
+        The lookahead windows start from the SOC & peaks of the windows
+        before them, so new charge COP's need a new solve of every window
+
+        :param cop_chg: New charge COP for every interval of the window
+        :return bool: Always False
+        """
+        return False
+
+    def update_capacity(self, capacity, heat_leak):
+        """
+        A new capacity changes the SOC carried between the lookahead
+        windows, so it needs a new solve of every window
+
+        :param float capacity: New RB tank capacity in KWH_thermal
+        :param heat_leak: Heat leak of every interval at the new capacity
+        :return bool: Always False
+        """
+        return False
@@ -1,5 +1,6 @@
 import datetime
 import pandas as pd
+import billing
 from tariff.bill_calculator import BillCalculator
 
 
@@ -7,49 +8,41 @@ def get_bill_calculator(config):
     return BillCalculator(config['site_id'])
 
 
+SAVINGS_COLUMNS = [
+    'month',
+    'LT_capacity',
+    'demand_savings',
+    'energy_savings',
+    'total_savings',
+    'baseline_bill',
+    'rte'
+]
+
+
+def _month_label(num):
+    return datetime.date(1900, num + 1, 1).strftime('%b')
+
+
 def generate_savings_table(targets, config):
-    savings = []
-    bill_calculator = get_bill_calculator(config)
+    savings = billing.calculate_savings(targets, config['site_id'])
+
+    month = [_month_label(num) for num in range(len(targets))]
+    savings.insert(0, 'month', month)
+    savings.insert(1, 'LT_capacity', config['lt_capacity'])
+
+    savings_table = pd.DataFrame(savings, columns=SAVINGS_COLUMNS)
+    return savings_table.reset_index(drop=True)
+
+
+def iter_savings_rows(targets, config):
+    """
+    Savings table rows of targets, one row per target as it arrives.
+
+    :param targets: Iterable of target DataFrames
+    :param dict config: LT Setback Config object
+    :return: Generator of rows matching SAVINGS_COLUMNS
+    """
     for num, target in enumerate(targets):
-        target = target.copy()
-
-        target = target.reset_index()
-
-        baseline_demand = bill_calculator.calculate_demand_bill(
-            target, load_column='baseline')
-        baseline_energy = bill_calculator.calculate_energy_bill(
-            target, load_column='baseline')
-        ideal_demand = bill_calculator.calculate_demand_bill(target)
-        ideal_energy = bill_calculator.calculate_energy_bill(target)
-
-        baseline_bill = baseline_demand + baseline_energy
-
-        demand_savings = baseline_demand - ideal_demand
-        energy_savings = baseline_energy - ideal_energy
-
-        total_savings = demand_savings + energy_savings
-
-        dchg = target[target['offsets'] > 0]['offsets'].sum()
-        chg = target[target['offsets'] < 0]['offsets'].sum()
-        rte = dchg / -chg
-
-        month = datetime.date(1900, num + 1, 1).strftime('%b')
-
-        row = (
-            month, config['lt_capacity'], demand_savings, energy_savings,
-            total_savings,
-            baseline_bill,
-            rte)
-        savings.append(row)
-
-    savings_columns = [
-        'month',
-        'LT_capacity',
-        'demand_savings',
-        'energy_savings',
-        'total_savings',
-        'baseline_bill',
-        'rte'
-    ]
-    savings_table = pd.DataFrame(savings, columns=savings_columns)
-    return savings_table
+        savings = billing.calculate_savings([target], config['site_id'])
+        yield (_month_label(num), config['lt_capacity'],
+               *savings.iloc[0][SAVINGS_COLUMNS[2:]])
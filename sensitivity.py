@@ -0,0 +1,310 @@
+"""
+This module runs the savings of a site over a grid of model parameters:
+sst_factor, MRC headroom, the SST range (sst_min_f & sst_max_f) and
+optimize_energy. The site data is loaded and preprocessed once, and its
+input arrays are placed in shared memory that every worker process maps
+read-only. A grid point only carries its parameters, so memory doesn't grow
+with the size of the grid. The savings of every grid point and window are
+returned as one tidy table, along with the warnings of the window's solve.
+
+"""
+# System imports
+import os
+import argparse
+import contextlib
+import io
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+
+# 3rd party imports
+import numpy as np
+import pandas as pd
+
+# Project imports
+import batch
+import config
+import load
+import thermal
+from billing import calculate_savings
+from iterative_optimizer import run_iterative_optimizer
+from periods import period_codes
+
+PARAMETERS = ('sst_factor', 'mrc_headroom', 'sst_min_f', 'sst_max_f',
+              'optimize_energy')
+
+# Power data columns shared with the workers, CRS load as discharge limits
+INPUT_COLUMNS = {
+    'building_baseline': 'building_baseline',
+    'temperature': 'temperature',
+    'crs_baseline': 'discharge_limits',
+}
+
+# Input arrays & frame of the current process
+_inputs = {}
+
+
+class SharedInputs:
+    """Input arrays of a site in shared memory blocks
+
+    Attributes:
+        blocks (dict): Shared memory block of every array
+        spec (dict): Block name, dtype & shape of every array, enough to
+            attach to the arrays from another process
+    """
+
+    def __init__(self, arrays):
+        """
+        Initialize the SharedInputs object, copying the arrays into shared
+        memory.
+
+        :param dict arrays: Array of every input name
+        """
+        self.blocks = {}
+        self.spec = {}
+        for name, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(values.nbytes, 1))
+            np.ndarray(values.shape, values.dtype, buffer=block.buf)[:] = \
+                values
+            self.blocks[name] = block
+            self.spec[name] = (block.name, values.dtype.str, values.shape)
+
+    def close(self):
+        """Release & remove the shared memory blocks"""
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _attach(spec, tz):
+    """
+    Map the shared input arrays of a worker process, once per process
+
+    :param dict spec: SharedInputs.spec of the arrays
+    :param tz: Timezone of the timestamps
+    """
+    blocks = {name: shared_memory.SharedMemory(name=block_name)
+              for name, (block_name, _, _) in spec.items()}
+    arrays = {name: np.ndarray(shape, dtype, buffer=blocks[name].buf)
+              for name, (_, dtype, shape) in spec.items()}
+    _set_inputs(arrays, tz)
+    _inputs['blocks'] = blocks
+
+
+def _set_inputs(arrays, tz):
+    index = pd.DatetimeIndex(arrays['timestamp'].view('M8[ns]'),
+                             name='timestamp')
+    index = index.tz_localize('UTC').tz_convert(tz)
+    # Built in one go without copying, so the input columns stay views of
+    # the shared arrays
+    columns = {column: arrays[column] for column in INPUT_COLUMNS}
+    _inputs['frame'] = pd.DataFrame(
+        {**columns, 'month': period_codes(index, 'month'),
+         'date': period_codes(index, 'date'), 'timestamp': index},
+        index=index, copy=False)
+
+
+def parameter_grid(grid):
+    """
+    Every combination of the parameter values of a grid
+
+    :param dict grid: Values of every varied parameter of PARAMETERS
+    :return list: Parameters of every grid point
+    """
+    unknown = set(grid) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f'Unknown sensitivity parameters {sorted(unknown)}')
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def point_config(master_conf, point):
+    """
+    Config of the site at a grid point
+
+    :param dict master_conf: LT Setback Config object of the site
+    :param dict point: Parameter values of the grid point
+    :return dict: Config with the parameters of the grid point
+    """
+    conf = dict(master_conf)
+    conf['optimizer_config'] = dict(master_conf['optimizer_config'])
+    if 'sst_min_f' in point or 'sst_max_f' in point:
+        conf.update(config.get_sst_config(
+            point.get('sst_min_f', master_conf['sst_min_f']),
+            point.get('sst_max_f', master_conf['sst_max_f'])))
+    if 'sst_factor' in point:
+        conf['sst_factor'] = point['sst_factor']
+    if 'optimize_energy' in point:
+        conf['optimize_energy'] = point['optimize_energy']
+    if 'mrc_headroom' in point:
+        conf['optimizer_config']['MRC'] = (conf['crs_max'] +
+                                           point['mrc_headroom'])
+    return conf
+
+
+def run_point(point, master_conf, period='month'):
+    """
+    Optimize every window of the shared inputs at a grid point
+
+    :param dict point: Parameter values of the grid point
+    :param dict master_conf: LT Setback Config object of the site
+    :param str period: Window of the optimization, 'month' or 'date'
+    :return list: Savings row of every window, with the warnings of its
+        solve
+    """
+    conf = point_config(master_conf, point)
+    frame = _inputs['frame']
+
+    # Only the thermal columns of the point are new arrays, the input
+    # columns are shared with the frame
+    columns = {column: frame[column] for column in frame.columns
+               if column != 'crs_baseline'}
+    power_data = pd.DataFrame(
+        {**columns, **thermal.get_thermal_info(frame, conf)},
+        index=frame.index, copy=False)
+
+    logs = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        targets = run_iterative_optimizer(
+            power_data.groupby(period, observed=True), conf, logs=logs)
+    savings = calculate_savings(targets, conf['optimizer_config']['site_id'])
+
+    labels = [period_codes(target.index[:1], period)[0] for target in targets]
+    return [{**point, period: label, **row,
+             'warnings': '; '.join(_warnings(logs.get(label, [])))}
+            for label, row in zip(labels, savings.to_dict('records'))]
+
+
+def _warnings(log):
+    """
+    Lines of a window log that flag a solve to look at, the iteration
+    limit and iterations that didn't solve to optimality
+
+    :param list log: Log lines of the window
+    :return list: Warning lines
+    """
+    return [line for line in log
+            if line.startswith('Warning') or
+            (line.startswith('Iteration') and not line.endswith('Optimal'))]
+
+
+def run_sensitivity(power_data, master_conf, grid, period='month',
+                    workers=1):
+    """
+    Savings of a site at every point of a parameter grid
+
+    :param DataFrame power_data: Power data with thermal info, as from
+        load.load_data
+    :param dict master_conf: LT Setback Config object of the site
+    :param dict grid: Values of every varied parameter of PARAMETERS
+    :param str period: Window of the optimization, 'month' or 'date'
+    :param int workers: Number of processes running grid points
+    :return DataFrame: One row per grid point & window
+    """
+    points = parameter_grid(grid)
+    arrays = {column: power_data[source].to_numpy(dtype=float)
+              for column, source in INPUT_COLUMNS.items()}
+    arrays['timestamp'] = power_data.index.asi8
+
+    master_conf = {**master_conf, 'workers': 1, 'target_cache': None,
+                   'crs_max': arrays['crs_baseline'].max()}
+    master_conf['optimizer_config'] = {**master_conf['optimizer_config'],
+                                       'solver_msg': False}
+    run = partial(run_point, master_conf=master_conf, period=period)
+
+    if workers > 1 and len(points) > 1:
+        with SharedInputs(arrays) as shared:
+            with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_attach,
+                    initargs=(shared.spec, power_data.index.tz)) as executor:
+                results = list(executor.map(run, points))
+    else:
+        _set_inputs(arrays, power_data.index.tz)
+        results = list(map(run, points))
+    _inputs.clear()
+
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+def sensitivity_site(site, grid, start=batch.DEFAULT_START,
+                     end=batch.DEFAULT_END, period='month', workers=1,
+                     path=batch.INPUT_PATH):
+    """
+    Savings of a single site at every point of a parameter grid
+
+    :param str site: Store name, e.g. WM3138
+    :param dict grid: Values of every varied parameter of PARAMETERS
+    :param str start: Start time of data to analyze
+    :param str end: End time of data to analyze
+    :param str period: Window of the optimization, 'month' or 'date'
+    :param int workers: Number of processes running grid points
+    :param str path: Directory holding the site power files
+    :return DataFrame: One row per grid point & window, None if the site
+        can't be run
+    """
+    power_file = batch.find_power_file(site, path)
+    config_file = batch.find_config_file(site)
+    if power_file is None or config_file is None:
+        print(f"Can't find power data or config file for {site}")
+        return None
+
+    print(f'Running sensitivity of site {site}')
+    power_data, master_conf = load.load_data(site, start, end, power_file,
+                                             config_file)
+    table = run_sensitivity(power_data, master_conf, grid, period, workers)
+    table.insert(0, 'site', site)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the savings of sites over a parameter grid')
+    parser.add_argument('sites', nargs='*',
+                        help='Stores to run, every store with data if empty')
+    parser.add_argument('--sst-factor', nargs='+', type=float)
+    parser.add_argument('--mrc-headroom', nargs='+', type=float,
+                        help=f'kW above the peak CRS load, '
+                             f'{load.MRC_HEADROOM} by default')
+    parser.add_argument('--sst-min-f', nargs='+', type=float)
+    parser.add_argument('--sst-max-f', nargs='+', type=float)
+    parser.add_argument('--optimize-energy', nargs='+',
+                        choices=['true', 'false'])
+    parser.add_argument('--start', default=batch.DEFAULT_START)
+    parser.add_argument('--end', default=batch.DEFAULT_END)
+    parser.add_argument('--period', default='month',
+                        choices=['month', 'date'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--input', default=batch.INPUT_PATH)
+    parser.add_argument('--output', default='output/')
+    args = parser.parse_args()
+
+    grid = {name: getattr(args, name) for name in PARAMETERS
+            if getattr(args, name) is not None}
+    if 'optimize_energy' in grid:
+        grid['optimize_energy'] = [value == 'true'
+                                   for value in grid['optimize_energy']]
+
+    sites = args.sites or [site for site in batch.get_config_stores()
+                           if batch.find_power_file(site, args.input)]
+    tables = [sensitivity_site(site, grid, args.start, args.end, args.period,
+                               args.workers, args.input)
+              for site in sites]
+    tables = [table for table in tables if table is not None]
+    sensitivity_table = pd.concat(tables, ignore_index=True) if tables else \
+        pd.DataFrame()
+
+    os.makedirs(args.output, exist_ok=True)
+    sensitivity_table.to_csv(os.path.join(args.output, 'sensitivity.csv'),
+                             index=False)
+    print(sensitivity_table)
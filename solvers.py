@@ -0,0 +1,441 @@
+"""
+This module holds the solver backends of the optimizers. A backend is picked
+by the "solver" entry of the optimizer config and sets the threads, time
+limit and relative MIP gap of the solve. PuLP frames are solved by the CBC
+or GLPK command line solvers, or in-process by HiGHS (through highspy) after
+being exported to sparse matrices, without any model or solution files.
+Either way the solution comes back as an array of variable values in the
+column order of the caller. HiGHS keeps the model of its last solve, so a
+re-solve only passes the coefficients and bounds changed since. The matrix
+engine runs HiGHS only.
+
+"""
+# 3rd party imports
+import numpy as np
+import pulp
+from scipy import sparse
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+# Project imports
+from optimizer_engine import common
+
+DEFAULT_TIME_LIMIT = 120
+
+# Map of HiGHS model statuses to the PuLP status names
+HIGHS_STATUS = {
+    'kOptimal': 'Optimal',
+    'kInfeasible': 'Infeasible',
+    'kUnboundedOrInfeasible': 'Infeasible',
+    'kUnbounded': 'Unbounded',
+    'kTimeLimit': 'Not Solved',
+    'kIterationLimit': 'Not Solved',
+    'kSolutionLimit': 'Not Solved',
+    'kInterrupt': 'Not Solved',
+}
+LP_STATUS_CODES = {name: code for code, name in pulp.LpStatus.items()}
+
+# HiGHS primal solution status of a feasible solution
+SOLUTION_FEASIBLE = 2
+
+# Thread count of the HiGHS scheduler of this process
+_scheduler = {'threads': None}
+
+
+class SolverBackend:
+    """Solve PuLP frames (and optionally matrix models) with one solver
+
+    Attributes:
+        name (str): Name of the backend in the optimizer config
+        threads (int): Solver threads, None for the solver default
+        time_limit (float): Time limit of a solve in seconds
+        mip_gap (float): Relative MIP gap, None for the solver default
+        solves_matrices (bool): Whether the backend solves matrix models
+    """
+    name = None
+    solves_matrices = False
+
+    def __init__(self, threads=None, time_limit=DEFAULT_TIME_LIMIT,
+                 mip_gap=None):
+        """
+        Initialize the SolverBackend object.
+
+        :param int threads: Solver threads, None for the solver default
+        :param float time_limit: Time limit of a solve in seconds
+        :param float mip_gap: Relative MIP gap, None for the solver default
+        """
+        self.threads = threads
+        self.time_limit = time_limit
+        self.mip_gap = mip_gap
+
+    def available(self):
+        """Whether the solver can run here"""
+        raise NotImplementedError
+
+    def solve_problem(self, frame, variables, msg=False, warm_start=False):
+        """
+        Solve a PuLP frame
+
+        :param LpProblem frame: PuLP problem
+        :param list variables: Variables of the frame, in column order
+        :param bool msg: Print solver output
+        :param bool warm_start: Start the solver from the current solution
+        :return tuple: PuLP solution status, array of the variable values
+            (NaN if unsolved) & objective value
+        """
+        raise NotImplementedError
+
+    def update_problem(self, frame, coefficients=(), rows=(), columns=()):
+        """
+        Pass the changes of an already solved PuLP frame on to its next
+        solve. The command line solvers export the whole frame on every
+        solve, so there's nothing to pass on.
+
+        :param LpProblem frame: PuLP problem, already patched
+        :param coefficients: (constraint, variable) pairs of the changed
+            coefficients
+        :param rows: Constraints with a changed constant
+        :param columns: Variables with changed bounds
+        """
+
+    def solve_matrix(self, c, integrality, lb, ub, a, a_lb, a_ub, msg=False,
+                     warm_start=False):
+        """
+        Solve a minimization in matrix form
+
+        :param ndarray c: Objective coefficients
+        :param ndarray integrality: 1 for integer columns, else 0
+        :param ndarray lb: Column lower bounds
+        :param ndarray ub: Column upper bounds
+        :param a: Sparse constraint matrix
+        :param ndarray a_lb: Row lower bounds
+        :param ndarray a_ub: Row upper bounds
+        :param bool msg: Print solver output
+        :param bool warm_start: Start the solver from the current solution
+        :return tuple: PuLP solution status, array of the variable values
+            (NaN if unsolved), objective value & relative MIP gap (None for
+            an LP)
+        """
+        raise ValueError(f'Solver "{self.name}" can\'t solve matrix models')
+
+    def update_matrix(self, a, coefficients=None, columns=None):
+        """
+        Pass the changes of an already solved matrix model on to its next
+        solve
+
+        :param a: Sparse constraint matrix of the model, already patched
+        :param tuple coefficients: Rows, columns & values of the changed
+            coefficients
+        :param tuple columns: Columns with changed bounds, with their lower
+            & upper bounds
+        """
+
+
+class CommandBackend(SolverBackend):
+    """Command line solver run by PuLP through model & solution files"""
+
+    def _command(self, msg=False, warm_start=False):
+        raise NotImplementedError
+
+    def available(self):
+        return self._command().available()
+
+    def solve_problem(self, frame, variables, msg=False, warm_start=False):
+        frame.solve(self._command(msg, warm_start))
+        values = np.array([variable.varValue for variable in variables],
+                          dtype=float)
+        return (pulp.LpStatus[frame.status], values,
+                pulp.value(frame.objective))
+
+
+class CbcBackend(CommandBackend):
+    """CBC command line solver bundled with PuLP"""
+    name = 'cbc'
+
+    def _command(self, msg=False, warm_start=False):
+        return pulp.PULP_CBC_CMD(timeLimit=self.time_limit,
+                                 gapRel=self.mip_gap,
+                                 threads=self.threads,
+                                 msg=msg,
+                                 warmStart=warm_start)
+
+
+class GlpkBackend(CommandBackend):
+    """GLPK command line solver, if installed"""
+    name = 'glpk'
+
+    def __init__(self, threads=None, time_limit=DEFAULT_TIME_LIMIT,
+                 mip_gap=None):
+        super().__init__(threads, time_limit, mip_gap)
+        if threads:
+            common.warning('GLPK is single threaded, "threads" is ignored')
+
+    def _command(self, msg=False, warm_start=False):
+        options = []
+        if self.mip_gap is not None:
+            options += ['--mipgap', str(self.mip_gap)]
+        return pulp.GLPK_CMD(msg=msg, timeLimit=self.time_limit,
+                             options=options)
+
+
+class HighsBackend(SolverBackend):
+    """In-process HiGHS solver driven through highspy
+
+    PuLP frames are handed over as matrices and the values of the frame's
+    variables are left unset, the solution is only returned as an array.
+    The model stays loaded after a solve, a later solve of the same frame
+    or matrix only needs the changes passed to update_problem or
+    update_matrix. A warm started re-solve of an LP continues from the
+    simplex basis of the previous solve, a MIP is seeded with the previous
+    solution as its incumbent.
+
+    Attributes:
+        highs (Highs): HiGHS instance holding the model of the last solve
+        model: PuLP frame or constraint matrix of the loaded model
+        rows (dict): Row of every constraint of a loaded frame, by id
+        columns (dict): Column of every variable of a loaded frame
+        integer (bool): Whether the loaded model has integer columns
+        values (ndarray): Solution of the last solve, None if unsolved
+    """
+    name = 'highs'
+    solves_matrices = True
+
+    def __init__(self, threads=None, time_limit=DEFAULT_TIME_LIMIT,
+                 mip_gap=None):
+        super().__init__(threads, time_limit, mip_gap)
+        self.highs = None
+        self.model = None
+        self.rows = {}
+        self.columns = {}
+        self.integer = False
+        self.values = None
+
+    def available(self):
+        return highspy is not None
+
+    def _load(self, model, c, integrality, lb, ub, a, a_lb, a_ub):
+        """
+        Load a minimization in matrix form into a new HiGHS instance
+
+        :param model: PuLP frame or constraint matrix of the model
+        :param ndarray c: Objective coefficients
+        :param ndarray integrality: 1 for integer columns, else 0
+        :param ndarray lb: Column lower bounds
+        :param ndarray ub: Column upper bounds
+        :param a: Sparse constraint matrix
+        :param ndarray a_lb: Row lower bounds
+        :param ndarray a_ub: Row upper bounds
+        """
+        a = sparse.csr_matrix(a)
+        highs = highspy.Highs()
+        highs.setOptionValue('output_flag', False)
+        # Every instance of a process shares one thread scheduler, which only
+        # takes another thread count once it's reset. 0 is the default count
+        threads = int(self.threads or 0)
+        if threads:
+            if _scheduler['threads'] not in (None, threads):
+                highspy.Highs.resetGlobalScheduler(True)
+            highs.setOptionValue('threads', threads)
+        if threads or _scheduler['threads'] is None:
+            _scheduler['threads'] = threads
+        if self.time_limit is not None:
+            highs.setOptionValue('time_limit', float(self.time_limit))
+        if self.mip_gap is not None:
+            highs.setOptionValue('mip_rel_gap', float(self.mip_gap))
+        highs.passModel(a.shape[1], a.shape[0], a.nnz,
+                        highspy.MatrixFormat.kRowwise,
+                        highspy.ObjSense.kMinimize, 0.0,
+                        np.asarray(c, dtype=float),
+                        np.asarray(lb, dtype=float),
+                        np.asarray(ub, dtype=float),
+                        np.asarray(a_lb, dtype=float),
+                        np.asarray(a_ub, dtype=float),
+                        a.indptr.astype(np.int32),
+                        a.indices.astype(np.int32),
+                        a.data.astype(float),
+                        np.asarray(integrality, dtype=np.int32))
+        self.highs = highs
+        self.model = model
+        self.integer = bool(np.any(integrality))
+        self.values = None
+
+    def _run(self, msg=False, warm_start=False):
+        """
+        Solve the loaded model
+
+        :param bool msg: Print solver output
+        :param bool warm_start: Start an LP from the basis of the previous
+            solve and a MIP from its solution
+        :return tuple: PuLP solution status, array of the variable values
+            (NaN if unsolved), objective value & relative MIP gap
+        """
+        highs = self.highs
+        highs.setOptionValue('output_flag', bool(msg))
+        if not warm_start:
+            highs.clearSolver()
+        elif self.integer and self.values is not None and \
+                np.isfinite(self.values).all():
+            # A MIP restarts its search, seeded with the previous solution
+            highs.setSolution(len(self.values),
+                              np.arange(len(self.values), dtype=np.int32),
+                              self.values)
+        highs.run()
+
+        status = HIGHS_STATUS.get(highs.getModelStatus().name, 'Undefined')
+        info = highs.getInfo()
+        mip_gap = info.mip_gap if self.integer else None
+        if info.primal_solution_status != SOLUTION_FEASIBLE:
+            self.values = None
+            return (status, np.full(highs.getNumCol(), np.nan), None,
+                    mip_gap)
+        self.values = np.array(highs.getSolution().col_value)
+        return status, self.values, info.objective_function_value, mip_gap
+
+    def _change(self, coefficients=None, columns=None):
+        """
+        Change coefficients & column bounds of the loaded model
+
+        :param tuple coefficients: Rows, columns & values of the changed
+            coefficients
+        :param tuple columns: Columns with changed bounds, with their lower
+            & upper bounds
+        """
+        if coefficients is not None:
+            for row, col, value in zip(*coefficients):
+                self.highs.changeCoeff(int(row), int(col), float(value))
+        if columns is not None:
+            cols, lower, upper = columns
+            self.highs.changeColsBounds(len(cols),
+                                        np.asarray(cols, dtype=np.int32),
+                                        np.asarray(lower, dtype=float),
+                                        np.asarray(upper, dtype=float))
+
+    def solve_matrix(self, c, integrality, lb, ub, a, a_lb, a_ub, msg=False,
+                     warm_start=False):
+        if a is not self.model:
+            self._load(a, c, integrality, lb, ub, a, a_lb, a_ub)
+        return self._run(msg, warm_start)
+
+    def update_matrix(self, a, coefficients=None, columns=None):
+        if a is self.model:
+            self._change(coefficients, columns)
+
+    def solve_problem(self, frame, variables, msg=False, warm_start=False):
+        if frame is not self.model:
+            self._load(frame, *problem_matrices(frame, variables))
+            self.rows = {id(constraint): row for row, constraint
+                         in enumerate(frame.constraints.values())}
+            self.columns = {variable: num
+                            for num, variable in enumerate(variables)}
+
+        status, values, objective, _ = self._run(msg, warm_start)
+        frame.status = LP_STATUS_CODES[status]
+        if objective is not None:
+            if frame.sense == pulp.LpMaximize:
+                objective = -objective
+            objective += frame.objective.constant
+        return status, values, objective
+
+    def update_problem(self, frame, coefficients=(), rows=(), columns=()):
+        if frame is not self.model:
+            return
+        self._change(
+            coefficients=([self.rows[id(constraint)]
+                           for constraint, _ in coefficients],
+                          [self.columns[variable]
+                           for _, variable in coefficients],
+                          [constraint.get(variable, 0)
+                           for constraint, variable in coefficients]),
+            columns=([self.columns[variable] for variable in columns],
+                     *_column_bounds(columns)))
+        for constraint in rows:
+            self.highs.changeRowBounds(self.rows[id(constraint)],
+                                       *_row_bounds(constraint))
+
+
+# Solver backends by name of the "solver" optimizer config
+SOLVERS = {
+    'cbc': CbcBackend,
+    'glpk': GlpkBackend,
+    'highs': HighsBackend,
+}
+
+
+def problem_matrices(frame, variables=None):
+    """
+    Export a PuLP frame as a minimization in matrix form
+
+    :param LpProblem frame: PuLP problem
+    :param list variables: Variables of the frame, in column order
+    :return tuple: Objective, integrality, column bounds, sparse constraint
+        matrix and row bounds
+    """
+    if variables is None:
+        variables = frame.variables()
+    columns = {variable: num for num, variable in enumerate(variables)}
+
+    c = np.zeros(len(variables))
+    for variable, coefficient in frame.objective.items():
+        c[columns[variable]] = coefficient
+    if frame.sense == pulp.LpMaximize:
+        c = -c
+
+    integrality = np.array([variable.cat == pulp.LpInteger
+                            for variable in variables], dtype=np.uint8)
+    lb, ub = _column_bounds(variables)
+
+    rows, cols, vals = [], [], []
+    a_lb = np.full(len(frame.constraints), -np.inf)
+    a_ub = np.full(len(frame.constraints), np.inf)
+    for row, constraint in enumerate(frame.constraints.values()):
+        for variable, coefficient in constraint.items():
+            rows.append(row)
+            cols.append(columns[variable])
+            vals.append(coefficient)
+        a_lb[row], a_ub[row] = _row_bounds(constraint)
+
+    a = sparse.csr_matrix((vals, (rows, cols)),
+                          shape=(len(a_lb), len(variables)))
+    return c, integrality, lb, ub, a, a_lb, a_ub
+
+
+def _column_bounds(variables):
+    lb = np.array([-np.inf if variable.lowBound is None
+                   else variable.lowBound for variable in variables],
+                  dtype=float)
+    ub = np.array([np.inf if variable.upBound is None
+                   else variable.upBound for variable in variables],
+                  dtype=float)
+    return lb, ub
+
+
+def _row_bounds(constraint):
+    rhs = -constraint.constant
+    lower = -np.inf if constraint.sense == pulp.LpConstraintLE else rhs
+    upper = np.inf if constraint.sense == pulp.LpConstraintGE else rhs
+    return lower, upper
+
+
+def get_solver(solver_config=None, default='cbc'):
+    """
+    Build the solver backend of an optimizer config
+
+    :param dict solver_config: "solver" entry of the optimizer config, with
+        name, threads, time_limit & mip_gap
+    :param str default: Backend used when no name is configured
+    :return SolverBackend: Solver backend
+    """
+    solver_config = dict(solver_config or {})
+    name = solver_config.pop('name', None) or default
+    try:
+        backend_class = SOLVERS[name]
+    except KeyError:
+        raise ValueError(f'Unknown solver "{name}"')
+
+    backend = backend_class(**solver_config)
+    if not backend.available():
+        raise ValueError(f'Solver "{name}" is not available')
+    return backend
@@ -0,0 +1,184 @@
+"""
+This module sweeps the LT capacity of a site for sizing studies. The model of
+every window is built once, and every capacity point only patches the SOC
+bounds and the heat leak, which scales with 1 / capacity. Each point is
+re-solved from the converged charge COP's of the previous point. Windows are
+swept in parallel, and the savings of every site, window and capacity are
+collected into one capacity to savings table.
+
+"""
+# System imports
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# 3rd party imports
+import pandas as pd
+
+# Project imports
+import batch
+import load
+from billing import calculate_savings
+from iterative_optimizer import iterate_window
+
+# Capacities of a sweep as fractions of the site's derated LT mass
+DEFAULT_SCALES = (0.5, 0.75, 1.0, 1.25, 1.5)
+
+
+def capacity_config(config, capacity):
+    """
+    Config of the site with another LT capacity
+
+    :param dict config: LT Setback Config object
+    :param float capacity: LT capacity in KWH_thermal
+    :return dict: Config with the LT & RB capacity replaced
+    """
+    return {**config, 'lt_capacity': capacity, 'optimizer_config': {
+        **config['optimizer_config'], 'RB_capacity': capacity}}
+
+
+def sweep_window(time_frame, window, config, capacities):
+    """
+    Solve a window for every capacity, reusing its model
+
+    :param time_frame: Month or date of the window
+    :param DataFrame window: Power data of the window, with the heat leak of
+        the site's capacity
+    :param dict config: LT Setback Config object
+    :param capacities: LT capacities in KWH_thermal
+    :return list: Savings, iterations & solve time of every capacity
+    """
+    base_capacity = config['lt_capacity']
+    tariff_id = config['optimizer_config']['site_id']
+    optimizer = None
+    rows = []
+    for capacity in capacities:
+        scaled = window.assign(
+            heat_leak=window['heat_leak'] * base_capacity / capacity)
+        if optimizer is not None and optimizer.update_capacity(
+                capacity, scaled['heat_leak']) is False:
+            optimizer = None
+
+        records = []
+        optimizer, target, converged = iterate_window(
+            scaled, capacity_config(config, capacity), optimizer,
+            records=records)
+        window = window.assign(cop_charge=converged['cop_charge'])
+
+        savings = calculate_savings([target], tariff_id).iloc[0]
+        rows.append({
+            'time_frame': time_frame,
+            'capacity': capacity,
+            **savings.to_dict(),
+            'iterations': len(records),
+            'solve_time': sum(record['solve_time'] for record in records),
+        })
+    print(f'Swept {len(rows)} capacities for {time_frame}')
+    return rows
+
+
+def run_sweep(power_data, config, capacities, period='month', workers=1):
+    """
+    Sweep the capacities on every window of the power data
+
+    :param DataFrame power_data: Power data with thermal info
+    :param dict config: LT Setback Config object
+    :param capacities: LT capacities in KWH_thermal
+    :param str period: Window of the sweep, 'month' or 'date'
+    :param int workers: Number of processes sweeping windows in parallel
+    :return DataFrame: Savings of every window & capacity
+    """
+    config = {**config, 'optimizer_config': {
+        **config['optimizer_config'], 'solver_msg': False}}
+    windows = [(time_frame, window) for time_frame, window
+               in power_data.groupby(period, observed=True) if len(window)]
+    if not windows:
+        return pd.DataFrame()
+
+    time_frames, frames = zip(*windows)
+    args = (time_frames, frames, repeat(config), repeat(list(capacities)))
+    if workers > 1 and len(windows) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(sweep_window, *args))
+    else:
+        results = list(map(sweep_window, *args))
+
+    table = pd.DataFrame([row for rows in results for row in rows])
+    return table.rename(columns={'time_frame': period})
+
+
+def sweep_site(site, capacities=None, scales=DEFAULT_SCALES,
+               start=batch.DEFAULT_START, end=batch.DEFAULT_END,
+               optimize_energy=False, period='month', workers=1,
+               path=batch.INPUT_PATH):
+    """
+    Capacity to savings curve of a single site
+
+    :param str site: Store name, e.g. WM3138
+    :param capacities: LT capacities in KWH_thermal, scales of the site's
+        capacity by default
+    :param scales: Fractions of the site's capacity swept by default
+    :param str start: Start time of data to analyze
+    :param str end: End time of data to analyze
+    :param bool optimize_energy: Include energy charges in the objective
+    :param str period: Window of the sweep, 'month' or 'date'
+    :param int workers: Number of processes sweeping windows in parallel
+    :param str path: Directory holding the site power files
+    :return DataFrame: Savings of every window & capacity, None if the site
+        can't be run
+    """
+    power_file = batch.find_power_file(site, path)
+    config_file = batch.find_config_file(site)
+    if power_file is None or config_file is None:
+        print(f"Can't find power data or config file for {site}")
+        return None
+
+    print(f'Sweeping site {site}')
+    power_data, master_conf = load.load_data(site, start, end, power_file,
+                                             config_file)
+    master_conf['optimize_energy'] = optimize_energy
+    if capacities is None:
+        capacities = [round(scale * master_conf['lt_capacity'], 2)
+                      for scale in scales]
+
+    table = run_sweep(power_data, master_conf, capacities, period, workers)
+    table.insert(0, 'site', site)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Sweep the LT capacity of sites for sizing studies')
+    parser.add_argument('sites', nargs='*',
+                        help='Stores to sweep, every store with data if '
+                             'empty')
+    parser.add_argument('--capacities', nargs='+', type=float,
+                        help='LT capacities in KWH_thermal')
+    parser.add_argument('--scales', nargs='+', type=float,
+                        default=list(DEFAULT_SCALES),
+                        help='Fractions of the site capacity to sweep')
+    parser.add_argument('--start', default=batch.DEFAULT_START)
+    parser.add_argument('--end', default=batch.DEFAULT_END)
+    parser.add_argument('--period', default='month',
+                        choices=['month', 'date'])
+    parser.add_argument('--optimize-energy', action='store_true')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--input', default=batch.INPUT_PATH)
+    parser.add_argument('--output', default='output/')
+    args = parser.parse_args()
+
+    sites = args.sites or [site for site in batch.get_config_stores()
+                           if batch.find_power_file(site, args.input)]
+    tables = [sweep_site(site, args.capacities, args.scales, args.start,
+                         args.end, args.optimize_energy, args.period,
+                         args.workers, args.input)
+              for site in sites]
+    tables = [table for table in tables if table is not None]
+    sweep_table = pd.concat(tables, ignore_index=True) if tables else \
+        pd.DataFrame()
+
+    os.makedirs(args.output, exist_ok=True)
+    sweep_table.to_csv(os.path.join(args.output, 'capacity_sweep.csv'),
+                       index=False)
+    print(sweep_table)
@@ -0,0 +1,150 @@
+"""
+This module holds a content-addressed store of optimized window targets. A
+window is keyed by a hash of its input slice together with a fingerprint of
+the configuration that affects its solution and a hash of the solver code,
+so a rerun only re-solves the windows whose inputs, configuration or solver
+code actually changed.
+
+"""
+# System imports
+import os
+import hashlib
+import importlib.util
+from functools import lru_cache, partial
+
+# 3rd party imports
+import numpy as np
+import pandas
+
+# Default directory of the target store
+TARGET_CACHE_PATH = '.target_cache/'
+
+# Config keys that don't change the solution of a window. The window bounds
+# are covered by the hash of the window's own input slice.
+IGNORED_KEYS = {'start', 'end', 'workers', 'solver_msg', 'target_cache'}
+
+# Modules whose code shapes the solution of a window, a change to any of
+# their sources invalidates the stored targets. The thermal inputs come from
+# load, util & thermal, and billing decides when the savings stop changing.
+CODE_MODULES = ('config', 'load', 'util', 'thermal', 'periods', 'billing',
+                'iterative_optimizer', 'lt_optimizer', 'matrix_optimizer',
+                'peak_optimizer', 'coupled_optimizer', 'rolling_horizon',
+                'convergence', 'solvers', 'tariff_calendar',
+                'optimizer_engine', 'tariff')
+
+
+@lru_cache(maxsize=None)
+def code_salt():
+    """
+    Hash the sources of CODE_MODULES, every source file of a package
+
+    :return str: Hex digest of the solver code
+    """
+    digest = hashlib.sha256()
+    for name in CODE_MODULES:
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            continue
+        files = [spec.origin]
+        if spec.submodule_search_locations:
+            files = sorted(os.path.join(root, file)
+                           for location in spec.submodule_search_locations
+                           for root, _, names in os.walk(location)
+                           for file in names if file.endswith('.py'))
+        digest.update(name.encode())
+        for file in files:
+            with open(file, 'rb') as source:
+                digest.update(source.read())
+    return digest.hexdigest()
+
+
+def fingerprint(value):
+    """
+    Build a stable, hashable representation of a config value
+
+    Functions and partials are represented by their qualified name and
+    arguments, so COP functions fingerprint the same across processes.
+
+    :param value: Config value
+    :return: Nested tuples of plain values
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((str(key), fingerprint(item))
+                            for key, item in value.items()
+                            if key not in IGNORED_KEYS))
+    if isinstance(value, (list, tuple)):
+        return tuple(fingerprint(item) for item in value)
+    if isinstance(value, partial):
+        return ('partial', fingerprint(value.func), fingerprint(value.args),
+                fingerprint(value.keywords))
+    if callable(value):
+        return (getattr(value, '__module__', None),
+                getattr(value, '__qualname__', repr(value)))
+    if isinstance(value, (pandas.DataFrame, pandas.Series)):
+        return fingerprint(pandas.util.hash_pandas_object(value).values)
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape,
+                hashlib.sha256(np.ascontiguousarray(value)).hexdigest())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def window_key(load, config):
+    """
+    Hash a window's input slice, configuration and solver code
+
+    :param DataFrame load: Power data of the window
+    :param dict config: LT Setback Config object
+    :return str: Hex digest identifying the window's solution
+    """
+    digest = hashlib.sha256()
+    digest.update(code_salt().encode())
+    digest.update(repr(list(load.columns)).encode())
+    digest.update(pandas.util.hash_pandas_object(load).values.tobytes())
+    digest.update(repr(fingerprint(config)).encode())
+    return digest.hexdigest()
+
+
+class TargetCache:
+    """Store of window targets on disk, keyed by window_key
+
+    Attributes:
+        path (str): Directory holding one pickle per window target
+    """
+
+    def __init__(self, path=TARGET_CACHE_PATH):
+        """
+        Initialize the TargetCache object.
+
+        :param str path: Directory holding the stored targets
+        """
+        self.path = path
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.pkl')
+
+    def get(self, key):
+        """
+        Fetch a stored target
+
+        :param str key: Window key
+        :return DataFrame: Stored target or None if the window isn't stored
+        """
+        try:
+            return pandas.read_pickle(self._file(key))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, target):
+        """
+        Store the target of a window
+
+        :param str key: Window key
+        :param DataFrame target: Target of the window
+        """
+        os.makedirs(self.path, exist_ok=True)
+        # Write & rename, so a crashed run never leaves a partial target
+        temp_file = self._file(key) + f'.{os.getpid()}'
+        target.to_pickle(temp_file)
+        os.replace(temp_file, self._file(key))
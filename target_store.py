@@ -0,0 +1,139 @@
+"""
+This module holds a compact container of optimized targets. Every window is
+a slice of one set of contiguous column arrays, located by a window offset
+index. Window DataFrames and per-day or per-month splits are views onto the
+same arrays, so a site's targets are held once in memory, optionally as
+float32.
+
+"""
+# 3rd party imports
+import numpy as np
+import pandas
+
+# Project imports
+from periods import period_codes
+
+
+class TargetStore:
+    """Contiguous column arrays of a set of target windows
+
+    The store is a sequence of target DataFrames, so it can be passed
+    wherever a list of targets is expected.
+
+    Attributes:
+        timestamps (ndarray): UTC nanoseconds of every interval
+        tz: Timezone of the timestamps
+        columns (dict): Column name to array of every interval
+        offsets (ndarray): Start of every window & end of the last window
+    """
+
+    def __init__(self, timestamps, tz, columns, offsets):
+        """
+        Initialize the TargetStore object.
+
+        :param ndarray timestamps: UTC nanoseconds of every interval
+        :param tz: Timezone of the timestamps
+        :param dict columns: Column name to array of every interval
+        :param offsets: Start of every window & end of the last window
+        """
+        self.timestamps = timestamps
+        self.tz = tz
+        self.columns = columns
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_targets(cls, targets, dtype=np.float64):
+        """
+        Pack target DataFrames into one store
+
+        :param targets: Iterable of target DataFrames with the same columns
+        :param dtype: Float type of the numeric columns, e.g. np.float32
+        :return TargetStore: Store of the targets
+        """
+        targets = list(targets)
+        if not targets:
+            raise ValueError('Can\'t build a target store without targets')
+
+        first = targets[0]
+        columns = {}
+        for column in first.columns:
+            values = [target[column].to_numpy() for target in targets]
+            if pandas.api.types.is_numeric_dtype(first[column]):
+                columns[column] = np.concatenate(values).astype(dtype,
+                                                                copy=False)
+            else:
+                columns[column] = np.concatenate(values)
+
+        timestamps = np.concatenate([target.index.asi8 for target in targets])
+        offsets = np.cumsum([0] + [len(target) for target in targets])
+        return cls(timestamps, first.index.tz, columns, offsets)
+
+    @property
+    def index(self):
+        """Timestamps of every interval of the store"""
+        return self._index(0, len(self.timestamps))
+
+    def _index(self, start, stop):
+        values = self.timestamps[start:stop].view('M8[ns]')
+        if self.tz is None:
+            return pandas.DatetimeIndex(values, name='timestamp')
+        return pandas.DatetimeIndex(
+            pandas.arrays.DatetimeArray(
+                values, dtype=pandas.DatetimeTZDtype(tz=self.tz)),
+            name='timestamp')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                raise ValueError('Target store slices must be contiguous')
+            return TargetStore(self.timestamps, self.tz, self.columns,
+                               self.offsets[start:max(start, stop) + 1])
+
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('Target store index out of range')
+
+        start, stop = self.offsets[item], self.offsets[item + 1]
+        return pandas.DataFrame(
+            {column: values[start:stop]
+             for column, values in self.columns.items()},
+            index=self._index(start, stop), copy=False)
+
+    def __iter__(self):
+        for num in range(len(self)):
+            yield self[num]
+
+    def split(self, period):
+        """
+        View the intervals of the store as windows of months or days
+
+        Windows never span two windows of the store.
+
+        :param str period: 'month' or 'date'
+        :return TargetStore: Store sharing the arrays of this store
+        """
+        start, stop = self.offsets[0], self.offsets[-1]
+        codes = np.asarray(period_codes(self._index(start, stop),
+                                        period).codes)
+        boundaries = np.flatnonzero(np.diff(codes)) + 1 + start
+        offsets = np.union1d(self.offsets, boundaries)
+        return TargetStore(self.timestamps, self.tz, self.columns, offsets)
+
+    def by_day(self):
+        """Per-day view of the store"""
+        return self.split('date')
+
+    def by_month(self):
+        """Per-month view of the store"""
+        return self.split('month')
+
+    @property
+    def nbytes(self):
+        """Memory held by the arrays of the store"""
+        return self.timestamps.nbytes + sum(
+            values.nbytes for values in self.columns.values())
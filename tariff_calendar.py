@@ -0,0 +1,64 @@
+"""
+This module precomputes the tariff calendar of an optimization window. The
+season, period and energy rate of every interval are derived once per
+(tariff, timestamp index) and shared by every optimizer built over the same
+window, including every iterative re-solve.
+
+"""
+# System imports
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+
+# 3rd party imports
+import pandas
+from tariff import Tariff
+
+# Maximum number of windows kept in the calendar cache
+CACHE_SIZE = 1024
+
+TariffCalendar = namedtuple('TariffCalendar',
+                            ['season', 'period', 'energy_tariff'])
+
+_calendars = OrderedDict()
+
+
+@lru_cache(maxsize=None)
+def get_tariff(tariff_id):
+    """
+    Fetch a shared Tariff object for a tariff id
+
+    :param str tariff_id: Tariff id
+    :return Tariff: Tariff object
+    """
+    return Tariff(tariff_id)
+
+
+def get_tariff_calendar(tariff_id, timestamps):
+    """
+    Fetch the season, period and energy rate arrays of a window
+
+    The window is identified by its first & last timestamps and its length,
+    which is unique for a fixed interval timestamp index.
+
+    :param str tariff_id: Tariff id
+    :param timestamps: Timestamps of every interval of the window
+    :return TariffCalendar: season, period & energy_tariff arrays
+    """
+    timestamps = pandas.DatetimeIndex(timestamps)
+    key = (tariff_id, timestamps[0], timestamps[-1], len(timestamps))
+    if key in _calendars:
+        _calendars.move_to_end(key)
+        return _calendars[key]
+
+    tariff = get_tariff(tariff_id)
+    frame = pandas.DataFrame({'timestamp': timestamps}, index=timestamps)
+    calendar = TariffCalendar(
+        season=tariff.apply_season(frame)['season'].values,
+        period=tariff.apply_period(load=frame)['period'].values,
+        energy_tariff=tariff.apply_energy_rates(
+            frame)['energy_tariff'].values.astype(float))
+
+    _calendars[key] = calendar
+    if len(_calendars) > CACHE_SIZE:
+        _calendars.popitem(last=False)
+    return calendar
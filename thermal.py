@@ -0,0 +1,127 @@
+"""
+This module holds the vectorized thermal model of the LT system. OAT
+conversion, COP curves, charge & discharge limits, heat leak and the
+SOC to SST line are linear formulas evaluated on whole arrays at once.
+
+"""
+# 3rd party imports
+import numpy as np
+
+# Master COP equation coefficients, COP = a * SST + b * OAT + c (in C)
+COP_SST_COEFFICIENT = 0.03365441
+COP_OAT_COEFFICIENT = -0.03725518
+COP_INTERCEPT = 3.681996189703361 + 0.35
+
+
+def to_celsius(temperature):
+    """
+    Convert temperatures from farenheit to celsius
+
+    :param temperature: Temperature(s) in F
+    :return: Temperature(s) in C
+    """
+    return (temperature - 32) * 5 / 9
+
+
+def to_farenheit(temperature):
+    """
+    Convert temperatures from celsius to farenheit
+
+    :param temperature: Temperature(s) in C
+    :return: Temperature(s) in F
+    """
+    return temperature * 9 / 5 + 32
+
+
+def master_cop_eq(sst, oat):
+    """
+    COP of the LT system at a saturated suction & outside air temperature
+
+    :param sst: SST(s) in C
+    :param oat: OAT(s) in C
+    :return: COP(s)
+    """
+    return COP_SST_COEFFICIENT * sst + COP_OAT_COEFFICIENT * oat + \
+        COP_INTERCEPT
+
+
+def sst_line(config):
+    """
+    Slope & intercept of the linear SOC to SST (in C) relationship
+
+    SST is at its max with an empty tank and at its min with a full tank.
+
+    :param dict config: LT Setback Config object
+    :return tuple: Slope & intercept
+    """
+    sst_min_c = to_celsius(config['sst_min_f'])
+    sst_max_c = to_celsius(config['sst_max_f'])
+
+    m = (sst_max_c - sst_min_c) / (0 - config['lt_capacity'])
+    c = sst_min_c - m * config['lt_capacity']
+    return m, c
+
+
+def get_sst(soc, config):
+    """
+    SST (in C) for every SOC
+
+    :param soc: SOC values, a Series keeps its index
+    :param dict config: LT Setback Config object
+    :return: SST values
+    """
+    m, c = sst_line(config)
+    return m * soc + c
+
+
+def get_charge_cop(sst, oat):
+    """
+    Charge COP for every interval
+
+    :param sst: SST of every interval in C
+    :param oat: OAT of every interval in C
+    :return ndarray: Charge COP's
+    """
+    return master_cop_eq(np.asarray(sst, dtype=float),
+                         np.asarray(oat, dtype=float))
+
+
+def get_heat_leak(discharge_limits, oat_c, config):
+    """
+    Heat leak for every interval, as a fraction of the tank capacity
+
+    :param discharge_limits: Discharge limits of every interval
+    :param oat_c: OAT of every interval in C
+    :param dict config: LT Setback Config object
+    :return ndarray: Heat leak values
+    """
+    cop_heat_leak = config['cop_max_sst'](np.asarray(oat_c, dtype=float))
+    heat_load = np.asarray(discharge_limits, dtype=float) * cop_heat_leak
+    return heat_load * config['sst_factor'] / config['lt_capacity']
+
+
+def get_thermal_info(df, config):
+    """
+    Compute every thermal input of the optimizer in one pass
+
+    :param DataFrame df: Power data with temperature (F) & crs_baseline
+    :param dict config: LT Setback Config object
+    :return dict: oat_c, cop_charge, cop_discharge, charge_limits,
+        discharge_limits & heat_leak arrays
+    """
+    oat_c = to_celsius(df['temperature'].to_numpy(dtype=float))
+    crs = df['crs_baseline'].to_numpy(dtype=float)
+
+    # COP at max SST for both charge (iterated later) & discharge
+    cop = config['cop_max_sst'](oat_c)
+    charge_limits = config['optimizer_config']['MRC'] - crs
+    discharge_limits = crs
+
+    return {
+        'oat_c': oat_c,
+        'cop_charge': cop,
+        'cop_discharge': cop.copy(),
+        'charge_limits': charge_limits,
+        'discharge_limits': discharge_limits,
+        'heat_leak': get_heat_leak(discharge_limits, oat_c, config),
+    }